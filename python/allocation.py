@@ -1,7 +1,12 @@
-import arcpy
+import multiprocessing
 import pandas as pd
 import numpy as np
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from tod import Kernels
+from tod.HandyGP import dfToArray
+from tod.LazyImport import arcpy
 
 """
 read in parcels as parcels_df
@@ -15,6 +20,104 @@ for segment in segments:
         update dict 
 """
 
+# activities allocated by `allocate_dict`/`allocate_array`, in the order of the
+#  capacity fields passed as `suit_cap_fields`
+ALLOC_ACTIVITIES = ["SF", "MF", "Ret", "Ind", "Off", "Hot"]
+
+
+def _segment_pool(workers=None, mode="process"):
+    """
+    workers: Integer, optional
+        Number of workers; None or 1 runs segments serially
+    mode: String, default="process"
+        "process" for a process pool, "thread" for a thread pool
+
+    Returns a pool for segment-parallel allocation (None to run serially).
+    Process pools must be started from a script guarded by
+    `if __name__ == "__main__"` (see `multiprocessing`).
+    """
+    if not workers or workers == 1:
+        return None
+    if mode == "thread":
+        return ThreadPool(workers)
+    if mode == "process":
+        return multiprocessing.Pool(workers)
+    raise ValueError("Unknown segment pool mode {} (use 'process' or 'thread')".format(mode))
+
+
+def _map_segments(pool, func, tasks, sizes):
+    """
+    results of `func` for each task, in task order; with a pool the largest
+    tasks (by `sizes`) are dispatched first so long segments do not finish last
+    """
+    if pool is None:
+        return [func(task) for task in tasks]
+    order = sorted(range(len(tasks)), key=lambda i: -sizes[i])
+    results = [None] * len(tasks)
+    for i, result in zip(order, pool.map(func, [tasks[i] for i in order], chunksize=1)):
+        results[i] = result
+    return results
+
+
+def _allocate_segment(task):
+    """
+    allocate one segment's parcels in suitability order, decrementing the
+    segment's controls (see `allocate_dict`); returns (filled rows, remaining controls)
+    """
+    segment, group, suit_df_seg_field, suit_cap_fields, seg_controls = task
+    (
+        sfr_sqft_cap,
+        mfr_sqft_cap,
+        ret_sqft_cap,
+        ind_sqft_cap,
+        off_sqft_cap,
+        hot_sqft_cap,
+    ) = suit_cap_fields
+
+    filled_rows = {}
+    print("Calculating allocation for segment --> {}".format(segment))
+    print ("...segment controls start: {}".format(seg_controls))
+    # iterate over parcel rows
+    for parcel_id, row in group.iterrows():
+        new_row = {suit_df_seg_field: segment}
+        parcel_count = OrderedDict(
+            {
+                "SF": row[sfr_sqft_cap],
+                "MF": row[mfr_sqft_cap],
+                "Ret": row[ret_sqft_cap],
+                "Ind": row[ind_sqft_cap],
+                "Off": row[off_sqft_cap],
+                "Hot": row[hot_sqft_cap],
+            }
+        )
+        for act_key in parcel_count.keys():
+            alloc_att = "{}_SF_{}".format(act_key, "alloc")
+            # get segment activity control val, if control is 0 set lu allocation to 0
+            segment_act_control = int(seg_controls[act_key])
+            if segment_act_control == 0:
+                new_row[alloc_att] = 0
+                continue
+            # get parcel activity capacity val (ie fill_to_val), if parcel_cap is 0 set alloc to 0
+            parcel_act_ccap = int(parcel_count[act_key])
+            if parcel_act_ccap == 0:
+                new_row[alloc_att] = 0
+                continue
+            # calculate updated control
+            updated_act_control = int(segment_act_control - parcel_act_ccap)
+            # if new control  is negative,
+            #   reset activity control and parcel allocations
+            if updated_act_control < 0:
+                dist = updated_act_control * -1
+                updated_act_control += dist
+                parcel_act_ccap -= dist
+            seg_controls[act_key] = updated_act_control  # update activity control to reflect allocation
+            new_row[alloc_att] = parcel_act_ccap  # add
+
+        # add new row to filled dict
+        filled_rows[parcel_id] = new_row
+    print ("...segment controls end: {}".format(seg_controls))
+    return filled_rows, seg_controls
+
 
 def allocate_dict(
         suit_df,
@@ -23,67 +126,42 @@ def allocate_dict(
         suit_df_seg_field,
         suit_cap_fields,
         control_dict,
+        workers=None,
+        mode="process",
 ):
+    """
+    Allocates each segment's control totals (`control_dict`) to its parcels in
+    descending suitability order, filling each parcel's capacity until the
+    segment's control is exhausted. `control_dict` is updated to the
+    remaining control totals.
+
+    Segments are independent, so they can be allocated in parallel by
+    `workers` processes or threads (`mode`, see `_segment_pool`); results are
+    merged in segment order and match the serial run exactly.
+    """
     # sort data by segment and suitability descending
     suit_df.sort_values(
         by=[suit_df_seg_field, suit_field], ascending=False, inplace=True
     )
 
-    (
-        sfr_sqft_cap,
-        mfr_sqft_cap,
-        ret_sqft_cap,
-        ind_sqft_cap,
-        off_sqft_cap,
-        hot_sqft_cap,
-    ) = suit_cap_fields
+    # one task per segment, with only the fields the allocation reads
+    tasks = [
+        (segment, group[suit_cap_fields], suit_df_seg_field, suit_cap_fields, control_dict[segment])
+        for segment, group in suit_df.groupby(suit_df_seg_field)
+    ]
+    pool = _segment_pool(workers, mode)
+    try:
+        results = _map_segments(pool, _allocate_segment, tasks, [len(task[1]) for task in tasks])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     filled_rows = {}
-    # loop over segments and create control dictionary
-    for segment, group in suit_df.groupby(suit_df_seg_field):
-        seg_controls = control_dict[segment]
-        print("Calculating allocation for segment --> {}".format(segment))
-        print ("...segment controls start: {}".format(seg_controls))
-        # iterate over parcel rows
-        count = 0
-        for parcel_id, row in group.iterrows():
-            new_row = {suit_df_seg_field: segment}
-            parcel_count = OrderedDict(
-                {
-                    "SF": row[sfr_sqft_cap],
-                    "MF": row[mfr_sqft_cap],
-                    "Ret": row[ret_sqft_cap],
-                    "Ind": row[ind_sqft_cap],
-                    "Off": row[off_sqft_cap],
-                    "Hot": row[hot_sqft_cap],
-                }
-            )
-            for act_key in parcel_count.keys():
-                alloc_att = "{}_SF_{}".format(act_key, "alloc")
-                # get segment activity control val, if control is 0 set lu allocation to 0
-                segment_act_control = int(seg_controls[act_key])
-                if segment_act_control == 0:
-                    new_row[alloc_att] = 0
-                    continue
-                # get parcel activity capacity val (ie fill_to_val), if parcel_cap is 0 set alloc to 0
-                parcel_act_ccap = int(parcel_count[act_key])
-                if parcel_act_ccap == 0:
-                    new_row[alloc_att] = 0
-                    continue
-                # calculate updated control
-                updated_act_control = int(segment_act_control - parcel_act_ccap)
-                # if new control  is negative,
-                #   reset activity control and parcel allocations
-                if updated_act_control < 0:
-                    dist = updated_act_control * -1
-                    updated_act_control += dist
-                    parcel_act_ccap -= dist
-                seg_controls[act_key] = updated_act_control  # update activity control to reflect allocation
-                new_row[alloc_att] = parcel_act_ccap  # add
-
-            # add new row to filled dict
-            filled_rows[parcel_id] = new_row
-        print ("...segment controls end: {}".format(seg_controls))
+    for task, (seg_rows, seg_controls) in zip(tasks, results):
+        filled_rows.update(seg_rows)
+        # workers update copies of the segment controls
+        control_dict[task[0]].update(seg_controls)
 
     filled_df = (
         pd.DataFrame(filled_rows)
@@ -94,6 +172,257 @@ def allocate_dict(
     return filled_df
 
 
+def _fill_segments(seg_idx, caps, controls):
+    """
+    Vectorized form of the running control decrement in `allocate_dict`.
+
+    seg_idx: (n,) int array
+        Segment position (row in `controls`) of each recipient. Recipients must
+        be grouped by segment and ordered for allocation (suitability descending)
+        within each segment.
+    caps: (n, k) int array
+        Non-negative capacity of each recipient for each activity.
+    controls: (s, k) int array
+        Control total of each segment for each activity.
+
+    Returns an (n, k) int array of allocated values. Within a segment each
+    recipient receives its full capacity until the control is exhausted, the
+    last recipient receives the remainder and all others receive nothing.
+    If numba is installed the compiled loop `Kernels.fillSegments` is used.
+    """
+    if Kernels.NUMBA:
+        return Kernels.fillSegments(
+            np.asarray(seg_idx), np.asarray(caps, dtype=np.int64), np.asarray(controls, dtype=np.int64)
+        )
+    caps = np.asarray(caps, dtype=np.int64)
+    controls = np.asarray(controls, dtype=np.int64)
+    seg_idx = np.asarray(seg_idx)
+    if len(seg_idx) == 0:
+        return np.zeros(caps.shape, dtype=np.int64)
+    # cumulative capacity of the recipients ahead of each recipient in its segment
+    cumu = np.cumsum(caps, axis=0)
+    seg_start = np.r_[True, seg_idx[1:] != seg_idx[:-1]]
+    start_rows = np.flatnonzero(seg_start)
+    offsets = (cumu - caps)[start_rows]
+    run_id = np.cumsum(seg_start) - 1
+    prev = cumu - caps - offsets[run_id]
+    ctrl = controls[seg_idx]
+    alloc = np.minimum(caps, np.maximum(ctrl - prev, 0))
+    # negative controls are handed entirely to the first recipient with capacity
+    neg = ctrl < 0
+    if neg.any():
+        first = np.logical_and(prev == 0, caps > 0)
+        alloc = np.where(neg, np.where(first, ctrl, 0), alloc)
+    return alloc
+
+
+def _segment_arrays(suit_df, suit_field, suit_df_seg_field, suit_cap_fields, control_dict):
+    """
+    sort `suit_df` for allocation and return (suit_df, order, segments,
+    seg_idx, caps, controls) as used by `_fill_segments`, where `order` maps
+    the rows of the arrays to the rows of the returned `suit_df`
+    """
+    suit_df.sort_values(
+        by=[suit_df_seg_field, suit_field], ascending=False, inplace=True
+    )
+    suit_df = suit_df[suit_df[suit_df_seg_field].notnull()]
+    segments, seg_idx = np.unique(suit_df[suit_df_seg_field].values, return_inverse=True)
+    # regroup segments in ascending order, keeping the suitability order within each
+    order = np.argsort(seg_idx, kind="mergesort")
+    seg_idx = seg_idx[order]
+    caps = np.trunc(suit_df[suit_cap_fields].values[order]).astype(np.int64)
+    controls = np.trunc(
+        np.array(
+            [[control_dict[seg][act] for act in ALLOC_ACTIVITIES] for seg in segments],
+            dtype=float,
+        )
+    ).astype(np.int64)
+    return suit_df, order, segments, seg_idx, caps, controls
+
+
+def _segment_totals(seg_idx, alloc, n_segments):
+    """(s, k) int array of the allocated values summed by segment"""
+    return np.array(
+        [np.bincount(seg_idx, weights=alloc[:, j], minlength=n_segments)
+         for j in range(alloc.shape[1])]
+    ).T.astype(np.int64).reshape(n_segments, alloc.shape[1])
+
+
+def _filled_frame(suit_df, suit_id_field, order, segments, seg_idx, alloc, controls, control_dict):
+    """update `control_dict` to the remaining controls and return the allocation data frame"""
+    remaining = controls - _segment_totals(seg_idx, alloc, len(segments))
+    for seg, seg_remaining in zip(segments, remaining):
+        print("...segment {} controls end: {}".format(seg, seg_remaining.tolist()))
+        for act, val in zip(ALLOC_ACTIVITIES, seg_remaining):
+            control_dict[seg][act] = int(val)
+
+    alloc_fields = ["{}_SF_{}".format(act, "alloc") for act in ALLOC_ACTIVITIES]
+    filled_df = pd.DataFrame(alloc, columns=alloc_fields)
+    filled_df.insert(0, suit_id_field, suit_df.index.values[order])
+    return filled_df
+
+
+def allocate_array(
+        suit_df,
+        suit_id_field,
+        suit_field,
+        suit_df_seg_field,
+        suit_cap_fields,
+        control_dict,
+):
+    """
+    Array-based equivalent of `allocate_dict`, taking the same arguments and
+    returning the same data frame of `{activity}_SF_alloc` values. Capacities
+    and controls are truncated to integers as in `allocate_dict`, and
+    `control_dict` is updated to the remaining control totals.
+    """
+    suit_df, order, segments, seg_idx, caps, controls = _segment_arrays(
+        suit_df, suit_field, suit_df_seg_field, suit_cap_fields, control_dict
+    )
+    alloc = _fill_segments(seg_idx, caps, controls)
+    return _filled_frame(
+        suit_df, suit_id_field, order, segments, seg_idx, alloc, controls, control_dict
+    )
+
+
+def allocate_spillover(
+        suit_df,
+        suit_id_field,
+        suit_field,
+        suit_df_seg_field,
+        suit_cap_fields,
+        control_dict,
+        graph,
+        boost=0.1,
+        round_share=0.05,
+):
+    """
+    Variant of `allocate_array` in which development spills over to
+    neighboring parcels: allocation proceeds in rounds, and after each round
+    the effective suitability of every parcel not yet visited is raised by
+    `boost` times the share of its neighbors that have received an allocation:
+
+        effective = suitability + boost * W.dot(allocated) * (suitability > 0)
+
+    where `W` is the row-normalized contiguity graph. Only parcels with a
+    positive suitability are boosted, so spillover never lifts unsuitable
+    (zero or negative suitability) parcels above suitable ones. Each round
+    visits the `round_share` most suitable (effective) parcels of each segment
+    with control remaining, in order, filling them as `allocate_array` does.
+    Each round costs one sparse product and one sort of the remaining
+    parcels, so a run is roughly linear in the number of parcels and edges.
+
+    suit_df, suit_id_field, suit_field, suit_df_seg_field, suit_cap_fields,
+    control_dict:
+        See `allocate_dict`; the index of `suit_df` holds the parcel ids
+    graph: contiguity.ContiguityGraph
+        Parcel neighbors (ids matching the index of `suit_df`); parcels
+        missing from the graph have no neighbors
+    boost: Number, default=0.1
+        Suitability added for a parcel whose neighbors have all been
+        allocated development (in the units of `suit_field`); with 0 the
+        result equals `allocate_array`
+    round_share: Number, default=0.05
+        Share of each segment's parcels visited per round (0 < share <= 1);
+        smaller shares let spillover build up more gradually
+
+    Returns the same data frame as `allocate_array` and updates `control_dict`
+    to the remaining control totals.
+    """
+    if not 0 < round_share <= 1:
+        raise ValueError("round_share must be in (0, 1], got {}".format(round_share))
+    suit_df, order, segments, seg_idx, caps, controls = _segment_arrays(
+        suit_df, suit_field, suit_df_seg_field, suit_cap_fields, control_dict
+    )
+    n = len(seg_idx)
+    W = graph.reindex(suit_df.index.values[order]).row_normalized()
+    suit = suit_df[suit_field].values[order].astype(float)
+    suitable = suit > 0
+    # parcels per segment visited each round
+    quota = np.ceil(np.bincount(seg_idx, minlength=len(segments)) * round_share).astype(np.int64)
+    # the order of `allocate_array` breaks ties in effective suitability
+    base_rank = np.arange(n)
+
+    alloc = np.zeros(caps.shape, dtype=np.int64)
+    remaining = controls.copy()
+    visited = np.zeros(n, dtype=bool)
+    effective = suit
+    while True:
+        active = (remaining != 0).any(axis=1)
+        cand = np.flatnonzero(~visited & active[seg_idx])
+        if len(cand) == 0:
+            break
+        # rank candidates by segment, then effective suitability descending
+        cand = cand[np.lexsort((base_rank[cand], -effective[cand], seg_idx[cand]))]
+        cand_seg = seg_idx[cand]
+        seg_start = np.r_[True, cand_seg[1:] != cand_seg[:-1]]
+        start_rows = np.flatnonzero(seg_start)
+        pos = np.arange(len(cand)) - start_rows[np.cumsum(seg_start) - 1]
+        take = cand[pos < quota[cand_seg]]
+
+        round_alloc = _fill_segments(seg_idx[take], caps[take], remaining)
+        alloc[take] = round_alloc
+        remaining -= _segment_totals(seg_idx[take], round_alloc, len(segments))
+        visited[take] = True
+        if boost:
+            allocated = (alloc != 0).any(axis=1).astype(float)
+            effective = suit + boost * W.dot(allocated) * suitable
+
+    return _filled_frame(
+        suit_df, suit_id_field, order, segments, seg_idx, alloc, controls, control_dict
+    )
+
+
+def _allocate_df_slice(task):
+    """
+    allocate one segment's control for one activity (see `allocate_df`);
+    returns (allocation column, total allocated, unallocated)
+    """
+    ctrl, suit_df_slc, cap_field, alloc_field = task
+    cumu_field = "{}_cumu".format(cap_field)
+
+    # TODO: make sure it isn't empty?
+
+    # Calculate the cumulative capacity row-by-row for recips in this seg
+    suit_df_slc[cumu_field] = suit_df_slc[cap_field].cumsum()
+
+    # Include recip_slc rows with cumulative cap < ctrl
+    crit = suit_df_slc[cumu_field] - suit_df_slc[cap_field] < ctrl
+
+    # Tag rows for allocation
+    suit_df_slc["__is_alloc__"] = np.select([crit], [1.0], 0.0)
+
+    # Calculate an allocation column
+    suit_df_slc[alloc_field] = suit_df_slc.__is_alloc__ * suit_df_slc[cap_field]
+
+    # Update the cumu field
+    suit_df_slc[cumu_field] *= suit_df_slc.__is_alloc__
+
+    # Identify the last recip that could be filled
+    if not len(suit_df_slc[crit][cumu_field]) == 0:
+        last_recip = suit_df_slc[crit][cumu_field].argmax()
+    # last_recip = recips_slc.index[last_recip]
+
+    # Check to see if the allocated quantity exceeds the ctrl
+    alloc = suit_df_slc[alloc_field].sum()
+    if alloc > ctrl:
+        # Revise the last recipient's total down by the difference
+        diff = alloc - ctrl
+        # recips_slc.iloc[last_recip][alloc_field] -= diff
+        suit_df_slc.at[last_recip, alloc_field] -= diff
+        unalloc = 0
+        tot_alloc = ctrl
+    elif alloc < ctrl:
+        # All the allocation totals are retained, but some portion
+        #  remains unallocated
+        unalloc = ctrl - alloc
+        tot_alloc = alloc
+    else:
+        unalloc = 0
+        tot_alloc = alloc
+    return suit_df_slc[alloc_field], tot_alloc, unalloc
+
+
 def allocate_df(
         control_df,
         control_fields,
@@ -101,6 +430,8 @@ def allocate_df(
         suit_df_cap_fields,
         suit_df_seg_field,
         suit_field,
+        workers=None,
+        mode="process",
 ):
     """
 
@@ -111,6 +442,9 @@ def allocate_df(
     :param suit_df_cap_fields: capacity fields of suitability features
     :param suit_df_seg_field: field identifying the segment of a feature
     :param suit_field: suitabiility field
+    :param workers: number of processes or threads allocating an activity's segments in
+        parallel (None or 1 runs serially); results are merged in segment order
+    :param mode: "process" or "thread" pool (see `_segment_pool`)
     :return: pandas dataframe unique id, allocated units and unallocated units by activity.
     """
 
@@ -120,76 +454,45 @@ def allocate_df(
 
     # apply segment limits
     alloc_cols = []
-    for cap_field, ctrl_field in zip(suit_df_cap_fields, control_fields):
-        # Get field specs
-        cumu_field = "{}_cumu".format(cap_field)
-        alloc_field = "{}_alloc".format(ctrl_field)
-        unalloc_field = "{}_unalloc".format(ctrl_field)
-
-        # Add the unalloc columns
-        control_df[alloc_field] = 0
-        control_df[unalloc_field] = 0
-
-        seg_alloc_cols = []
-        # Iterate over segments
-        for seg, ctrl_row in control_df.iterrows():
-            ctrl = ctrl_row[ctrl_field]
-
-            # Take a slice from recips for this seg and this cap field
+    pool = _segment_pool(workers, mode)
+    try:
+        for cap_field, ctrl_field in zip(suit_df_cap_fields, control_fields):
+            # Get field specs
+            alloc_field = "{}_alloc".format(ctrl_field)
+            unalloc_field = "{}_unalloc".format(ctrl_field)
+
+            # Add the unalloc columns
+            control_df[alloc_field] = 0
+            control_df[unalloc_field] = 0
+
+            # Take a slice from recips for each seg and this cap field
             slc_fields = [suit_df_seg_field, cap_field]
-            slc = suit_df_sorted[suit_df_seg_field] == seg
-            suit_df_slc = suit_df_sorted[slc][slc_fields].copy()
-
-            # TODO: make sure it isn't empty?
-
-            # Calculate the cumulative capacity row-by-row for recips in this seg
-            suit_df_slc[cumu_field] = suit_df_slc[cap_field].cumsum()
-
-            # Include recip_slc rows with cumulative cap < ctrl
-            crit = suit_df_slc[cumu_field] - suit_df_slc[cap_field] < ctrl
-
-            # Tag rows for allocation
-            suit_df_slc["__is_alloc__"] = np.select([crit], [1.0], 0.0)
-
-            # Calculate an allocation column
-            suit_df_slc[alloc_field] = suit_df_slc.__is_alloc__ * suit_df_slc[cap_field]
-
-            # Update the cumu field
-            suit_df_slc[cumu_field] *= suit_df_slc.__is_alloc__
-
-            # Identify the last recip that could be filled
-            if not len(suit_df_slc[crit][cumu_field]) == 0:
-                last_recip = suit_df_slc[crit][cumu_field].argmax()
-            # last_recip = recips_slc.index[last_recip]
-
-            # Check to see if the allocated quantity exceeds the ctrl
-            alloc = suit_df_slc[alloc_field].sum()
-            if alloc > ctrl:
-                # Revise the last recipient's total down by the difference
-                diff = alloc - ctrl
-                # recips_slc.iloc[last_recip][alloc_field] -= diff
-                suit_df_slc.at[last_recip, alloc_field] -= diff
-                unalloc = 0
-                tot_alloc = ctrl
-            elif alloc < ctrl:
-                # All the allocation totals are retained, but some portion
-                #  remains unallocated
-                unalloc = ctrl - alloc
-                tot_alloc = alloc
-            else:
-                unalloc = 0
-                tot_alloc = alloc
-
-            # Record results for this control/seg
-            ctrl_row[alloc_field] = tot_alloc
-            ctrl_row[unalloc_field] = unalloc
-            seg_alloc_cols.append(suit_df_slc[alloc_field])
-
-        # Combine results for all segs
-        seg_alloc_col = pd.concat(seg_alloc_cols)
-
-        # Record the result
-        alloc_cols.append(seg_alloc_col)
+            ctrl_rows = []
+            tasks = []
+            for seg, ctrl_row in control_df.iterrows():
+                slc = suit_df_sorted[suit_df_seg_field] == seg
+                ctrl_rows.append(ctrl_row)
+                tasks.append(
+                    (ctrl_row[ctrl_field], suit_df_sorted[slc][slc_fields].copy(), cap_field, alloc_field)
+                )
+            results = _map_segments(pool, _allocate_df_slice, tasks, [len(task[1]) for task in tasks])
+
+            seg_alloc_cols = []
+            for ctrl_row, (seg_alloc_col, tot_alloc, unalloc) in zip(ctrl_rows, results):
+                # Record results for this control/seg
+                ctrl_row[alloc_field] = tot_alloc
+                ctrl_row[unalloc_field] = unalloc
+                seg_alloc_cols.append(seg_alloc_col)
+
+            # Combine results for all segs
+            seg_alloc_col = pd.concat(seg_alloc_cols)
+
+            # Record the result
+            alloc_cols.append(seg_alloc_col)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     result = pd.concat(alloc_cols, axis=1)
     # TODO: sort out why result is 3x bigger than suit_df_sorted
@@ -229,10 +532,9 @@ if __name__ == "__main__":
         suit_df_seg_field=seg_field,
         suit_cap_fields=cap_fields,
         control_dict=ctl_dict,
+        workers=multiprocessing.cpu_count(),
     )
-    out_array = np.array(np.rec.fromrecords(allocation_dict.values))
-    names = allocation_dict.dtypes.index.tolist()
-    out_array.dtype.names = tuple(names)
+    out_array = dfToArray(allocation_dict)
     arcpy.da.NumPyArrayToTable(
         out_array,
         r"K:\Projects\BCDCOG\Features\Files_For_RDB\RDB_V3\tables\allocation.csv",
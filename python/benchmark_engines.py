@@ -0,0 +1,411 @@
+"""
+Engine benchmarks
+
+Times the allocation and TOD template engines on synthetic corridors (see
+`synthetic`) from 1k to 1M parcels, without source data:
+
+    python benchmark_engines.py
+    python benchmark_engines.py --engines allocate_dict allocate_array --sizes 1000 100000
+    python benchmark_engines.py --compare
+
+Each engine/size case runs in a fresh worker process, so the reported peak
+memory belongs to that case alone. A case builds the corridor, then runs the
+engine `--repeat` times on fresh copies of its inputs (engines modify their
+inputs), with the random generators seeded identically each time. Results are
+appended to a JSON-lines file (`--out`) with the current git commit, so
+throughput and memory can be tracked across commits with `--compare`.
+
+Engines whose run time grows much faster than the parcel count (per-row
+pandas loops, one-unit-at-a-time random draws) are limited to the sizes in
+`Engine.max_parcels` unless `--no-limits` is given.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from run_report import peak_rss_mb
+from synthetic import CAP_FIELDS, ID_FIELD, SEG_FIELD, SUIT_FIELD, make_corridor
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+SIZES = [1000, 10000, 100000, 1000000]
+# SmartAlloc allocates one unit at a time, so unit totals are scaled down
+SMART_ALLOC_UNITS_SCALE = 0.1
+
+
+class Engine(object):
+    """
+    name: String
+    setup: callable
+        Takes a `SyntheticCorridor` and returns a callable that runs the engine
+        once on new copies of its inputs. Engine modules are imported here, so
+        import time is not included in the timings.
+    max_parcels: Integer, optional
+        Largest corridor the engine is run on (unless limits are disabled)
+    """
+
+    def __init__(self, name, setup, max_parcels=None):
+        self.name = name
+        self.setup = setup
+        self.max_parcels = max_parcels
+
+
+def _allocate_dict(corridor):
+    from allocation import allocate_dict
+    suit_df, controls = corridor.suit_df(), corridor.control_dict()
+    return lambda: allocate_dict(
+        suit_df, ID_FIELD, SUIT_FIELD, SEG_FIELD, CAP_FIELDS, controls
+    )
+
+
+def _allocate_array(corridor):
+    from allocation import allocate_array
+    suit_df, controls = corridor.suit_df(), corridor.control_dict()
+    return lambda: allocate_array(
+        suit_df, ID_FIELD, SUIT_FIELD, SEG_FIELD, CAP_FIELDS, controls
+    )
+
+
+def _allocate_df(corridor):
+    from allocation import allocate_df
+    from synthetic import ACTIVITIES
+    suit_df, control_df = corridor.suit_df(), corridor.control_df()
+    return lambda: allocate_df(
+        control_df, ACTIVITIES, suit_df, CAP_FIELDS, SEG_FIELD, SUIT_FIELD
+    )
+
+
+def _smart_alloc(corridor):
+    from tod import SmartAlloc as SA
+    from synthetic import ACTIVITIES
+    control_rows, recipient_rows = corridor.smart_alloc_arrays(SMART_ALLOC_UNITS_SCALE)
+    return lambda: SA.ArrayToArrayAllocation(
+        control_rows,
+        SEG_FIELD,
+        list(ACTIVITIES),
+        recipient_rows,
+        ID_FIELD,
+        SEG_FIELD,
+        ["{}_cap".format(act) for act in ACTIVITIES],
+        ["{}_suit".format(act) for act in ACTIVITIES],
+    )
+
+
+def _distribute(corridor):
+    from tod import TOD
+    station_arrays = corridor.distribute_arrays()
+
+    def run():
+        for total, array in station_arrays:
+            TOD._distribute(total, array, "total_activity", "density_weight")
+
+    return run
+
+
+def _allocate_hotels(corridor):
+    from tod import TOD
+    station_arrays = corridor.hotel_arrays()
+
+    def run():
+        for total, array, min_value in station_arrays:
+            TOD._allocate(
+                total,
+                array,
+                "hotel_activity",
+                "nonres_activity",
+                control_attr="nonres_activity",
+                min_value=min_value,
+            )
+
+    return run
+
+
+def _adjust_targets(corridor):
+    from tod import TOD
+    from synthetic import EXISTING_FIELDS, STATION_FIELD, TARGET_FIELDS
+    dev_areas_df = corridor.dev_area_df()
+    out_fields = [f.replace("_Tgt", "_Adj") for f in TARGET_FIELDS]
+
+    def run():
+        # as in `adjustTargetsBasedOnExisting2`
+        for station_area, station_df in dev_areas_df.groupby(STATION_FIELD):
+            station_df = station_df.copy()
+            for ex_field, tgt_field, out_field in zip(
+                    EXISTING_FIELDS, TARGET_FIELDS, out_fields
+            ):
+                station_df = TOD._adjustTargets(
+                    station_df, ID_FIELD, tgt_field, ex_field, out_field
+                )
+
+    return run
+
+
+ENGINES = [
+    Engine("allocate_dict", _allocate_dict, max_parcels=100000),
+    Engine("allocate_array", _allocate_array),
+    Engine("allocate_df", _allocate_df),
+    Engine("SmartAlloc._allocateValues", _smart_alloc, max_parcels=10000),
+    Engine("TOD._distribute", _distribute),
+    Engine("TOD._allocate", _allocate_hotels, max_parcels=100000),
+    Engine("TOD._adjustTargets", _adjust_targets, max_parcels=100000),
+]
+ENGINES_BY_NAME = dict((engine.name, engine) for engine in ENGINES)
+
+
+@contextmanager
+def quiet():
+    """silence engine progress messages"""
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def _seed(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def git_commit():
+    """short hash of the checked-out commit (None outside a git work tree)"""
+    try:
+        with open(os.devnull, "w") as devnull:
+            out = subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=path.dirname(path.abspath(__file__)),
+                stderr=devnull,
+            )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.decode("ascii").strip()
+
+
+def run_case(engine_name, n_parcels, n_segments=10, n_stations=20, seed=1, repeat=3):
+    """
+    engine_name: String
+        Name of an engine in `ENGINES`
+    n_parcels, n_segments, n_stations, seed:
+        Synthetic corridor specs (see `synthetic.make_corridor`)
+    repeat: Integer, default=3
+        Number of timed runs
+
+    Returns a dictionary of timings (best and mean seconds), throughput
+    (parcels per second for the best run), peak process memory after setup and
+    after the runs (MB) and, where `tracemalloc` is available, the peak memory
+    allocated by one run (MB).
+    """
+    engine = ENGINES_BY_NAME[engine_name]
+    record = {
+        "engine": engine_name,
+        "n_parcels": n_parcels,
+        "n_segments": n_segments,
+        "n_stations": n_stations,
+        "seed": seed,
+        "repeat": repeat,
+        "status": "ok",
+    }
+    try:
+        corridor = make_corridor(n_parcels, n_segments, n_stations, seed=seed)
+        times = []
+        setup_rss = None
+        for i in range(repeat):
+            run = engine.setup(corridor)
+            if setup_rss is None:
+                setup_rss = peak_rss_mb()
+            _seed(seed)
+            with quiet():
+                start = time.time()
+                run()
+                times.append(time.time() - start)
+        run_rss = peak_rss_mb()
+        alloc_peak = None
+        if tracemalloc is not None:
+            run = engine.setup(corridor)
+            _seed(seed)
+            tracemalloc.start()
+            try:
+                with quiet():
+                    run()
+                alloc_peak = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            finally:
+                tracemalloc.stop()
+    except Exception as e:
+        record.update({"status": "error: {}: {}".format(type(e).__name__, e)})
+        return record
+    record.update(
+        {
+            "best_s": min(times),
+            "mean_s": sum(times) / len(times),
+            "parcels_per_s": n_parcels / min(times) if min(times) > 0 else None,
+            "setup_rss_mb": setup_rss,
+            "peak_rss_mb": run_rss,
+            "alloc_peak_mb": alloc_peak,
+        }
+    )
+    return record
+
+
+def _run_case_args(args):
+    return run_case(*args)
+
+
+def run_benchmarks(
+        engines=None,
+        sizes=SIZES,
+        n_segments=10,
+        n_stations=20,
+        seed=1,
+        repeat=3,
+        limits=True,
+        out_file=None,
+        inline=False,
+):
+    """
+    engines: [String, ...], optional
+        Engine names (defaults to all `ENGINES`)
+    sizes: [Integer, ...], default=SIZES
+        Corridor sizes (parcels)
+    n_segments, n_stations, seed, repeat:
+        See `run_case`
+    limits: Boolean, default=True
+        If True, engines are not run on corridors larger than their
+        `max_parcels`
+    out_file: String, optional
+        JSON-lines file the results are appended to
+    inline: Boolean, default=False
+        If True, cases run in this process (peak memory then accumulates
+        across cases)
+
+    Returns a data frame of results, one row per engine and size.
+    """
+    engines = engines or [engine.name for engine in ENGINES]
+    run_info = {
+        "run": datetime.now().strftime("%Y%m%dT%H%M%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+    records = []
+    for name in engines:
+        engine = ENGINES_BY_NAME[name]
+        for n_parcels in sizes:
+            if limits and engine.max_parcels and n_parcels > engine.max_parcels:
+                record = {"engine": name, "n_parcels": n_parcels,
+                          "status": "skipped (max_parcels={})".format(engine.max_parcels)}
+            else:
+                print("Benchmarking {} on {} parcels...".format(name, n_parcels))
+                args = (name, n_parcels, n_segments, n_stations, seed, repeat)
+                if inline:
+                    record = run_case(*args)
+                else:
+                    pool = multiprocessing.Pool(processes=1)
+                    try:
+                        record = pool.apply(_run_case_args, (args,))
+                    finally:
+                        pool.close()
+                        pool.join()
+                print("...{}".format(_describe(record)))
+            record.update(run_info)
+            records.append(record)
+            if out_file and record["status"] == "ok":
+                with open(out_file, "a") as f:
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+    return pd.DataFrame(records)
+
+
+def _describe(record):
+    if record["status"] != "ok":
+        return record["status"]
+    return "best {:.3f}s ({:,.0f} parcels/s), peak memory {}".format(
+        record["best_s"],
+        record["parcels_per_s"] or 0,
+        "n/a" if record["peak_rss_mb"] is None else "{:.0f} MB".format(record["peak_rss_mb"]),
+    )
+
+
+def compare_commits(results_file, value="parcels_per_s"):
+    """
+    results_file: String
+        JSON-lines results written by `run_benchmarks`
+    value: String, default="parcels_per_s"
+        Measure to compare
+
+    Returns an (engine, parcels) x commit table of `value`, using the latest
+    run of each commit.
+    """
+    with open(results_file) as f:
+        results = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    results["commit"] = results["commit"].fillna("unknown")
+    latest = results.sort_values("run").drop_duplicates(
+        ["engine", "n_parcels", "commit"], keep="last"
+    )
+    commit_order = pd.unique(results.sort_values("run")["commit"])
+    table = latest.pivot_table(
+        index=["engine", "n_parcels"], columns="commit", values=value
+    )
+    return table[[c for c in commit_order if c in table.columns]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the allocation and TOD template engines on synthetic corridors"
+    )
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES_BY_NAME),
+                        help="engines to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES,
+                        help="corridor sizes in parcels")
+    parser.add_argument("--segments", type=int, default=10)
+    parser.add_argument("--stations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-limits", action="store_true",
+                        help="run every engine on every size")
+    parser.add_argument("--inline", action="store_true",
+                        help="run cases in this process rather than worker processes")
+    parser.add_argument("--out", default="benchmark_results.jsonl",
+                        help="JSON-lines file results are appended to")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare results in --out across commits and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        print(compare_commits(args.out).to_string())
+        return
+    results = run_benchmarks(
+        engines=args.engines,
+        sizes=args.sizes,
+        n_segments=args.segments,
+        n_stations=args.stations,
+        seed=args.seed,
+        repeat=args.repeat,
+        limits=not args.no_limits,
+        out_file=args.out,
+        inline=args.inline,
+    )
+    columns = ["engine", "n_parcels", "status", "best_s", "parcels_per_s",
+               "peak_rss_mb", "alloc_peak_mb"]
+    print(results[[c for c in columns if c in results.columns]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
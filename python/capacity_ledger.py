@@ -0,0 +1,233 @@
+"""
+Capacity ledger
+
+Floor area estimates for each parcel, use grouping and development phase
+(existing, pipeline, capacity, allocated, ...) held in one parcels x uses x
+phases array with named axes, in place of a `{Use}_SF_{Phase}` column per
+combination. Phase transitions are array operations over all uses at once:
+
+    ledger = CapacityLedger(parcel_frame.index, USES, ["Ex", "Pipe", "ExPi"])
+    ledger.load_frame(ex_pipe_df)              # "SF_SF_Ex", "SF_SF_Pipe", ...
+    ledger.sum_phases("ExPi", ["Ex", "Pipe"])  # ExPi = Ex + Pipe
+    ...
+    ledger.export(parcel_frame)                # "SF_SF_ExPi", ...
+
+Field names (the feature class schema) are only produced when values are
+read out with `to_frame` or written to a `ParcelFrame` with `export`; names
+are parsed back into (use, phase) cells by `load_frame` and `assign`.
+
+Phases may be limited to a subset of uses (e.g., tracked uses only); cells
+outside a phase's uses stay 0 and are not materialized. Each phase has the
+field type its fields are written with, following `ParcelFrame.assign`:
+"LONG" values are truncated to integers as they are stored (nulls as 0) and
+"DOUBLE" values are kept as floats (nulls as NaN).
+"""
+import numpy as np
+import pandas as pd
+
+
+class CapacityLedger(object):
+    """
+    index: array-like
+        Parcel ids, in row order (e.g., `ParcelFrame.index`)
+    uses: [String, ...]
+        Use groupings (e.g., ["SF", "MF", "Ret", ...])
+    phases: [String, ...]
+        Development phases (field suffixes, e.g., ["Ex", "Pipe", "ExPi"])
+    phase_uses: Dict, optional
+        {phase: [use, ...]} for phases limited to some uses (defaults to all)
+    field_types: Dict, optional
+        {phase: "LONG" | "DOUBLE"} (defaults to "LONG")
+    measure: String, default="SF"
+        Measure token of the field names (`{use}_{measure}_{phase}`)
+    """
+
+    axes = ("parcel", "use", "phase")
+
+    def __init__(self, index, uses, phases, phase_uses=None, field_types=None, measure="SF"):
+        self.index = pd.Index(index)
+        self.uses = list(uses)
+        self.phases = list(phases)
+        self.measure = measure
+        phase_uses = phase_uses or {}
+        field_types = field_types or {}
+        self.phase_uses = dict(
+            (phase, list(phase_uses.get(phase, self.uses))) for phase in self.phases
+        )
+        self.field_types = dict(
+            (phase, field_types.get(phase, "LONG")) for phase in self.phases
+        )
+        for phase, field_type in self.field_types.items():
+            if field_type not in ("LONG", "DOUBLE"):
+                raise ValueError(
+                    "Unsupported field type '{}' for phase {}".format(field_type, phase)
+                )
+        self._use_idx = dict((use, i) for i, use in enumerate(self.uses))
+        self._phase_idx = dict((phase, j) for j, phase in enumerate(self.phases))
+        # use positions of each phase's uses
+        self._phase_cols = dict(
+            (phase, np.array([self._use_idx[u] for u in uses], dtype=np.int64))
+            for phase, uses in self.phase_uses.items()
+        )
+        self.values = np.zeros((len(self.index), len(self.uses), len(self.phases)))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, phase):
+        return phase in self._phase_idx
+
+    def __getitem__(self, phase):
+        """(parcels, uses) view of the values of `phase`"""
+        return self.values[:, :, self._phase_idx[phase]]
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def field(self, use, phase, measure=None):
+        """field name of a (use, phase) cell"""
+        return "{}_{}_{}".format(use, measure or self.measure, phase)
+
+    def fields(self, phase, uses=None, measure=None):
+        """
+        phase: String
+        uses: [String, ...], optional
+            Uses to include (defaults to the phase's uses); uses outside the
+            phase are skipped
+        measure: String, optional
+            Measure token (defaults to the ledger's)
+
+        Returns the field names of `phase`, in the order of `uses`.
+        """
+        phase_uses = self.phase_uses[phase]
+        uses = phase_uses if uses is None else [u for u in uses if u in phase_uses]
+        return [self.field(use, phase, measure) for use in uses]
+
+    def _cell(self, field, measure=None):
+        """(use position, phase) of a field name, or None"""
+        token = "_{}_".format(measure or self.measure)
+        if token not in field:
+            return None
+        use, phase = field.split(token, 1)
+        if phase not in self._phase_idx or use not in self.phase_uses[phase]:
+            return None
+        return self._use_idx[use], phase
+
+    def _coerce(self, phase, values):
+        """values as stored for `phase` (see `ParcelFrame.assign`)"""
+        values = np.asarray(values, dtype=float)
+        if self.field_types[phase] == "LONG":
+            return np.trunc(np.nan_to_num(values))
+        return values
+
+    def set(self, phase, values):
+        """
+        phase: String
+        values: array-like
+            New values for all uses (parcels, uses) or for the phase's uses
+            (parcels, phase uses), or broadcastable to the latter; values of
+            uses outside the phase are ignored
+        """
+        cols = self._phase_cols[phase]
+        values = self._coerce(phase, values)
+        if values.ndim == 2 and values.shape[1] == len(self.uses):
+            values = values[:, cols]
+        self.values[:, cols, self._phase_idx[phase]] = np.broadcast_to(
+            values, (len(self), len(cols))
+        )
+
+    def assign(self, field, values):
+        """
+        field: String
+            Field name of a single (use, phase) cell
+        values: Series or array-like
+            New values; a series is aligned on the parcel id (parcels missing
+            from the series are null)
+        """
+        cell = self._cell(field)
+        if cell is None:
+            raise KeyError("{} is not a field of the capacity ledger".format(field))
+        use_pos, phase = cell
+        if isinstance(values, pd.Series):
+            values = values.reindex(self.index).values
+        self.values[:, use_pos, self._phase_idx[phase]] = self._coerce(phase, values)
+
+    def load_frame(self, df):
+        """
+        df: DataFrame
+            Values indexed by parcel id; columns named as ledger fields are
+            loaded (parcels missing from `df` are null) and others ignored
+
+        Returns the ledger.
+        """
+        fields = [f for f in df.columns if self._cell(f) is not None]
+        if not fields:
+            return self
+        aligned = df[fields].reindex(self.index)
+        for field in fields:
+            self.assign(field, aligned[field].values)
+        return self
+
+    def to_frame(self, fields, measure=None, divisor=None):
+        """
+        fields: [String, ...]
+            Field names of the cells to read out (see `fields`)
+        measure: String, optional
+            Measure token of `fields` (defaults to the ledger's), e.g., "FAR"
+            when reading out floor area ratios with `divisor`
+        divisor: (parcels,) array-like, optional
+            Values are divided by it (e.g., parcel area)
+
+        Returns a data frame of `fields` indexed by parcel id. "LONG" phases
+        are read out as integers unless divided.
+        """
+        columns = []
+        for field in fields:
+            cell = self._cell(field, measure)
+            if cell is None:
+                raise KeyError("{} is not a field of the capacity ledger".format(field))
+            use_pos, phase = cell
+            values = self.values[:, use_pos, self._phase_idx[phase]]
+            if divisor is not None:
+                values = values / np.asarray(divisor, dtype=float)
+            elif self.field_types[phase] == "LONG":
+                values = values.astype(np.int64)
+            columns.append(values)
+        return pd.DataFrame(dict(zip(fields, columns)), index=self.index, columns=fields)
+
+    def sum_phases(self, out, phases):
+        """`out` = sum of `phases` (e.g., ExPi = Ex + Pipe)"""
+        self.set(out, sum(self[phase] for phase in phases))
+
+    def blend(self, out, primary, fallback):
+        """`out` = `primary` where it is not null, otherwise `fallback` (e.g., TotCap = Adj | BCap)"""
+        first = self[primary]
+        self.set(out, np.where(np.isnan(first), self[fallback], first))
+
+    def change(self, out, total, existing):
+        """`out` = max(`total` - `existing`, 0), nulls as 0 (e.g., ChgCap = TotCap - Ex)"""
+        with np.errstate(invalid="ignore"):
+            chg = np.maximum(self[total] - np.nan_to_num(self[existing]), 0)
+        self.set(out, np.nan_to_num(chg))
+
+    def total(self, phase, uses=None):
+        """(parcels,) sum of `phase` over `uses` (defaults to the phase's uses)"""
+        uses = self.phase_uses[phase] if uses is None else uses
+        cols = [self._use_idx[u] for u in uses if u in self.phase_uses[phase]]
+        return self[phase][:, cols].sum(axis=1)
+
+    def export(self, parcel_frame, phases=None):
+        """
+        parcel_frame: ParcelFrame
+            Frame the fields are assigned to (written with `ParcelFrame.write`)
+        phases: [String, ...], optional
+            Phases to export (defaults to all)
+
+        Materializes the `{use}_{measure}_{phase}` fields of `phases` in
+        `parcel_frame` with each phase's field type.
+        """
+        for phase in phases or self.phases:
+            parcel_frame.update(
+                self.to_frame(self.fields(phase)), field_type=self.field_types[phase]
+            )
@@ -0,0 +1,115 @@
+"""
+Categorical codes
+
+Shared dictionaries of small integer codes for categorical text fields (land
+uses, property types, station names). Text columns are encoded once, when they
+are loaded, as pandas categoricals whose categories are the labels of a shared
+domain, so codes are identical across every column and table encoded against
+the same domain (e.g., `LandUse2` and `Exp_LU` both use `LAND_USE`).
+
+Filters, field routing and grouping then operate on the integer codes:
+
+    codes = CategoryCodes()
+    df["LandUse2"] = codes.encode(df["LandUse2"], LAND_USE)
+    excluded = codes.isin(df["LandUse2"], ["Transportation", "Utilities"], LAND_USE)
+    routes = codes.lookup({"Office": 0, "Multifamily": 1}, LAND_USE)[
+        df["LandUse2"].cat.codes.values
+    ]
+
+Nulls and empty strings are encoded as missing values (code -1).
+"""
+import numpy as np
+import pandas as pd
+
+# Domains
+LAND_USE = "land_use"
+PROPERTY_TYPE = "property_type"
+STATION = "station"
+
+
+def _is_null(label):
+    return label is None or label == "" or (isinstance(label, float) and np.isnan(label))
+
+
+class CategoryCodes(object):
+    """
+    domains: Dict, optional
+        {domain: [label, ...]} to seed the code dictionaries with known labels
+        (codes follow list order). Labels encountered later are appended.
+    """
+
+    def __init__(self, domains=None):
+        # {domain: [label, ...]}; a label's code is its position
+        self.labels = {}
+        self._codes = {}
+        for domain in sorted(domains or {}):
+            self.extend(domains[domain], domain)
+
+    def extend(self, labels, domain):
+        """
+        labels: [String, ...]
+            Labels to add to `domain`; labels already in the domain keep their
+            codes and nulls are ignored.
+        domain: String
+        """
+        domain_codes = self._codes.setdefault(domain, {})
+        domain_labels = self.labels.setdefault(domain, [])
+        for label in labels:
+            if not _is_null(label) and label not in domain_codes:
+                domain_codes[label] = len(domain_labels)
+                domain_labels.append(label)
+
+    def encode(self, values, domain):
+        """
+        values: Series or array-like
+            Text values to encode
+        domain: String
+
+        Returns `values` as a categorical (a series if `values` is a series)
+        with the labels of `domain` as its categories. New labels are added to
+        the domain in sorted order.
+        """
+        uniques = pd.unique(np.asarray(values, dtype=object))
+        self.extend(sorted(u for u in uniques if not _is_null(u)), domain)
+        encoded = pd.Categorical(values, categories=self.labels[domain])
+        if isinstance(values, pd.Series):
+            return pd.Series(encoded, index=values.index, name=values.name)
+        return encoded
+
+    def code(self, label, domain):
+        """code of `label` in `domain` (-1 if the label is not in the domain)"""
+        return self._codes.get(domain, {}).get(label, -1)
+
+    def codes(self, labels, domain):
+        """
+        Returns an array of the codes of `labels` in `domain`; labels not in the
+        domain are skipped.
+        """
+        codes = [self.code(label, domain) for label in labels]
+        return np.array([c for c in codes if c >= 0], dtype=np.int32)
+
+    def isin(self, column, labels, domain):
+        """
+        column: Series
+            Categorical column encoded against `domain`
+        labels: [String, ...]
+        domain: String
+
+        Returns a boolean array flagging rows of `column` whose label is in
+        `labels`, compared as integer codes.
+        """
+        return np.in1d(column.cat.codes.values, self.codes(labels, domain))
+
+    def lookup(self, mapping, domain, default=-1):
+        """
+        mapping: Dict
+            {label: value}
+        domain: String
+        default: optional
+            Value for labels not in `mapping` and for missing values
+
+        Returns an array of values indexed by code, with one trailing `default`
+        entry so that missing values (code -1) look up `default`.
+        """
+        values = [mapping.get(label, default) for label in self.labels.get(domain, [])]
+        return np.array(values + [default])
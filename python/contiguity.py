@@ -0,0 +1,304 @@
+"""
+Parcel contiguity
+
+A sparse parcel neighbor graph stored in compressed sparse row (CSR) form:
+the neighbors of parcel `i` are `indices[indptr[i]:indptr[i + 1]]` (positions
+in `ids`) with edge weights `weights[indptr[i]:indptr[i + 1]]`. Graphs are
+built once from parcel polygons (queen or rook adjacency, see
+`build_graph`) or centroids (k nearest neighbors, see `knn_graph`), persisted
+as `.npz` files and reused by all scenarios, like the parcel-zone crosswalk:
+
+    graph = load_graph(graph_file, parcels, "ParclID")
+    nbr_share = graph.reindex(ids).row_normalized().dot(is_developed)
+
+`dot` multiplies the graph's adjacency matrix by a vector of parcel values in
+O(edges) time using numpy only; `to_scipy` returns a `scipy.sparse` matrix
+when scipy is installed.
+"""
+import numpy as np
+from os import path
+
+from tod.LazyImport import arcpy
+
+try:
+    from scipy import sparse
+    from scipy.spatial import cKDTree
+except ImportError:
+    sparse = None
+    cKDTree = None
+
+QUEEN = "queen"
+ROOK = "rook"
+
+
+class ContiguityGraph(object):
+    """
+    ids: array-like
+        Parcel id of each node (row)
+    indptr: (n + 1,) int array
+        Start of each node's neighbors in `indices`
+    indices: (nnz,) int array
+        Neighbor positions (in `ids`)
+    weights: (nnz,) float array, optional
+        Edge weights (default 1.0)
+    """
+
+    def __init__(self, ids, indptr, indices, weights=None):
+        self.ids = np.asarray(ids)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        if weights is None:
+            weights = np.ones(len(self.indices))
+        self.weights = np.asarray(weights, dtype=float)
+        # row of each edge, for products and transposes
+        self._rows = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    @property
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        """ids of the neighbors of the node at position `i`"""
+        return self.ids[self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    @classmethod
+    def from_pairs(cls, ids, src_ids, nbr_ids, weights=None, symmetric=True):
+        """
+        ids: array-like
+            Parcel ids (nodes), in the order of the graph's rows
+        src_ids, nbr_ids: array-like
+            Parcel ids of each neighbor pair; pairs with ids not in `ids` and
+            self pairs are dropped
+        weights: array-like, optional
+            Weight of each pair (default 1.0); duplicate pairs keep the
+            largest weight
+        symmetric: Boolean, default=True
+            If True, each pair is also added in the reverse direction
+
+        Returns the graph of the pairs.
+        """
+        ids = np.asarray(ids)
+        sorter = np.argsort(ids, kind="mergesort")
+        src = _positions(ids, sorter, src_ids)
+        nbr = _positions(ids, sorter, nbr_ids)
+        weights = np.ones(len(src)) if weights is None else np.asarray(weights, dtype=float)
+        keep = (src >= 0) & (nbr >= 0) & (src != nbr)
+        src, nbr, weights = src[keep], nbr[keep], weights[keep]
+        if symmetric:
+            src, nbr = np.r_[src, nbr], np.r_[nbr, src]
+            weights = np.r_[weights, weights]
+        # order edges by row, then neighbor, with the largest weight first and
+        #  drop duplicate pairs
+        order = np.lexsort((-weights, nbr, src))
+        src, nbr, weights = src[order], nbr[order], weights[order]
+        if len(src):
+            first = np.r_[True, (src[1:] != src[:-1]) | (nbr[1:] != nbr[:-1])]
+            src, nbr, weights = src[first], nbr[first], weights[first]
+        indptr = np.r_[0, np.cumsum(np.bincount(src, minlength=len(ids)))]
+        return cls(ids, indptr, nbr, weights)
+
+    def dot(self, x):
+        """
+        x: (n,) or (n, k) array
+            Values by node
+
+        Returns the adjacency matrix product: for each node, the weighted sum
+        of its neighbors' values.
+        """
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 1:
+            return np.bincount(
+                self._rows, weights=self.weights * x[self.indices], minlength=len(self)
+            )
+        return np.column_stack([self.dot(x[:, j]) for j in range(x.shape[1])])
+
+    def row_normalized(self):
+        """graph with each node's edge weights scaled to sum to 1"""
+        sums = np.bincount(self._rows, weights=self.weights, minlength=len(self))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = self.weights / sums[self._rows]
+        return ContiguityGraph(self.ids, self.indptr, self.indices, weights)
+
+    def reindex(self, ids):
+        """
+        ids: array-like
+            Parcel ids of the nodes to keep, in the new row order
+
+        Returns the subgraph of `ids` (ids not in the graph become nodes
+        without neighbors; edges to dropped nodes are removed).
+        """
+        ids = np.asarray(ids)
+        if len(ids) == len(self.ids) and np.array_equal(ids, self.ids):
+            return self
+        sorter = np.argsort(ids, kind="mergesort")
+        # new position of each old node (-1 if dropped)
+        new_pos = _positions(ids, sorter, self.ids)
+        src = new_pos[self._rows]
+        nbr = new_pos[self.indices]
+        keep = (src >= 0) & (nbr >= 0)
+        order = np.lexsort((nbr[keep], src[keep]))
+        src, nbr = src[keep][order], nbr[keep][order]
+        indptr = np.r_[0, np.cumsum(np.bincount(src, minlength=len(ids)))]
+        return ContiguityGraph(ids, indptr, nbr, self.weights[keep][order])
+
+    def to_scipy(self):
+        """the adjacency matrix as a `scipy.sparse.csr_matrix` (requires scipy)"""
+        if sparse is None:
+            raise ImportError("scipy is required for ContiguityGraph.to_scipy")
+        return sparse.csr_matrix(
+            (self.weights, self.indices, self.indptr), shape=(len(self), len(self))
+        )
+
+    def save(self, graph_file):
+        """persist the graph to an `.npz` file"""
+        np.savez(
+            graph_file, ids=self.ids, indptr=self.indptr, indices=self.indices, weights=self.weights
+        )
+        print("...contiguity graph written here: {}".format(graph_file))
+
+    @classmethod
+    def load(cls, graph_file):
+        """graph persisted with `save`"""
+        with np.load(graph_file, allow_pickle=False) as npz:
+            return cls(npz["ids"], npz["indptr"], npz["indices"], npz["weights"])
+
+
+def _positions(ids, sorter, values):
+    """position of each of `values` in `ids` (-1 if missing)"""
+    values = np.asarray(values)
+    if len(ids) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    pos = np.searchsorted(ids, values, sorter=sorter)
+    pos = sorter[np.minimum(pos, len(ids) - 1)]
+    return np.where(ids[pos] == values, pos, -1).astype(np.int64)
+
+
+def build_graph(parcels, parcel_id, contiguity=QUEEN, where_clause=None, out_file=None):
+    """
+    parcels: String (path to feature class)
+        Parcel polygons
+    parcel_id: String
+        Unique parcel id field in `parcels`
+    contiguity: String, default="queen"
+        "queen" treats parcels sharing an edge or a corner as neighbors;
+        "rook" requires a shared edge
+    where_clause: String, optional
+        SQL clause to select a subset of `parcels`
+    out_file: String, optional
+        Path to an `.npz` file to persist the graph to
+
+    Finds neighboring parcels in one pass (`PolygonNeighbors`, which uses the
+    features' spatial index); edges are weighted 1.0.
+
+    Returns the graph as a `ContiguityGraph`.
+    """
+    if contiguity not in (QUEEN, ROOK):
+        raise ValueError("Unknown contiguity {} (use 'queen' or 'rook')".format(contiguity))
+    print("Building parcel contiguity graph ({})...".format(contiguity))
+    parcel_fl = arcpy.MakeFeatureLayer_management(
+        in_features=parcels, out_layer="contiguity_parcels", where_clause=where_clause
+    )
+    nbr_tbl = "in_memory\\parcel_neighbors"
+    try:
+        arcpy.PolygonNeighbors_analysis(
+            in_features=parcel_fl,
+            out_table=nbr_tbl,
+            in_fields=parcel_id,
+            both_sides="BOTH_SIDES",
+        )
+        pairs = arcpy.da.TableToNumPyArray(
+            in_table=nbr_tbl,
+            field_names=["src_{}".format(parcel_id), "nbr_{}".format(parcel_id), "LENGTH"],
+        )
+        ids = arcpy.da.TableToNumPyArray(in_table=parcel_fl, field_names=[parcel_id])[parcel_id]
+    finally:
+        arcpy.Delete_management(parcel_fl)
+        if arcpy.Exists(nbr_tbl):
+            arcpy.Delete_management(nbr_tbl)
+    if contiguity == ROOK:
+        # corner-only neighbors share no boundary length
+        pairs = pairs[pairs["LENGTH"] > 0]
+    graph = ContiguityGraph.from_pairs(
+        ids, pairs["src_{}".format(parcel_id)], pairs["nbr_{}".format(parcel_id)]
+    )
+    if out_file:
+        graph.save(out_file)
+    return graph
+
+
+def knn_graph(ids, x, y, k=8, max_distance=None, chunk_size=2000):
+    """
+    ids: array-like
+        Parcel ids
+    x, y: array-like
+        Parcel centroid coordinates
+    k: Integer, default=8
+        Number of nearest neighbors linked to each parcel
+    max_distance: Number, optional
+        Neighbors farther than this are not linked
+    chunk_size: Integer, default=2000
+        Parcels searched at a time without scipy
+
+    Links each parcel to its `k` nearest parcels (made symmetric). Uses a
+    KD-tree (`scipy.spatial.cKDTree`) when scipy is installed; otherwise
+    distances are computed `chunk_size` parcels at a time (quadratic, for
+    small parcel sets only).
+
+    Returns the graph as a `ContiguityGraph` with edges weighted 1.0.
+    """
+    ids = np.asarray(ids)
+    xy = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+    n = len(ids)
+    k = min(k, n - 1)
+    if k < 1:
+        return ContiguityGraph.from_pairs(ids, [], [])
+    if cKDTree is not None:
+        dist, nbr = cKDTree(xy).query(xy, k=k + 1)
+    else:
+        dist = np.empty((n, k + 1))
+        nbr = np.empty((n, k + 1), dtype=np.int64)
+        for start in range(0, n, chunk_size):
+            block = xy[start:start + chunk_size]
+            rows = np.arange(len(block))[:, np.newaxis]
+            d2 = ((block[:, np.newaxis, :] - xy[np.newaxis, :, :]) ** 2).sum(axis=2)
+            part = np.argpartition(d2, k, axis=1)[:, :k + 1]
+            part_d2 = d2[rows, part]
+            order = np.argsort(part_d2, axis=1, kind="mergesort")
+            nbr[start:start + len(block)] = part[rows, order]
+            dist[start:start + len(block)] = np.sqrt(part_d2[rows, order])
+    src = np.repeat(np.arange(n), k + 1)
+    nbr = nbr.ravel()
+    keep = src != nbr
+    if max_distance is not None:
+        keep &= dist.ravel() <= max_distance
+    return ContiguityGraph.from_pairs(ids, ids[src[keep]], ids[nbr[keep]])
+
+
+def load_graph(graph_file, parcels, parcel_id, contiguity=QUEEN, where_clause=None, rebuild=False):
+    """
+    graph_file: String
+        Path to the persisted graph (`.npz`)
+    parcels, parcel_id, contiguity, where_clause:
+        See `build_graph`
+    rebuild: Boolean, default=False
+        If True, the graph is rebuilt even if `graph_file` exists
+
+    Returns the graph in `graph_file`, building and persisting it first if
+    needed.
+    """
+    if path.exists(graph_file) and not rebuild:
+        return ContiguityGraph.load(graph_file)
+    return build_graph(
+        parcels=parcels,
+        parcel_id=parcel_id,
+        contiguity=contiguity,
+        where_clause=where_clause,
+        out_file=graph_file,
+    )
@@ -0,0 +1,172 @@
+"""
+Parcel-zone crosswalks
+
+Parcel and zone (TAZ, corridor segment) geometry does not change between
+scenarios, so the parcel-zone overlay is computed once and persisted as a
+crosswalk table of intersection areas and area shares:
+
+    {parcel_id} | {zone_id} | AREA | SHARE
+
+`SHARE` is the proportion of the parcel's area falling in the zone. Summaries
+then aggregate parcel attributes to zones through the crosswalk instead of
+running a spatial join for each scenario.
+
+The inputs a crosswalk was built from (parcel and zone sources, id fields and
+zone selection) are recorded in a JSON manifest next to the csv
+(`{xwalk_file}.json`); `load_crosswalk` rebuilds the crosswalk when they
+differ from the requested ones. The manifest also records the id columns'
+dtypes, so a persisted crosswalk is read back with the ids as built (e.g.,
+text parcel ids such as "0012" stay text).
+"""
+import json
+import pandas as pd
+from os import path
+
+from tod.LazyImport import arcpy
+
+XWALK_AREA = "AREA"
+XWALK_SHARE = "SHARE"
+
+
+def _manifest_file(xwalk_file):
+    return "{}.json".format(xwalk_file)
+
+
+def _crosswalk_manifest(parcels, parcel_id, zones, zone_id, zone_where=None):
+    """inputs a crosswalk is built from, as recorded in its manifest"""
+    return {
+        "parcels": parcels,
+        "parcel_id": parcel_id,
+        "zones": zones,
+        "zone_id": zone_id,
+        "zone_where": zone_where,
+    }
+
+
+def _id_dtypes(xwalk, id_fields):
+    """{field: dtype} of the crosswalk's id columns ("text" for text ids)"""
+    dtypes = {}
+    for field in id_fields:
+        dtype = xwalk[field].dtype
+        dtypes[field] = "text" if dtype.kind in "OUS" else dtype.str
+    return dtypes
+
+
+def _read_csv(xwalk_file, dtypes):
+    """persisted crosswalk with its id columns in their recorded dtypes"""
+    read_dtypes = dict(
+        (str(field), str if dtype == "text" else str(dtype)) for field, dtype in dtypes.items()
+    )
+    # text ids such as "NA" are not nulls
+    return pd.read_csv(xwalk_file, dtype=read_dtypes, keep_default_na=False)
+
+
+def _read_manifest(xwalk_file):
+    """manifest of a persisted crosswalk, or None if missing"""
+    manifest_file = _manifest_file(xwalk_file)
+    if not path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def build_crosswalk(parcels, parcel_id, zones, zone_id, zone_where=None, out_file=None):
+    """
+    parcels: String (path to feature class)
+        Parcel features
+    parcel_id: String
+        Unique parcel id field in `parcels`
+    zones: String (path to feature class)
+        Zone features (e.g., TAZs)
+    zone_id: String
+        Zone id field in `zones`. Zone features sharing an id are treated as
+        one zone.
+    zone_where: String, optional
+        SQL clause to select a subset of `zones`
+    out_file: String, optional
+        Path to a csv file to persist the crosswalk to (with its manifest)
+
+    Intersects all parcels with all zones in one bulk overlay
+    (`TabulateIntersection`, which uses the features' spatial indexes).
+
+    Returns the crosswalk as a data frame.
+    """
+    print("Building parcel-zone crosswalk ({})...".format(zone_id))
+    zone_fl = arcpy.MakeFeatureLayer_management(
+        in_features=zones, out_layer="xwalk_zones", where_clause=zone_where
+    )
+    xwalk_tbl = "in_memory\\parcel_zone_xwalk"
+    try:
+        arcpy.TabulateIntersection_analysis(
+            in_zone_features=parcels,
+            zone_fields=parcel_id,
+            in_class_features=zone_fl,
+            out_table=xwalk_tbl,
+            class_fields=zone_id,
+        )
+        xwalk = pd.DataFrame(
+            arcpy.da.TableToNumPyArray(
+                in_table=xwalk_tbl,
+                field_names=[parcel_id, zone_id, XWALK_AREA, "PERCENTAGE"],
+            )
+        )
+    finally:
+        arcpy.Delete_management(zone_fl)
+        if arcpy.Exists(xwalk_tbl):
+            arcpy.Delete_management(xwalk_tbl)
+    xwalk[XWALK_SHARE] = xwalk.pop("PERCENTAGE") / 100.0
+    xwalk = xwalk[xwalk[XWALK_AREA] > 0].reset_index(drop=True)
+    if out_file:
+        xwalk.to_csv(out_file, index=False)
+        manifest = _crosswalk_manifest(parcels, parcel_id, zones, zone_id, zone_where)
+        manifest["dtypes"] = _id_dtypes(xwalk, [parcel_id, zone_id])
+        with open(_manifest_file(out_file), "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        print("...crosswalk written here: {}".format(out_file))
+    return xwalk
+
+
+def load_crosswalk(
+        xwalk_file, parcels, parcel_id, zones, zone_id, zone_where=None, rebuild=False
+):
+    """
+    xwalk_file: String
+        Path to the persisted crosswalk csv
+    parcels, parcel_id, zones, zone_id, zone_where:
+        See `build_crosswalk`
+    rebuild: Boolean, default=False
+        If True, the crosswalk is rebuilt even if `xwalk_file` exists
+
+    Returns the crosswalk in `xwalk_file`, building and persisting it first if
+    needed. A persisted crosswalk is only reused if its manifest matches the
+    requested inputs (crosswalks without a manifest or id dtypes are rebuilt).
+    """
+    if path.exists(xwalk_file) and not rebuild:
+        manifest = _read_manifest(xwalk_file) or {}
+        requested = _crosswalk_manifest(parcels, parcel_id, zones, zone_id, zone_where)
+        built_from = dict((key, manifest.get(key)) for key in requested)
+        if built_from == requested and "dtypes" in manifest:
+            return _read_csv(xwalk_file, manifest["dtypes"])
+        print("Crosswalk in {} was built from other inputs; rebuilding it".format(xwalk_file))
+    return build_crosswalk(
+        parcels=parcels,
+        parcel_id=parcel_id,
+        zones=zones,
+        zone_id=zone_id,
+        zone_where=zone_where,
+        out_file=xwalk_file,
+    )
+
+
+def dominant_zone(xwalk, parcel_id, zone_id):
+    """
+    xwalk: DataFrame
+        Crosswalk (see `build_crosswalk`)
+    parcel_id: String
+    zone_id: String
+
+    Returns a series, indexed by parcel id, of the zone holding the largest
+    share of each parcel.
+    """
+    ranked = xwalk.sort_values([parcel_id, XWALK_SHARE], ascending=[True, False])
+    return ranked.drop_duplicates(parcel_id).set_index(parcel_id)[zone_id]
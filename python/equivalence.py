@@ -0,0 +1,522 @@
+"""
+Engine equivalence
+
+Checks that alternative (faster) engines reproduce the results of the
+reference implementations before they are swapped into the pipeline. Each
+case pairs a reference engine with any number of candidate engines taking the
+same inputs:
+
+    allocate       `allocate_dict` vs `allocate_array`, segment-parallel
+                   `allocate_dict` and `allocate_spillover` without spillover
+    distribute     `TOD._distribute`
+    adjust_targets station-level `TOD._adjustTargets` loop
+                   (as in `adjustTargetsBasedOnExisting2`)
+    sqft_by_lu     `sqFtByLu` cursor logic vs `sqFtByLu_df`
+
+New engines are added with `register_candidate`. Engines run on fresh copies
+of each input set, drawn from synthetic corridors (see `synthetic`) and from
+golden files: inputs recorded from real runs (`record_inputs`) or synthetic
+inputs, stored with the reference output they produced. Outputs are compared
+within the case's tolerances (`np.isclose` semantics) and the report lists
+mismatches and the candidates' speedup over the reference:
+
+    python equivalence.py                      # synthetic corridors + goldens
+    python equivalence.py --record             # store synthetic goldens
+    python equivalence.py --cases allocate --sizes 1000 100000 --atol 1
+"""
+import argparse
+import copy
+import glob
+import multiprocessing
+import pickle
+import random
+import time
+from datetime import datetime
+from os import makedirs, path
+
+import numpy as np
+import pandas as pd
+
+from benchmark_engines import quiet
+from synthetic import (
+    CAP_FIELDS,
+    EXISTING_FIELDS,
+    ID_FIELD,
+    SEG_FIELD,
+    STATION_FIELD,
+    SUIT_FIELD,
+    TARGET_FIELDS,
+    make_corridor,
+)
+
+GOLDEN_DIR = path.join(path.dirname(path.abspath(__file__)), "golden")
+GOLDEN_EXT = ".pkl"
+
+
+class Case(object):
+    """
+    name: String
+    reference: callable
+        Reference engine, called with the keyword arguments of an input set
+    normalize: callable
+        Takes an engine output and its input set and returns a data frame
+        (indexed by record id) of the values to compare
+    synthetic_inputs: callable
+        Takes a `SyntheticCorridor` and returns a list of (label, input set)
+        pairs
+    rtol, atol: Number
+        Default tolerances for comparing candidate and reference values
+    """
+
+    def __init__(self, name, reference, normalize, synthetic_inputs, rtol=0.0, atol=0.0):
+        self.name = name
+        self.reference = reference
+        self.normalize = normalize
+        self.synthetic_inputs = synthetic_inputs
+        self.rtol = rtol
+        self.atol = atol
+        # {name: engine}
+        self.candidates = {}
+
+
+# Reference engines and input builders
+# --------------------------------------------------------------------------
+def _allocate_dict(**inputs):
+    from allocation import allocate_dict
+    return allocate_dict(**inputs)
+
+
+def _allocate_dict_parallel(**inputs):
+    from allocation import allocate_dict
+    return allocate_dict(workers=multiprocessing.cpu_count(), **inputs)
+
+
+def _allocate_array(**inputs):
+    from allocation import allocate_array
+    return allocate_array(**inputs)
+
+
+def _allocate_spillover(**inputs):
+    # without spillover (boost 0) the rounds must reproduce the rank-order fill
+    from allocation import allocate_spillover
+    from contiguity import ContiguityGraph
+    graph = ContiguityGraph.from_pairs(inputs["suit_df"].index.values, [], [])
+    return allocate_spillover(graph=graph, boost=0.0, **inputs)
+
+
+def _allocate_inputs(corridor):
+    return [
+        (
+            "all",
+            {
+                "suit_df": corridor.suit_df(),
+                "suit_id_field": ID_FIELD,
+                "suit_field": SUIT_FIELD,
+                "suit_df_seg_field": SEG_FIELD,
+                "suit_cap_fields": CAP_FIELDS,
+                "control_dict": corridor.control_dict(),
+            },
+        )
+    ]
+
+
+def _allocate_frame(output, inputs):
+    return output.set_index(inputs["suit_id_field"])
+
+
+def _distribute(**inputs):
+    from tod import TOD
+    return TOD._distribute(**inputs)
+
+
+def _distribute_inputs(corridor):
+    stations = sorted(corridor.station_parcels())
+    return [
+        (
+            station,
+            {
+                "total": total,
+                "array": array,
+                "sum_attr": "total_activity",
+                "weight_attr": "density_weight",
+            },
+        )
+        for station, (total, array) in zip(stations, corridor.distribute_arrays())
+    ]
+
+
+def _distribute_frame(output, inputs):
+    return pd.DataFrame(
+        {inputs["sum_attr"]: output[inputs["sum_attr"]]}, index=output["NAME"]
+    )
+
+
+def adjust_station_targets(df, id_field, existing_fields, target_fields, out_fields):
+    """
+    Reference station-level target adjustment: `TOD._adjustTargets` applied to
+    each target field in turn, as in `adjustTargetsBasedOnExisting2`.
+    """
+    from tod import TOD
+    for ex_field, tgt_field, out_field in zip(existing_fields, target_fields, out_fields):
+        df = TOD._adjustTargets(df, id_field, tgt_field, ex_field, out_field)
+    return df
+
+
+def _adjust_inputs(corridor):
+    dev_areas_df = corridor.dev_area_df()
+    return [
+        (
+            station_area,
+            {
+                "df": station_df.copy(),
+                "id_field": ID_FIELD,
+                "existing_fields": EXISTING_FIELDS,
+                "target_fields": TARGET_FIELDS,
+                "out_fields": [f.replace("_Tgt", "_Adj") for f in TARGET_FIELDS],
+            },
+        )
+        for station_area, station_df in dev_areas_df.groupby(STATION_FIELD)
+    ]
+
+
+def _adjust_frame(output, inputs):
+    return output.set_index(inputs["id_field"])[inputs["out_fields"]]
+
+
+def sqft_by_lu_rows(df, sqft_field, lu_field, lu_field_ref):
+    """
+    Reference land use routing: the row-by-row `UpdateCursor` logic of
+    `sqFtByLu` applied to a data frame (output fields start at 0 and are
+    LONG, so square footage is truncated).
+    """
+    update_fields = sorted({v for v in lu_field_ref.values()})
+    rows = []
+    for lu, bldg_area in zip(df[lu_field], df[sqft_field]):
+        r = [0] * len(update_fields)
+        update_field = lu_field_ref.get(lu, "")
+        if update_field:
+            r[update_fields.index(update_field)] = int(bldg_area)
+        rows.append(r)
+    return pd.DataFrame(rows, index=df.index, columns=update_fields)
+
+
+def _sqft_by_lu_df(**inputs):
+    from existing_sqft import sqFtByLu_df
+    return np.trunc(sqFtByLu_df(**inputs)).astype(np.int64)
+
+
+def _sqft_inputs(corridor):
+    from existing_sqft import lu_field_ref
+    return [
+        (
+            "all",
+            {
+                "df": corridor.parcels[["LandUse2", "BldSqFt"]].copy(),
+                "sqft_field": "BldSqFt",
+                "lu_field": "LandUse2",
+                "lu_field_ref": dict(lu_field_ref),
+            },
+        )
+    ]
+
+
+def _sqft_frame(output, inputs):
+    return output
+
+
+CASES = [
+    Case("allocate", _allocate_dict, _allocate_frame, _allocate_inputs),
+    Case("distribute", _distribute, _distribute_frame, _distribute_inputs, rtol=1e-9, atol=1e-6),
+    Case("adjust_targets", adjust_station_targets, _adjust_frame, _adjust_inputs,
+         rtol=1e-9, atol=1e-6),
+    Case("sqft_by_lu", sqft_by_lu_rows, _sqft_frame, _sqft_inputs),
+]
+CASES_BY_NAME = dict((case.name, case) for case in CASES)
+
+
+def register_candidate(case_name, name, engine):
+    """
+    case_name: String
+        Case the engine is an alternative for (see `CASES`)
+    name: String
+        Candidate name used in reports
+    engine: callable
+        Takes the same keyword arguments as the case's reference engine and
+        returns output in the same form
+    """
+    CASES_BY_NAME[case_name].candidates[name] = engine
+
+
+register_candidate("allocate", "allocate_array", _allocate_array)
+register_candidate("allocate", "allocate_dict (segment-parallel)", _allocate_dict_parallel)
+register_candidate("allocate", "allocate_spillover (boost=0)", _allocate_spillover)
+register_candidate("sqft_by_lu", "sqFtByLu_df", _sqft_by_lu_df)
+
+
+# Comparison
+# --------------------------------------------------------------------------
+def compare_frames(reference, candidate, rtol=0.0, atol=0.0):
+    """
+    reference, candidate: DataFrame
+        Normalized engine outputs
+    rtol, atol: Number
+        Tolerances, as in `np.isclose`
+
+    Returns a dictionary with "passed", the number of mismatched values,
+    maximum absolute and relative differences and a note on any structural
+    differences (index or columns).
+    """
+    result = {"passed": False, "n_mismatch": None, "max_abs_diff": None,
+              "max_rel_diff": None, "note": ""}
+    missing_cols = [c for c in reference.columns if c not in candidate.columns]
+    if missing_cols:
+        result["note"] = "missing columns: {}".format(missing_cols)
+        return result
+    if len(reference.index) != len(candidate.index) or not reference.index.sort_values().equals(
+            candidate.index.sort_values()):
+        result["note"] = "index differs ({} vs {} rows)".format(len(reference), len(candidate))
+        return result
+    ref = reference.sort_index()
+    cand = candidate[list(reference.columns)].reindex(ref.index)
+    ref_vals = ref.values.astype(float)
+    cand_vals = cand.values.astype(float)
+    both_nan = np.isnan(ref_vals) & np.isnan(cand_vals)
+    close = np.isclose(cand_vals, ref_vals, rtol=rtol, atol=atol) | both_nan
+    diff = np.where(both_nan, 0.0, np.abs(cand_vals - ref_vals))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel = np.where(diff == 0, 0.0, diff / np.abs(ref_vals))
+    result.update(
+        {
+            "passed": bool(close.all()),
+            "n_mismatch": int((~close).sum()),
+            "max_abs_diff": float(np.nanmax(diff)) if diff.size else 0.0,
+            "max_rel_diff": float(np.nanmax(rel)) if rel.size else 0.0,
+        }
+    )
+    return result
+
+
+def _run(engine, inputs, seed):
+    """run `engine` on a copy of `inputs`; returns (output, seconds)"""
+    inputs = copy.deepcopy(inputs)
+    np.random.seed(seed)
+    random.seed(seed)
+    with quiet():
+        start = time.time()
+        output = engine(**inputs)
+        elapsed = time.time() - start
+    return output, elapsed
+
+
+def check_case(case, label, inputs, golden_output=None, rtol=None, atol=None, seed=0):
+    """
+    case: Case
+    label: String
+        Input set label used in the report
+    inputs: Dict
+        Keyword arguments for the engines
+    golden_output: optional
+        Stored reference output for `inputs`; if given, the reference engine
+        is also checked against it
+    rtol, atol: Number, optional
+        Tolerances overriding the case's defaults
+    seed: Integer, default=0
+        Seed for the random generators before each engine run
+
+    Returns a list of report rows, one per candidate (and one for the
+    reference if `golden_output` is given).
+    """
+    rtol = case.rtol if rtol is None else rtol
+    atol = case.atol if atol is None else atol
+    rows = []
+    try:
+        ref_output, ref_s = _run(case.reference, inputs, seed)
+        ref_frame = case.normalize(ref_output, inputs)
+    except Exception as e:
+        return [{"case": case.name, "inputs": label, "engine": "reference",
+                 "passed": False, "note": "error: {}: {}".format(type(e).__name__, e)}]
+
+    engines = [("reference (golden)", None)] if golden_output is not None else []
+    engines += sorted(case.candidates.items())
+    if not engines:
+        return [{"case": case.name, "inputs": label, "engine": "reference", "passed": True,
+                 "ref_s": ref_s, "note": "no candidates"}]
+    for name, engine in engines:
+        row = {"case": case.name, "inputs": label, "engine": name, "ref_s": ref_s}
+        try:
+            if engine is None:
+                cand_frame, cand_s = ref_frame, ref_s
+                row.update(compare_frames(case.normalize(golden_output, inputs), ref_frame, rtol, atol))
+            else:
+                output, cand_s = _run(engine, inputs, seed)
+                cand_frame = case.normalize(output, inputs)
+                row.update(compare_frames(ref_frame, cand_frame, rtol, atol))
+        except Exception as e:
+            row.update({"passed": False, "note": "error: {}: {}".format(type(e).__name__, e)})
+            rows.append(row)
+            continue
+        row.update({"cand_s": cand_s, "speedup": ref_s / cand_s if cand_s > 0 else None})
+        rows.append(row)
+    return rows
+
+
+# Golden files
+# --------------------------------------------------------------------------
+def record_inputs(case_name, label, inputs, golden_dir=GOLDEN_DIR, seed=0):
+    """
+    case_name: String
+    label: String
+        Input set label (e.g., the scenario name)
+    inputs: Dict
+        Keyword arguments for the case's engines, as passed to the reference
+        engine in a real run
+    golden_dir: String, default=GOLDEN_DIR
+    seed: Integer, default=0
+
+    Runs the reference engine on a copy of `inputs` and stores the inputs and
+    output as a golden file. Returns the file path.
+    """
+    case = CASES_BY_NAME[case_name]
+    output, _ = _run(case.reference, inputs, seed)
+    if not path.exists(golden_dir):
+        makedirs(golden_dir)
+    golden_file = path.join(golden_dir, "{}__{}{}".format(case_name, label, GOLDEN_EXT))
+    golden = {
+        "case": case_name,
+        "label": label,
+        "seed": seed,
+        "inputs": inputs,
+        "output": output,
+        "created": datetime.now().isoformat(),
+    }
+    with open(golden_file, "wb") as f:
+        pickle.dump(golden, f, protocol=2)
+    return golden_file
+
+
+def load_goldens(golden_dir=GOLDEN_DIR, cases=None):
+    """list of golden records in `golden_dir` (optionally limited to `cases`)"""
+    goldens = []
+    for golden_file in sorted(glob.glob(path.join(golden_dir, "*" + GOLDEN_EXT))):
+        with open(golden_file, "rb") as f:
+            golden = pickle.load(f)
+        if cases is None or golden["case"] in cases:
+            goldens.append(golden)
+    return goldens
+
+
+def synthetic_label(n_parcels, seed, label):
+    return "synthetic-n{}-s{}/{}".format(n_parcels, seed, label)
+
+
+def record_synthetic(cases=None, sizes=(1000,), seeds=(1,), golden_dir=GOLDEN_DIR):
+    """store synthetic input sets and their reference outputs as golden files"""
+    files = []
+    for n_parcels in sizes:
+        for seed in seeds:
+            corridor = make_corridor(n_parcels, seed=seed)
+            for case in CASES:
+                if cases and case.name not in cases:
+                    continue
+                for label, inputs in case.synthetic_inputs(corridor):
+                    files.append(
+                        record_inputs(case.name, synthetic_label(n_parcels, seed, label)
+                                      .replace("/", "_"), inputs, golden_dir, seed)
+                    )
+    return files
+
+
+def run_checks(cases=None, sizes=(1000, 10000), seeds=(1,), golden_dir=GOLDEN_DIR,
+               rtol=None, atol=None):
+    """
+    cases: [String, ...], optional
+        Case names (defaults to all `CASES`)
+    sizes, seeds:
+        Synthetic corridors to check (parcels, seeds); empty to skip
+    golden_dir: String, default=GOLDEN_DIR
+        Folder of golden files to check (skipped if it does not exist)
+    rtol, atol: Number, optional
+        Tolerances overriding the cases' defaults
+
+    Returns a data frame report with one row per case, input set and engine.
+    """
+    rows = []
+    for n_parcels in sizes:
+        for seed in seeds:
+            corridor = make_corridor(n_parcels, seed=seed)
+            for case in CASES:
+                if cases and case.name not in cases:
+                    continue
+                print("Checking {} on {} synthetic parcels (seed {})...".format(
+                    case.name, n_parcels, seed))
+                for label, inputs in case.synthetic_inputs(corridor):
+                    rows += check_case(case, synthetic_label(n_parcels, seed, label),
+                                       inputs, rtol=rtol, atol=atol, seed=seed)
+    if path.exists(golden_dir):
+        for golden in load_goldens(golden_dir, cases):
+            print("Checking {} on golden inputs {}...".format(golden["case"], golden["label"]))
+            rows += check_case(CASES_BY_NAME[golden["case"]], golden["label"], golden["inputs"],
+                               golden_output=golden["output"], rtol=rtol, atol=atol,
+                               seed=golden.get("seed", 0))
+    return pd.DataFrame(
+        rows,
+        columns=["case", "inputs", "engine", "passed", "n_mismatch", "max_abs_diff",
+                 "max_rel_diff", "ref_s", "cand_s", "speedup", "note"],
+    )
+
+
+def summarize_checks(report):
+    """
+    Rolls a `run_checks` report up to one row per case and engine: whether all
+    input sets passed, the number of input sets, the largest differences and
+    the overall speedup (total reference time / total candidate time).
+    """
+    grouped = report.groupby(["case", "engine"], sort=False)
+    summary = pd.DataFrame(
+        {
+            "passed": grouped["passed"].all(),
+            "n_inputs": grouped.size(),
+            "n_failed": grouped["passed"].apply(lambda s: int((~s.astype(bool)).sum())),
+            "max_abs_diff": grouped["max_abs_diff"].max(),
+            "ref_s": grouped["ref_s"].sum(),
+            "cand_s": grouped["cand_s"].sum(),
+        }
+    )
+    summary["speedup"] = (summary["ref_s"] / summary["cand_s"]).where(summary["cand_s"] > 0)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check alternative engines against the reference implementations"
+    )
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES_BY_NAME))
+    parser.add_argument("--sizes", nargs="*", type=int, default=[1000, 10000],
+                        help="synthetic corridor sizes in parcels (none to skip)")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[1])
+    parser.add_argument("--golden-dir", default=GOLDEN_DIR)
+    parser.add_argument("--rtol", type=float, help="relative tolerance for all cases")
+    parser.add_argument("--atol", type=float, help="absolute tolerance for all cases")
+    parser.add_argument("--record", action="store_true",
+                        help="store synthetic inputs and reference outputs as golden files")
+    parser.add_argument("--out", help="csv file for the detailed report")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        files = record_synthetic(args.cases, args.sizes, args.seeds, args.golden_dir)
+        print("...{} golden files written to {}".format(len(files), args.golden_dir))
+        return
+    report = run_checks(args.cases, args.sizes, args.seeds, args.golden_dir,
+                        args.rtol, args.atol)
+    if args.out:
+        report.to_csv(args.out, index=False)
+    print(summarize_checks(report).to_string())
+    failed = report[~report["passed"].astype(bool)]
+    if len(failed):
+        print("\nFailed checks:")
+        print(failed[["case", "inputs", "engine", "n_mismatch", "max_abs_diff", "note"]]
+              .to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
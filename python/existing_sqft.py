@@ -1,6 +1,9 @@
-import arcpy
+import numpy as np
 import pandas as pd
 
+from parcel_chunks import map_chunks
+from tod.LazyImport import arcpy
+
 # List of LU categories found in parcel data
 lu_cats = [
     "Commercial/Retail",
@@ -105,11 +108,51 @@ def sqFtByLu(in_fc, sqft_field, lu_field, lu_field_ref, where_clause=None):
                 c.updateRow(r)
 
 
-def sqFtByLu_pd(in_fc, id_field, sqft_field, lu_field, lu_field_ref, 
-                where_clause=None):
+def sqFtByLu_df(df, sqft_field, lu_field, lu_field_ref):
+    """
+    df: DataFrame
+        Table with building square footage and land use columns (for example
+        `ParcelFrame.df`)
+    sqft_field: String
+        Column in `df` that contains building square footage
+    lu_field: String
+        Column in `df` that contains land use information
+    lu_field_ref: Dict
+        Dictionary of land use categories (expected values from `lu_field`)
+        as keys and output field names as values.
+
+    Returns a data frame with the same index as `df` and a column for each
+    output field implied by `lu_field_ref`. Each row's square footage is
+    recorded in the field its land use maps to (0 in all other fields), as
+    `sqFtByLu` does for a feature class, without reading or writing it. Land
+    use columns are routed by categorical code (see `categories`); other
+    columns are encoded first.
+    """
+    update_fields = sorted({v for v in lu_field_ref.values()})
+    # route by categorical code: look up each land use category's output field
+    #  index once, then index the lookup with the codes (-1 = not routed)
+    lu = df[lu_field]
+    if not hasattr(lu, "cat"):
+        lu = lu.astype("category")
+    field_idx = {field: i for i, field in enumerate(update_fields)}
+    lookup = np.array(
+        [field_idx.get(lu_field_ref.get(cat), -1) for cat in lu.cat.categories] + [-1]
+    )
+    routes = lookup[lu.cat.codes.values]
+    sqft = df[sqft_field].fillna(0).values
+    out_df = pd.DataFrame(index=df.index)
+    for i, update_field in enumerate(update_fields):
+        out_df[update_field] = np.where(routes == i, sqft, 0)
+    return out_df
+
+
+def sqFtByLu_pd(in_fc, id_field, sqft_field, lu_field, lu_field_ref,
+                where_clause=None, chunk_size=None):
     """
     in_fc: String (path to feature class)
         Feature class 
+    id_field: String
+        Unique id field in `in_fc`
     sqft_field: String
         Field in `in_fc` that contains building square footage
     lu_field: String
@@ -120,36 +163,26 @@ def sqFtByLu_pd(in_fc, id_field, sqft_field, lu_field, lu_field_ref,
         in a given category will be recorded in the field list implied by
         the dictionary values. These fields will be added to `in_fc` if
         they do not already exist.
+    where_clause: String, optional
+        SQL clause selecting the features to update; other features are not
+        changed
+    chunk_size: Integer, optional
+        Maximum number of features read and updated at a time; if None all
+        features are processed at once.
+
+    Streaming version of `sqFtByLu`: features are read in chunks, pivoted with
+    `sqFtByLu_df` and written back before the next chunk is read, so memory
+    use is bounded by `chunk_size`. Returns the number of features updated.
     """
-    # Add lu fields if needed
-    update_fields = sorted({v for v in lu_field_ref.values()})
-    # TODO: update as a pandas vector-based calc to avoid `AddField`, `CalcField` calls
+    def _pivot(df):
+        out_df = sqFtByLu_df(df, sqft_field, lu_field, lu_field_ref)
+        return np.trunc(out_df).astype(np.int64)
 
-    all_fields = [id_field, lu_field, sqft_field]
-    # Dump in_fc to df
-    df = pd.DataFrame(
-        arcpy.da.TableToNumPyArray(
-            in_fc, all_fields, where_clause=where_clause
-        )
+    return map_chunks(
+        in_table=in_fc,
+        id_field=id_field,
+        fields=[lu_field, sqft_field],
+        func=_pivot,
+        chunk_size=chunk_size,
+        where_clause=where_clause,
     )
-
-    for update_field in update_fields:
-        # Check if the field exists
-        try:
-            f = arcpy.ListFields(in_fc, update_field)[0]
-            # Reset field value to zero
-            arcpy.CalculateField_management(in_fc, update_field, 0)
-        except IndexError:
-            # Add the field
-            arcpy.AddField_management(in_fc, update_field, "LONG")
-    # Update field values using a cursor
-    all_fields = update_fields + [lu_field, sqft_field]
-    with arcpy.da.UpdateCursor(in_fc, all_fields) as c:
-        for r in c:
-            bldg_area = r[-1]
-            lu = r[-2]
-            update_field = lu_field_ref.get(lu, "")
-            if update_field:
-                update_idx = update_fields.index(update_field)
-                r[update_idx] = bldg_area
-                c.updateRow(r)
\ No newline at end of file
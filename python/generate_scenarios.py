@@ -25,6 +25,21 @@ ANALYSIS SPECS:
       - `TECH`: Station types may change based on selected tech (for LCRT always use `BRT`)
       - `SHARE_THRESHOLD`: The proportion of a parcel feature that needs to overlap a 
          TOD station area polygon to be considered "within" the station area.
+      - `CHUNK_SIZE`: Maximum number of parcel rows read or written at a time by the
+         per-parcel stages (suitability, parcel attributes). None processes the parcel
+         base at once; set (e.g., 250000) to bound memory use on regional parcel bases.
+      - `REBUILD_STORE`: If True, the memory-mapped parcel attribute store is re-exported
+         from `parcels` (required after the parcel features are edited).
+      - `RUN_SUMMARY`: If True, a table of stage timings, row counts and memory use is
+         printed at the end of each scenario (stage records are always appended to the
+         scenario's `run_report.jsonl`).
+      - `RECORD_GOLDEN`: If True, each scenario's allocation inputs and reference output
+         are stored as golden files in `{scenarios_ws}/golden`, for checking alternative
+         allocation engines against real inputs (see `equivalence.py`).
+      - `SPILLOVER_BOOST`: If set (e.g., 0.1), development spills over to neighboring
+         parcels: each parcel's allocation suitability is raised by this amount times the
+         share of its (queen contiguous) neighbors already allocated development (see
+         `allocation.allocate_spillover`). None allocates strictly by suitability rank.
 
   - Use groupings (support consistent field naming and references by use category)
       - `RES`: residential use groupings
@@ -83,10 +98,8 @@ STANDARD INPUTS:
       - `pipe_fld_ref`: Dictionary with keys listing expected (relevant)
          categories in `newpipe_lu` and values that relate each category to a use in 
          `USES`
-      - `new_dev_wc`: Where clause to select features from `newpipe_fc` that are new 
-         developments
-      - `pipe_wc`: Where clause to select features from `newpipe_fc` that are pipeline 
-         developments
+         (categories in `newpipe_lu` are routed to new or pipeline fields by these
+         dictionaries, so no where clause is needed to separate them)
       
   - `stations`: Point file of all station potential locations. This feature class
      includes attribute corresponding to scenario names. Values in these attributes
@@ -159,15 +172,24 @@ import arcpy
 
 from suitability import generate_suitability
 from walksheds import generate_walksheds
-from existing_sqft import sqFtByLu
-from allocation import allocate_df, allocate_dict
+from existing_sqft import sqFtByLu_df
+from allocation import allocate_df, allocate_dict, allocate_spillover
+from parcel_frame import ParcelFrame
+from capacity_ledger import CapacityLedger
+from parcel_store import open_store
+from run_report import RunReport, summary_table
+from equivalence import record_inputs
+from categories import CategoryCodes, LAND_USE, PROPERTY_TYPE, STATION
+from summaries import activity_fields, conversion_factors, summarize
+from crosswalk import load_crosswalk, dominant_zone
+from contiguity import load_graph
 from os import path
 from tod.TOD import (
     createTODTemplatesGDB,
     applyTODTemplates,
     adjustTargetsBasedOnExisting2,
 )
-from tod.HandyGP import extendTableDf, dfToArcpyTable
+from tod.HandyGP import extendTableDf, dfToArcpyTable, dfToArray
 import pandas as pd
 import numpy as np
 
@@ -182,6 +204,11 @@ arcpy.env.overwriteOutput = True
 USE_NET = False
 TECH = "BRT"
 SHARE_THRESHOLD = 0.5
+CHUNK_SIZE = None
+REBUILD_STORE = False
+RUN_SUMMARY = True
+RECORD_GOLDEN = False
+SPILLOVER_BOOST = None
 
 # Use groupings
 RES = ["SF", "MF"]
@@ -189,6 +216,7 @@ NRES = ["Ret", "Ind", "Off"]
 HOTEL = ["Hot"]
 UNTRACKED = ["Oth"]
 USES = RES + NRES + HOTEL + UNTRACKED
+TRACKED = [use for use in USES if use not in UNTRACKED]
 
 # Suitability weightings
 weights = {
@@ -308,6 +336,23 @@ basecap_sqft = "EXP_Sqft"
 basecap_lu = "Exp_LU"
 base_sf_cap = "SF_Cpct"
 flu_lock = "FLU_LOCK"
+parcel_store_dir = path.join(scenarios_ws, "parcel_store")  # exported once, reused by later runs
+parcel_store_fields = [
+    is_do_field,
+    do_prop_field,
+    acres_field,
+    seg_id_field,
+    current_lu_field,
+    exp_lu_field,
+    in_pipe_field,
+    flu_lock,
+    par_bld_sqft_field,
+    par_sqft_field,
+    basecap_sqft,
+    basecap_lu,
+    base_sf_cap,
+    "SHAPE@AREA",
+]
 
 # New/pipeline features
 newpipe_fc = "pipeline_with_pid"
@@ -338,8 +383,6 @@ pipe_fld_ref = {
     "Student Pipeline": "Oth",
     "Single Family Pipeline": "SF",
 }
-new_dev_wc = arcpy.AddFieldDelimiters(newpipe_fc, newpipe_lu) + " LIKE '%New'"
-pipe_wc = arcpy.AddFieldDelimiters(newpipe_fc, newpipe_lu) + " LIKE '%Pipeline'"
 
 # Stations
 stations = "stations_LCRT_BRT_scenarios_20200814"
@@ -355,6 +398,8 @@ restrictions = None
 taz = path.join(source_gdb, "TAZ_LCRT_SBF08122020v2")
 tid = "Big_TAZ"
 taz_wc = arcpy.AddFieldDelimiters(taz, 'LCRT') + "= 1"
+taz_xwalk_file = path.join(scenarios_ws, "parcel_taz_crosswalk.csv")  # built once, reused by all scenarios
+contiguity_file = path.join(scenarios_ws, "parcel_contiguity.npz")  # built once if SPILLOVER_BOOST is set
 
 # Control variables
 control_tbl = path.join(project_dir, "tables", "control_totals_111620.csv")
@@ -387,6 +432,16 @@ alloc_fields = genFieldList(suffix="Alloc",
 future_fields = genFieldList(suffix="Fut",
                              include_untracked=False)  # 2040 sqft combines existing/pipeline and allocated sqft
 
+# capacity ledger phases (field suffixes above); parcel floor area estimates are held
+#  as a parcels x uses x phases array and written as `{Use}_SF_{Phase}` fields at export
+ledger_phases = ["Par", "New", "Pipe", "Ex", "ExPi", "BCap", "Plan", "Adj", "TotCap", "ChgCap",
+                 "Alloc", "Fut"]
+ledger_phase_uses = {
+    phase: TRACKED for phase in ["Plan", "Adj", "TotCap", "ChgCap", "Alloc", "Fut"]
+}
+ledger_field_types = {"Adj": "DOUBLE", "TotCap": "DOUBLE"}
+ledger_export_phases = [phase for phase in ledger_phases if phase != "Adj"]
+
 # FAR conversions for AGOL
 far_expi_fields = genFieldList(suffix="ExPi", measure="FAR", include_untracked=False)  # FAR for existing and pipeline
 far_alloc_fields = genFieldList(suffix="Alloc", measure="FAR", include_untracked=False)  # FAR allocated
@@ -408,6 +463,31 @@ try:
     if not arcpy.Exists(scenarios_ws):
         pth, name = path.split(scenarios_ws)
         arcpy.CreateFolder_management(out_folder_path=pth, out_name=name)
+    # Parcel attribute store (source parcel attributes are the same for all scenarios)
+    parcel_store = open_store(
+        store_dir=parcel_store_dir,
+        in_table=parcels,
+        id_field=id_field,
+        fields=parcel_store_fields,
+        chunk_size=CHUNK_SIZE,
+        rebuild=REBUILD_STORE,
+    )
+    # Parcel-TAZ crosswalk (parcel and TAZ geometry are the same for all scenarios)
+    taz_xwalk = load_crosswalk(
+        xwalk_file=taz_xwalk_file,
+        parcels=parcels,
+        parcel_id=id_field,
+        zones=taz,
+        zone_id=tid,
+    )
+    # Parcel neighbors for spillover allocation
+    if SPILLOVER_BOOST is not None:
+        parcel_graph = load_graph(
+            graph_file=contiguity_file,
+            parcels=parcels,
+            parcel_id=id_field,
+        )
+
     # Run each scenario
     for scenario in scenarios:
         # Create the scenario workspace folder if needed
@@ -419,768 +499,646 @@ try:
                 out_folder_path=scenarios_ws, out_name=scenario
             )
 
+        # Per-stage timing, row counts and memory use for this run
+        report = RunReport(scenario, out_file=path.join(scen_ws, "run_report.jsonl"))
+
         # Drop scenario gdb for a clean run
         #  (NumPyArrayToTable cannot overwrite existing tables)
-        if arcpy.Exists(scen_gdb):
-            print "Deleting existing scenario db for new run..."
-            arcpy.Delete_management(scen_gdb)
-
-        # Create the scenario gdb
-        print "Creating scenario gdb..."
-        scen_gdb = createTODTemplatesGDB(
-            in_folder=scen_ws,
-            gdb_name="{}_scenario.gdb".format(scenario),
-            sr=scenarios_sr,
-        )
+        with report.stage("setup"):
+            if arcpy.Exists(scen_gdb):
+                print "Deleting existing scenario db for new run..."
+                arcpy.Delete_management(scen_gdb)
+
+            # Create the scenario gdb
+            print "Creating scenario gdb..."
+            scen_gdb = createTODTemplatesGDB(
+                in_folder=scen_ws,
+                gdb_name="{}_scenario.gdb".format(scenario),
+                sr=scenarios_sr,
+            )
 
-        # extend station type table
-        print "Extending station types table with embellishments..."
-        st_type_tbl = path.join(scen_gdb, "station_area_types")
-        type_emb = pd.read_csv(st_type_emb_tbl)
-        type_emb_arr = np.array(
-            np.rec.fromrecords(
-                recList=type_emb.values, names=type_emb.dtypes.index.tolist()
+            # extend station type table
+            print "Extending station types table with embellishments..."
+            st_type_tbl = path.join(scen_gdb, "station_area_types")
+            type_emb = pd.read_csv(st_type_emb_tbl)
+            type_emb_arr = dfToArray(type_emb)
+            # Add embellishsments
+            arcpy.da.ExtendTable(
+                in_table=st_type_tbl,
+                table_match_field="stn_type",
+                in_array=type_emb_arr,
+                array_match_field="stn_type",
             )
-        )
-        # Add embellishsments
-        arcpy.da.ExtendTable(
-            in_table=st_type_tbl,
-            table_match_field="stn_type",
-            in_array=type_emb_arr,
-            array_match_field="stn_type",
-        )
 
-        # Import scenario stations into the new GDB
-        print "Pushing scenario stations to gdb..."
-        stations_wc = arcpy.AddFieldDelimiters(stations, scenario) + " <> 'NA'"
-        stations_fl = arcpy.MakeFeatureLayer_management(
-            in_features=stations, out_layer="stat_scenario", where_clause=stations_wc
-        )
+            # Import scenario stations into the new GDB
+            print "Pushing scenario stations to gdb..."
+            stations_wc = arcpy.AddFieldDelimiters(stations, scenario) + " <> 'NA'"
+            stations_fl = arcpy.MakeFeatureLayer_management(
+                in_features=stations, out_layer="stat_scenario", where_clause=stations_wc
+            )
 
-        # Assume stations source has the template fields already populated (stn_type, stn_name, stn_order)
-        arcpy.Append_management(
-            inputs=stations_fl,
-            target=path.join(scen_gdb, "stations"),
-            schema_type="NO_TEST",
-        )
-        """ TODO: modify TOD.py to generate customized tables 
-            (ie _todTemplatesFromConfig() ...insert csv as templates for stn_types and gradients)
-            existing strategy is to modify the defaults to fit LCRT needs
-        """
+            # Assume stations source has the template fields already populated (stn_type, stn_name, stn_order)
+            arcpy.Append_management(
+                inputs=stations_fl,
+                target=path.join(scen_gdb, "stations"),
+                schema_type="NO_TEST",
+            )
+            """ TODO: modify TOD.py to generate customized tables 
+                (ie _todTemplatesFromConfig() ...insert csv as templates for stn_types and gradients)
+                existing strategy is to modify the defaults to fit LCRT needs
+            """
         # Build walkshed for suitability calculations
-        print "Generating walksheds..."
-        walk_shed = generate_walksheds(
-            stations=stations_fl,
-            walk_net=walk_net,
-            imp_field=imp_field,
-            cost=cost,
-            out_gdb=scen_gdb,
-            stations_wc=None,
-        )
+        with report.stage("walksheds"):
+            print "Generating walksheds..."
+            walk_shed = generate_walksheds(
+                stations=stations_fl,
+                walk_net=walk_net,
+                imp_field=imp_field,
+                cost=cost,
+                out_gdb=scen_gdb,
+                stations_wc=None,
+            )
+
+        # Land use, property type and station name codes shared by all stages
+        codes = CategoryCodes()
 
         # generate suitability table and tack on the tot_suit to parcel data
-        print "Evaluating suitability..."
-        suit_fc, suit_table = generate_suitability(
-            in_suit_fc=parcels,
-            id_field=id_field,
-            is_do_field=is_do_field,
-            do_prop_field=do_prop_field,
-            acres_field=acres_field,
-            seg_id_field=seg_id_field,
-            current_lu_field=current_lu_field,
-            exp_lu_field=exp_lu_field,
-            pipe_field=in_pipe_field,
-            stations=stations_fl,
-            station_buffers=walk_shed,
-            weights=weights,
-            flu_lock=flu_lock,
-            out_gdb=scen_gdb,
-            tod_excl_lu=tod_excl_lu,
-            alloc_excl_lu=alloc_excl_lu,
-            stations_wc=None,
-        )
+        with report.stage("suitability"):
+            print "Evaluating suitability..."
+            suit_fc, suit_table = generate_suitability(
+                in_suit_fc=parcels,
+                id_field=id_field,
+                is_do_field=is_do_field,
+                do_prop_field=do_prop_field,
+                acres_field=acres_field,
+                seg_id_field=seg_id_field,
+                current_lu_field=current_lu_field,
+                exp_lu_field=exp_lu_field,
+                pipe_field=in_pipe_field,
+                stations=stations_fl,
+                station_buffers=walk_shed,
+                weights=weights,
+                flu_lock=flu_lock,
+                out_gdb=scen_gdb,
+                tod_excl_lu=tod_excl_lu,
+                alloc_excl_lu=alloc_excl_lu,
+                stations_wc=None,
+                codes=codes,
+                chunk_size=CHUNK_SIZE,
+                store=parcel_store,
+            )
+
+        # Load parcel attributes once; the stages below update the parcel frame
+        #  in memory and the parcel features are written once at the end
+        with report.stage("parcel_load"):
+            print "Loading parcel attributes..."
+            parcel_frame = ParcelFrame(
+                in_fc=suit_fc,
+                id_field=id_field,
+                fields=[
+                    seg_id_field,
+                    current_lu_field,
+                    basecap_lu,
+                    par_bld_sqft_field,
+                    par_sqft_field,
+                    basecap_sqft,
+                    base_sf_cap,
+                    flu_lock,
+                    "alloc_suit",
+                    "SHAPE@AREA",
+                ],
+                categories={current_lu_field: LAND_USE, basecap_lu: LAND_USE},
+                codes=codes,
+                chunk_size=CHUNK_SIZE,
+                store=parcel_store,
+            )
 
         # Estimate existing, pipeline
         #  -- Parcel-based estimates
-        print "Appending existing activity data to parcel features based on parcel attributes"
-        _par_est_fld_ref = makeFieldRefDict(par_est_fld_ref, "Par")
-        sqFtByLu(
-            in_fc=suit_fc,
-            sqft_field=par_bld_sqft_field,
-            lu_field=current_lu_field,
-            lu_field_ref=_par_est_fld_ref,
-            where_clause=None,
-        )
-
-        # -- From New Dev features
-        print "...Estimating new activity"
-        newpipe = arcpy.FeatureClassToFeatureClass_conversion(
-            newpipe_fc, scen_gdb, "newpipe"
-        )
-        _new_dev_fld_ref = makeFieldRefDict(new_dev_fld_ref, "New")
-        sqFtByLu(
-            in_fc=newpipe,
-            sqft_field=newpipe_sqft,
-            lu_field=newpipe_lu,
-            lu_field_ref=_new_dev_fld_ref,
-            where_clause=new_dev_wc,
-        )
-
-        # -- Pipeline dev
-        print "...Estimating pipeline development"
-        _pipe_fld_ref = makeFieldRefDict(pipe_fld_ref, "Pipe")
-        sqFtByLu(
-            in_fc=newpipe,
-            sqft_field=newpipe_sqft,
-            lu_field=newpipe_lu,
-            lu_field_ref=_pipe_fld_ref,
-            where_clause=pipe_wc,
-        )
-
-        # -- Sum to parcels
-        print "...Summarizing new and pipeline data to parcel level"
-        newpipe_fields = [newpipe_par_field] + new_dev_fields + pipe_fields
-        newpipe_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=newpipe, field_names=newpipe_fields, null_value=0
+        with report.stage("existing_pipeline"):
+            print "Appending existing activity data to parcel features based on parcel attributes"
+            ledger = CapacityLedger(
+                index=parcel_frame.index,
+                uses=USES,
+                phases=ledger_phases,
+                phase_uses=ledger_phase_uses,
+                field_types=ledger_field_types,
+            )
+            _par_est_fld_ref = makeFieldRefDict(par_est_fld_ref, "Par")
+            ledger.load_frame(
+                sqFtByLu_df(
+                    df=parcel_frame.df,
+                    sqft_field=par_bld_sqft_field,
+                    lu_field=current_lu_field,
+                    lu_field_ref=_par_est_fld_ref,
+                )
             )
-        )
-        newpipe_sum = newpipe_df.groupby(newpipe_par_field).sum().reset_index()
-        # -- Extend table
-        print "...Adding new and pipeline data to parcels"
-        extendTableDf(
-            in_table=suit_fc,
-            table_match_field=id_field,
-            df=newpipe_sum,
-            df_match_field=newpipe_par_field,
-            append_only=False,
-        )
 
-        # -- Calculate fields
-        print "...Calculating existing (parcel-based & new development)"
-        for ex_lu_field, par_est_field, new_dev_field in zip(
-                ex_lu_fields, par_est_fields, new_dev_fields
-        ):
-            arcpy.AddField_management(suit_fc, ex_lu_field, "LONG")
-            with arcpy.da.UpdateCursor(
-                    suit_fc, [par_est_field, new_dev_field, ex_lu_field]
-            ) as c:
-                for r in c:
-                    par_val, new_dev_val, ex_lu_val = r
-                    if new_dev_val:
-                        r[-1] = new_dev_val
-                    else:
-                        r[-1] = par_val
-                    c.updateRow(r)
-
-        print "...Calculating existing + pipeline"
-        for ex_lu_field, pipe_field, expi_field in zip(
-                ex_lu_fields, pipe_fields, expi_fields
-        ):
-            arcpy.AddField_management(suit_fc, expi_field, "LONG")
-            with arcpy.da.UpdateCursor(
-                    suit_fc, [ex_lu_field, pipe_field, expi_field]
-            ) as c:
-                for r in c:
-                    ex_val, pipe_val, expi_val = r
-                    if ex_val is None:
-                        ex_val = 0
-                    if pipe_val is None:
-                        pipe_val = 0
-                    r[-1] = ex_val + pipe_val
-                    c.updateRow(r)
-
-        # Address "planned" development (expected LU but not pipeline)
-        # for each expected land use, report the expecte sf based on FAR or num units
-        # "Pivot out" the baseline expected floor area for all parcels
-        print "...Pivoting baseline development capacity"
-        bcap_suffix = basecap_fields[0].split("_SF_")[-1]
-        _bcap_fld_ref = makeFieldRefDict(par_est_fld_ref, bcap_suffix)
-        bcap_wc = arcpy.AddFieldDelimiters(suit_fc, in_pipe_field) + " <> 1"
-        sqFtByLu(
-            in_fc=suit_fc,
-            sqft_field=basecap_sqft,
-            lu_field=basecap_lu,
-            lu_field_ref=_bcap_fld_ref,
-            where_clause=bcap_wc,
-        )
-        # include SF RES capacity
-        print "...Patching SF res baseline cap"
-        sf_res_cap_field = "SF_SF_{}".format(bcap_suffix)
-        sf_expr = "!{}! * {}".format(base_sf_cap, activity_sf_factors["SF"])
-        arcpy.CalculateField_management(
-            suit_fc, sf_res_cap_field, sf_expr, expression_type="PYTHON")
-
-        # -- Dump basecaps to df
-        bcap_df_fields = [id_field] + basecap_fields
-        bcap_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=suit_fc, field_names=bcap_df_fields, null_value=0.0
+            # -- From New Dev features
+            #  (property types route to "New" or "Pipe" fields by category)
+            print "...Estimating new activity"
+            newpipe = arcpy.FeatureClassToFeatureClass_conversion(
+                newpipe_fc, scen_gdb, "newpipe"
+            )
+            newpipe_frame = ParcelFrame(
+                in_fc=newpipe,
+                id_field=arcpy.Describe(newpipe).OIDFieldName,
+                fields=[newpipe_par_field, newpipe_sqft, newpipe_lu],
+                categories={newpipe_lu: PROPERTY_TYPE},
+                codes=codes,
+                chunk_size=CHUNK_SIZE,
+            )
+            _new_dev_fld_ref = makeFieldRefDict(new_dev_fld_ref, "New")
+            newpipe_frame.update(
+                sqFtByLu_df(
+                    df=newpipe_frame.df,
+                    sqft_field=newpipe_sqft,
+                    lu_field=newpipe_lu,
+                    lu_field_ref=_new_dev_fld_ref,
+                )
             )
-        )
-        print "...(total SF cap: {})".format(bcap_df[sf_res_cap_field].sum())
-
-        # Calculate "planned dev" (expi + bcap for "locked in" parcels)
-        print "...Calculating planned dev (ExPi + Bcap-for-locked-in-parcels)"
-        for plan_field, expi_field, bcap_field in zip(
-                plan_fields, expi_fields, basecap_fields
-        ):
-            arcpy.AddField_management(suit_fc, plan_field, "LONG")
-            with arcpy.da.UpdateCursor(
-                    suit_fc, [plan_field, expi_field, bcap_field, flu_lock]
-            ) as c:
-                for r in c:
-                    plan_val, expi_val, bcap_val, locked = r
-                    if locked == 1:
-                        if bcap_val is None:
-                            bcap_val = 0
-                        if expi_val is None:
-                            expi_val = 0
-                        plan_val = expi_val + bcap_val
-                    else:
-                        plan_val = expi_val
-                    r[0] = plan_val
-                    c.updateRow(r)
 
-        # Apply TOD templates
-        print "Applying TOD templates..."
-        if USE_NET:
-            # Net-based run:
-            applyTODTemplates(
-                in_gdb=scen_gdb,
-                fishnet_fc=suit_fc,
-                fishnet_id=id_field,
-                technology_name=TECH,
-                fishnet_suitability_field="tod_suit",
-                fishnet_where_clause="",
-                network_dataset=walk_net,
-                impedance_attribute=imp_field,
-                restrictions=restrictions,
-                preset_stations_field=None,
-                weight_by_area=True,
-                share_threshold=SHARE_THRESHOLD,
+            # -- Pipeline dev
+            print "...Estimating pipeline development"
+            _pipe_fld_ref = makeFieldRefDict(pipe_fld_ref, "Pipe")
+            newpipe_frame.update(
+                sqFtByLu_df(
+                    df=newpipe_frame.df,
+                    sqft_field=newpipe_sqft,
+                    lu_field=newpipe_lu,
+                    lu_field_ref=_pipe_fld_ref,
+                )
             )
-            dev_area_tbl = path.join(scen_gdb, "dev_area_activities_net_suit")
-        else:
-            # Simple buffer-based run:
-            applyTODTemplates(
-                in_gdb=scen_gdb,
-                fishnet_fc=suit_fc,
-                fishnet_id=id_field,
-                technology_name=TECH,
-                fishnet_suitability_field="tod_suit",
-                fishnet_where_clause="",
-                preset_stations_field=None,
-                weight_by_area=True,
-                share_threshold=SHARE_THRESHOLD,
+            newpipe_frame.write()
+
+            # -- Sum to parcels
+            print "...Summarizing new and pipeline data to parcel level"
+            newpipe_sum = newpipe_frame.df.groupby(newpipe_par_field)[
+                new_dev_fields + pipe_fields].sum()
+            # -- Add to parcels
+            print "...Adding new and pipeline data to parcels"
+            ledger.load_frame(newpipe_sum)
+
+            # -- Calculate fields
+            print "...Calculating existing (parcel-based & new development)"
+            new_dev_vals = ledger["New"]
+            ledger.set("Ex", np.where(new_dev_vals != 0, new_dev_vals, ledger["Par"]))
+
+            print "...Calculating existing + pipeline"
+            ledger.sum_phases("ExPi", ["Ex", "Pipe"])
+
+            # Address "planned" development (expected LU but not pipeline)
+            # for each expected land use, report the expecte sf based on FAR or num units
+            # "Pivot out" the baseline expected floor area for all parcels
+            #  (like `sqFtByLu`, this is applied to all parcels, including those in
+            #  the pipeline)
+            print "...Pivoting baseline development capacity"
+            bcap_suffix = basecap_fields[0].split("_SF_")[-1]
+            _bcap_fld_ref = makeFieldRefDict(par_est_fld_ref, bcap_suffix)
+            ledger.load_frame(
+                sqFtByLu_df(
+                    df=parcel_frame.df,
+                    sqft_field=basecap_sqft,
+                    lu_field=basecap_lu,
+                    lu_field_ref=_bcap_fld_ref,
+                )
             )
-            dev_area_tbl = path.join(scen_gdb, "dev_area_activities_suit")
+            # include SF RES capacity
+            print "...Patching SF res baseline cap"
+            sf_res_cap_field = "SF_SF_{}".format(bcap_suffix)
+            ledger.assign(
+                sf_res_cap_field, parcel_frame[base_sf_cap] * activity_sf_factors["SF"]
+            )
+            print "...(total SF cap: {})".format(int(ledger.total("BCap", uses=["SF"]).sum()))
+
+            # Calculate "planned dev" (expi + bcap for "locked in" parcels)
+            print "...Calculating planned dev (ExPi + Bcap-for-locked-in-parcels)"
+            locked = (parcel_frame[flu_lock] == 1).values[:, np.newaxis]
+            expi_vals = ledger["ExPi"]
+            ledger.set("Plan", np.where(locked, expi_vals + ledger["BCap"], expi_vals))
+
+        # Apply TOD templates
+        with report.stage("tod_templates"):
+            print "Applying TOD templates..."
+            if USE_NET:
+                # Net-based run:
+                applyTODTemplates(
+                    in_gdb=scen_gdb,
+                    fishnet_fc=suit_fc,
+                    fishnet_id=id_field,
+                    technology_name=TECH,
+                    fishnet_suitability_field="tod_suit",
+                    fishnet_where_clause="",
+                    network_dataset=walk_net,
+                    impedance_attribute=imp_field,
+                    restrictions=restrictions,
+                    preset_stations_field=None,
+                    weight_by_area=True,
+                    share_threshold=SHARE_THRESHOLD,
+                )
+                dev_area_tbl = path.join(scen_gdb, "dev_area_activities_net_suit")
+            else:
+                # Simple buffer-based run:
+                applyTODTemplates(
+                    in_gdb=scen_gdb,
+                    fishnet_fc=suit_fc,
+                    fishnet_id=id_field,
+                    technology_name=TECH,
+                    fishnet_suitability_field="tod_suit",
+                    fishnet_where_clause="",
+                    preset_stations_field=None,
+                    weight_by_area=True,
+                    share_threshold=SHARE_THRESHOLD,
+                )
+                dev_area_tbl = path.join(scen_gdb, "dev_area_activities_suit")
 
         # Adjust dev_area_activities_net_suit activity values to SQFT
-        print "Converting activity targets to Sq Ft targets from station type embellishments..."
-        for tgt_sf_field in tgt_sf_fields:
-            arcpy.AddField_management(dev_area_tbl, tgt_sf_field, "LONG")
-            arcpy.CalculateField_management(dev_area_tbl, tgt_sf_field, 0)
-
-        # -- Dump reference tables: stations, station_types, parcels
-        stations_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(stations, ["stn_name", "stn_type"])
-        )
-        stn_type_fields = ["stn_type"] + [
-            fld for k in tgt_sf_fields for fld in tgt_sf_field_dict[k][-2:]
-        ]
-        stn_types_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=st_type_tbl, field_names=stn_type_fields
+        with report.stage("target_sqft") as stage:
+            print "Converting activity targets to Sq Ft targets from station type embellishments..."
+            for tgt_sf_field in tgt_sf_fields:
+                arcpy.AddField_management(dev_area_tbl, tgt_sf_field, "LONG")
+                arcpy.CalculateField_management(dev_area_tbl, tgt_sf_field, 0)
+
+            # -- Dump reference tables: stations, station_types, parcels
+            stations_df = pd.DataFrame(
+                arcpy.da.TableToNumPyArray(stations, ["stn_name", "stn_type"])
             )
-        )
-        append_fields = [id_field, "stn_name"] + expi_fields + basecap_fields + plan_fields
-        parcels_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=suit_fc, field_names=append_fields, null_value=0.0
+            stn_type_fields = ["stn_type"] + [
+                fld for k in tgt_sf_fields for fld in tgt_sf_field_dict[k][-2:]
+            ]
+            stn_types_df = pd.DataFrame(
+                arcpy.da.TableToNumPyArray(
+                    in_table=st_type_tbl, field_names=stn_type_fields
+                )
+            )
+            parcel_frame.load(["stn_name"], categories={"stn_name": STATION})
+            parcels_df = (
+                parcel_frame.to_df(["stn_name"], index=True)
+                .join(ledger.to_frame(expi_fields + basecap_fields + plan_fields))
+                .reset_index()
             )
-        )
 
-        # -- Update dev_area_tbl to include more specific activity type sqft
-        tgt_act_fields = list({tgt_sf_field_dict[k][0] for k in tgt_sf_fields})
-        dev_area_fields = [id_field] + tgt_sf_fields + tgt_act_fields
-        with arcpy.da.UpdateCursor(dev_area_tbl, dev_area_fields) as c:
-            for r in c:
-                parcel_id = r[0]
-                stn_name = parcels_df[parcels_df[id_field] == parcel_id][
-                    "stn_name"
-                ].values[0]
-                stn_type = " - ".join(
-                    [
-                        stations_df[stations_df["stn_name"] == stn_name][
-                            "stn_type"
-                        ].values[0],
-                        TECH,
-                    ]
-                )
-                stn_type_data = stn_types_df[stn_types_df["stn_type"] == stn_type]
-                for tgt_sf_field in tgt_sf_fields:
-                    tgt_act_field, share_field, sqft_field = tgt_sf_field_dict[
-                        tgt_sf_field
-                    ]
-                    tgt_idx = dev_area_fields.index(tgt_act_field)
-                    update_idx = dev_area_fields.index(tgt_sf_field)
-                    tgt_val = r[tgt_idx]
-                    if tgt_val > 0:
-                        share = stn_type_data[share_field].values[0]
-                        sqft = stn_type_data[sqft_field].values[0]
-                        estimate = tgt_val * share * sqft
-                        r[update_idx] = estimate
-                        c.updateRow(r)
-
-        # -- Tack on existing + pipeline square footage fields to the dev_area_tbl
-        # -- Tack on planned square footage fields to the dev_area_tbl
-        extendTableDf(
-            in_table=dev_area_tbl,
-            table_match_field=id_field,
-            df=parcels_df,
-            df_match_field=id_field,
-            append_only=False,
-        )
+            # -- Update dev_area_tbl to include more specific activity type sqft
+            tgt_act_fields = list({tgt_sf_field_dict[k][0] for k in tgt_sf_fields})
+            dev_area_fields = [id_field] + tgt_sf_fields + tgt_act_fields
+            with arcpy.da.UpdateCursor(dev_area_tbl, dev_area_fields) as c:
+                for r in c:
+                    stage.count(read=1)
+                    parcel_id = r[0]
+                    stn_name = parcels_df[parcels_df[id_field] == parcel_id][
+                        "stn_name"
+                    ].values[0]
+                    stn_type = " - ".join(
+                        [
+                            stations_df[stations_df["stn_name"] == stn_name][
+                                "stn_type"
+                            ].values[0],
+                            TECH,
+                        ]
+                    )
+                    stn_type_data = stn_types_df[stn_types_df["stn_type"] == stn_type]
+                    for tgt_sf_field in tgt_sf_fields:
+                        tgt_act_field, share_field, sqft_field = tgt_sf_field_dict[
+                            tgt_sf_field
+                        ]
+                        tgt_idx = dev_area_fields.index(tgt_act_field)
+                        update_idx = dev_area_fields.index(tgt_sf_field)
+                        tgt_val = r[tgt_idx]
+                        if tgt_val > 0:
+                            share = stn_type_data[share_field].values[0]
+                            sqft = stn_type_data[sqft_field].values[0]
+                            estimate = tgt_val * share * sqft
+                            r[update_idx] = estimate
+                            c.updateRow(r)
+                            stage.count(written=1)
+
+            # -- Tack on existing + pipeline square footage fields to the dev_area_tbl
+            # -- Tack on planned square footage fields to the dev_area_tbl
+            extendTableDf(
+                in_table=dev_area_tbl,
+                table_match_field=id_field,
+                df=parcels_df,
+                df_match_field=id_field,
+                append_only=False,
+            )
 
         # Adjust build-out targets based on existing and pipeline development
-        print "Adjusting build-out targets based on existing and pipeline development"
-        adj_tgt_tbl = dev_area_tbl + "_adj"
-        tgt_suffix = tgt_sf_fields[0].split("_SF_")[-1]
-        # expi_suffix = expi_fields[0].split("_SF_")[-1]
-        plan_suffix = plan_fields[0].split("_SF_")[-1]
-        # expi_refs = [f.replace(tgt_suffix, expi_suffix) for f in tgt_sf_fields]
-        plan_refs = [f.replace(tgt_suffix, plan_suffix) for f in tgt_sf_fields]
-        adjustTargetsBasedOnExisting2(
-            dev_areas_table=dev_area_tbl,
-            id_field=id_field,
-            station_area_field="stn_name",
-            existing_fields=plan_refs,
-            target_fields=tgt_sf_fields,
-            out_fields=adj_fields,
-            out_table=adj_tgt_tbl,
-            where_clause=None,
-        )
+        with report.stage("adjust_targets"):
+            print "Adjusting build-out targets based on existing and pipeline development"
+            adj_tgt_tbl = dev_area_tbl + "_adj"
+            tgt_suffix = tgt_sf_fields[0].split("_SF_")[-1]
+            # expi_suffix = expi_fields[0].split("_SF_")[-1]
+            plan_suffix = plan_fields[0].split("_SF_")[-1]
+            # expi_refs = [f.replace(tgt_suffix, expi_suffix) for f in tgt_sf_fields]
+            plan_refs = [f.replace(tgt_suffix, plan_suffix) for f in tgt_sf_fields]
+            adjustTargetsBasedOnExisting2(
+                dev_areas_table=dev_area_tbl,
+                id_field=id_field,
+                station_area_field="stn_name",
+                existing_fields=plan_refs,
+                target_fields=tgt_sf_fields,
+                out_fields=adj_fields,
+                out_table=adj_tgt_tbl,
+                where_clause=None,
+            )
 
-        print "Blending TOD and baseline capacity estimates"
-        # "Pivot out" the baseline expected floor area for all parcels
-        # print "...Pivoting baseline development capacity"
-        # bcap_suffix = basecap_fields[0].split("_SF_")[-1]
-        # _bcap_fld_ref = makeFieldRefDict(par_est_fld_ref, bcap_suffix)
-        # bcap_wc = arcpy.AddFieldDelimiters(suit_fc, in_pipe_field) + " <> 1"
-        # sqFtByLu(
-        #     in_fc=suit_fc,
-        #     sqft_field=basecap_sqft,
-        #     lu_field=basecap_lu,
-        #     lu_field_ref=_bcap_fld_ref,
-        #     where_clause=bcap_wc,
-        # )
-        # # -- Dump basecaps to df
-        # bcap_df_fields = [id_field] + basecap_fields
-        # bcap_df = pd.DataFrame(
-        #     arcpy.da.TableToNumPyArray(
-        #         in_table=suit_fc, field_names=bcap_df_fields, null_value=0.0
-        #     )
-        # )
-        # -- Dump adjusted TOD caps to df
-        print "...masking baseline capacity with TOD capacity"
-        adj_df_fields = [id_field] + adj_fields
-        adj_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(in_table=adj_tgt_tbl, field_names=adj_df_fields)
-        )
-        # -- Merge and update TOD and base cap
-        cap_df = bcap_df.merge(adj_df, how="left", on=id_field)
-        for tcap, bcap, acap in zip(totcap_fields, basecap_fields, adj_fields):
-            acap_filter = np.isnan(cap_df[acap])
-            cap_df[tcap] = np.select(
-                [acap_filter],
-                [cap_df[bcap]],
-                cap_df[acap]
+        with report.stage("capacity") as stage:
+            print "Blending TOD and baseline capacity estimates"
+            # "Pivot out" the baseline expected floor area for all parcels
+            # print "...Pivoting baseline development capacity"
+            # bcap_suffix = basecap_fields[0].split("_SF_")[-1]
+            # _bcap_fld_ref = makeFieldRefDict(par_est_fld_ref, bcap_suffix)
+            # bcap_wc = arcpy.AddFieldDelimiters(suit_fc, in_pipe_field) + " <> 1"
+            # sqFtByLu(
+            #     in_fc=suit_fc,
+            #     sqft_field=basecap_sqft,
+            #     lu_field=basecap_lu,
+            #     lu_field_ref=_bcap_fld_ref,
+            #     where_clause=bcap_wc,
+            # )
+            # # -- Dump basecaps to df
+            # bcap_df_fields = [id_field] + basecap_fields
+            # bcap_df = pd.DataFrame(
+            #     arcpy.da.TableToNumPyArray(
+            #         in_table=suit_fc, field_names=bcap_df_fields, null_value=0.0
+            #     )
+            # )
+            # -- Dump adjusted TOD caps to the ledger
+            adj_df_fields = [id_field] + adj_fields
+            adj_df = pd.DataFrame(
+                arcpy.da.TableToNumPyArray(in_table=adj_tgt_tbl, field_names=adj_df_fields)
             )
-        # -- export full capacity estimates
-        print "...exporting blended capacity to 'capacity' table"
-        capacity_table = path.join(scen_gdb, "capacity")
-        dfToArcpyTable(cap_df, capacity_table)
-
-        print "Calculating change capacity"
-        # Get existing activity (ex_lu_fields)
-        ex_array_fields = [id_field] + ex_lu_fields
-        exist_array = arcpy.da.TableToNumPyArray(
-            suit_fc, ex_array_fields, null_value=0.0
-        )
-        # Extend capacity table
-        arcpy.da.ExtendTable(capacity_table, id_field, exist_array, id_field)
-        # Add fields and update
-        for ccap_field, tcap_field, ex_lu_field in zip(
-                chgcap_fields, totcap_fields, ex_lu_fields
-        ):
-            arcpy.AddField_management(capacity_table, ccap_field, "LONG")
-            with arcpy.da.UpdateCursor(
-                    capacity_table, [ccap_field, tcap_field, ex_lu_field]
-            ) as c:
-                for r in c:
-                    ccap, tcap, ex = r
-                    if tcap is None:
-                        r[0] = 0
-                    elif ex is None:
-                        r[0] = tcap
-                    else:
-                        if tcap - ex < 0:
-                            r[0] = 0
-                        else:
-                            r[0] = tcap - ex
-                    c.updateRow(r)
-        # Dump tot-capacity fields into suitabiltiy fc for FAR calcs
-        tcap_fields = [id_field] + totcap_fields + chgcap_fields
-        cap_array = arcpy.da.TableToNumPyArray(
-            capacity_table, tcap_fields, null_value=0.0
-        )
-        arcpy.da.ExtendTable(suit_fc, id_field, cap_array, id_field)
+            stage.count(read=len(adj_df))
+            ledger.load_frame(adj_df.set_index(id_field))
+            # -- Blend TOD and base cap (TOD capacity where available)
+            print "...masking baseline capacity with TOD capacity"
+            ledger.blend("TotCap", "Adj", "BCap")
+            # -- Calculate change capacity (total capacity minus existing)
+            print "Calculating change capacity"
+            ledger.change("ChgCap", "TotCap", "Ex")
+            # -- export full capacity estimates
+            print "...exporting blended capacity to 'capacity' table"
+            cap_df = ledger.to_frame(
+                basecap_fields + adj_fields + totcap_fields + ex_lu_fields + chgcap_fields
+            ).reset_index()
+            capacity_table = path.join(scen_gdb, "capacity")
+            dfToArcpyTable(cap_df, capacity_table)
+            stage.count(written=len(cap_df))
 
         # Run allocation
-        print "Allocating square footage based on change capacity and segment level control totals"
-        pipe_fields_noOther = pipe_fields[:-1]
-        p_flds = [id_field, seg_id_field, "alloc_suit"] + chgcap_fields + pipe_fields_noOther
-        pdf = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=suit_fc, field_names=p_flds, null_value=0.0
+        with report.stage("allocation"):
+            print "Allocating square footage based on change capacity and segment level control totals"
+            pipe_fields_noOther = pipe_fields[:-1]
+            pdf = parcel_frame.to_df([seg_id_field, "alloc_suit"], index=True).join(
+                ledger.to_frame(chgcap_fields + pipe_fields_noOther)
             )
-        ).set_index(keys=id_field)
-
-        ''' read control table to df '''
-        control_fields = ["Ind", "Ret", "MF", "SF", "Off", "Hot"]
-        control_seg_attr = "segment"
-        demand_phase = "group"
-        ctl_df = pd.read_csv(
-            control_tbl, usecols=control_fields + [control_seg_attr, demand_phase]
-        ).set_index(control_seg_attr)
-        ctl_df = ctl_df[ctl_df[demand_phase] == "net"].drop(demand_phase, axis=1)
-
-        # ''' remove activity sqft already absorbed by pipeline development '''
-        # pipeline_df = pdf[[seg_id_field] + pipe_fields_noOther]
-        # pipeline_by_seg = pipeline_df.groupby(seg_id_field).sum()
-        # for col in ctl_df.columns:
-        #     idx = ctl_df.columns.get_loc(col)
-        #     ctl_df[col] = np.where((ctl_df[col] != 0),
-        #                            ctl_df[col] - pipeline_by_seg.iloc[:, idx],
-        #                            0)
-        #     ctl_df[col] = np.where((ctl_df[col] < 0),
-        #                            0,
-        #                            ctl_df[col])
-
-        ''' run allocation '''
-        ctl_dict = ctl_df.T.to_dict()
-        allocation_df = allocate_dict(
-            suit_df=pdf,
-            suit_id_field=id_field,
-            suit_field="alloc_suit",
-            suit_df_seg_field=seg_id_field,
-            suit_cap_fields=chgcap_fields,
-            control_dict=ctl_dict,
-        )
-
-        # write out to parcels
-        extendTableDf(
-            in_table=suit_fc,
-            table_match_field=id_field,
-            df=allocation_df,
-            df_match_field=id_field,
-        )
 
-        # populate 2040 totals for each activity
-        print "Calculating 2040 sqft totals..."
-        for (
-                expi_field,
-                alloc_field,
-                future_field,
-        ) in zip(expi_fields, alloc_fields, future_fields):
-            arcpy.AddField_management(suit_fc, future_field, "LONG")
-            with arcpy.da.UpdateCursor(
-                    suit_fc, [expi_field, alloc_field, future_field]
-            ) as cur:
-                for row in cur:
-                    act_list = [val for val in row if val is not None]
-                    row[2] = sum(act_list)
-                    cur.updateRow(row)
-
-        # populate expi, alloc, and buildout parcel sum
-        print "Calculating summary square footage for developement phases.."
-        sum_sf_fields = ["ExPi_SF_sum", "Alloc_SF_sum", "Future_SF_sum"]
-        activity_fields = [expi_fields, alloc_fields, future_fields]
-        for summ, activities in zip(sum_sf_fields, activity_fields):
-            arcpy.AddField_management(in_table=suit_fc, field_name=summ, field_type="LONG")
-            print "\tAdding {} for each parcel...".format(summ)
-            with arcpy.da.UpdateCursor(in_table=suit_fc, field_names=[summ] + activities) as cur:
-                for row in cur:
-                    act_list = [val for val in row[1:] if val is not None]
-                    row[0] = sum(act_list)
-                    cur.updateRow(row)
-
-        # populate FAR by activity for visualization and summaries
-        # far = activity_sqft/parcel_sqft
-        print "Calculating FAR for each phase..."
-        FAR_phases = [
-            [alloc_fields, far_alloc_fields],
-            [expi_fields, far_expi_fields],
-            [future_fields, far_future_fields],
-        ]
-        for phase in FAR_phases:
-            for act_sqft_field, act_far_field in zip(phase[0], phase[1]):
-                arcpy.AddField_management(
-                    in_table=suit_fc, field_name=act_far_field, field_type="DOUBLE"
+            ''' read control table to df '''
+            control_fields = ["Ind", "Ret", "MF", "SF", "Off", "Hot"]
+            control_seg_attr = "segment"
+            demand_phase = "group"
+            ctl_df = pd.read_csv(
+                control_tbl, usecols=control_fields + [control_seg_attr, demand_phase]
+            ).set_index(control_seg_attr)
+            ctl_df = ctl_df[ctl_df[demand_phase] == "net"].drop(demand_phase, axis=1)
+
+            # ''' remove activity sqft already absorbed by pipeline development '''
+            # pipeline_df = pdf[[seg_id_field] + pipe_fields_noOther]
+            # pipeline_by_seg = pipeline_df.groupby(seg_id_field).sum()
+            # for col in ctl_df.columns:
+            #     idx = ctl_df.columns.get_loc(col)
+            #     ctl_df[col] = np.where((ctl_df[col] != 0),
+            #                            ctl_df[col] - pipeline_by_seg.iloc[:, idx],
+            #                            0)
+            #     ctl_df[col] = np.where((ctl_df[col] < 0),
+            #                            0,
+            #                            ctl_df[col])
+
+            ''' run allocation '''
+            ctl_dict = ctl_df.T.to_dict()
+            if RECORD_GOLDEN:
+                record_inputs(
+                    case_name="allocate",
+                    label=scenario,
+                    inputs={
+                        "suit_df": pdf.copy(),
+                        "suit_id_field": id_field,
+                        "suit_field": "alloc_suit",
+                        "suit_df_seg_field": seg_id_field,
+                        "suit_cap_fields": chgcap_fields,
+                        "control_dict": ctl_dict,
+                    },
+                    golden_dir=path.join(scenarios_ws, "golden"),
                 )
-                with arcpy.da.UpdateCursor(
-                        in_table=suit_fc,
-                        field_names=[act_sqft_field, act_far_field, par_sqft_field],
-                ) as c:
-                    for r in c:
-                        act_sqft, act_far, par_psqft = r
-                        if act_sqft is None:
-                            act_sqft = 0
-                        r[1] = act_sqft / par_psqft
-                        c.updateRow(r)
-
-        # create station area weighted FAR values for Indicator summaries
-        # create buildout summary sum_SF_build, activ_SF_build, wstat_FAR_build
-        print "Calculating weighted FAR for each station area parcels..."
-        station_sum_fields = [
-            "Wstat_ExPi_far",
-            "Wstat_Alloc_far",
-            "Wstat_Build_far",
-        ]
-        for field in station_sum_fields:
-            arcpy.AddField_management(
-                in_table=suit_fc, field_name=field, field_type="DOUBLE"
-            )
-        station_names = set(
-            row[0] for row in arcpy.da.SearchCursor(suit_fc, "stn_name")
-        )
-        for station in station_names:
-            if station is not None:
-                suit_fl = arcpy.MakeFeatureLayer_management(
-                    in_features=suit_fc,
-                    out_layer="suit_fl",
-                    where_clause="stn_name = '{}'".format(station),
+            if SPILLOVER_BOOST is None:
+                allocation_df = allocate_dict(
+                    suit_df=pdf,
+                    suit_id_field=id_field,
+                    suit_field="alloc_suit",
+                    suit_df_seg_field=seg_id_field,
+                    suit_cap_fields=chgcap_fields,
+                    control_dict=ctl_dict,
                 )
-                land_areas = arcpy.da.TableToNumPyArray(
-                    suit_fl, "SHAPE@AREA", skip_nulls=True
+            else:
+                allocation_df = allocate_spillover(
+                    suit_df=pdf,
+                    suit_id_field=id_field,
+                    suit_field="alloc_suit",
+                    suit_df_seg_field=seg_id_field,
+                    suit_cap_fields=chgcap_fields,
+                    control_dict=ctl_dict,
+                    graph=parcel_graph,
+                    boost=SPILLOVER_BOOST,
                 )
-                land_area = land_areas["SHAPE@AREA"].sum()
-                with arcpy.da.UpdateCursor(
-                        suit_fl,
-                        ["SHAPE@AREA"]
-                        + station_sum_fields
-                        + expi_fields[:-1]
-                        + alloc_fields
-                        + future_fields,
-                ) as cur:
-                    for row in cur:
-                        p_area, expi_far, alloc_far, build_far, \
-                        ep_sf, ep_mf, ep_ret, ep_ind, ep_off, ep_hot, \
-                        a_sf, a_mf, a_ret, a_ind, a_off, a_hot, \
-                        b_sf, b_mf, b_ret, b_ind, b_off, b_hot = row
-                        area_share = p_area / land_area  # land area share for station
-                        ep_sqft_sum = (ep_sf + ep_mf + ep_ret + ep_ind + ep_off + ep_hot)  # sum of activity sqft
-                        a_sqft_sum = (a_sf + a_mf + a_ret + a_ind + a_off + a_hot)  # sum of activity sqft
-                        b_sqft_sum = (b_sf + b_mf + b_ret + b_ind + b_off + b_hot)  # sum of activity sqft
-                        row[1] = (ep_sqft_sum / p_area) * area_share  # sum of activity sqft/par_sqft [expi]
-                        row[2] = (a_sqft_sum / p_area) * area_share  # sum of activity sqft/par_sqft [alloc]
-                        row[3] = (b_sqft_sum / p_area) * area_share  # sum of activity sqft/par_sqft [buildout]
-                        cur.updateRow(row)
-                arcpy.Delete_management(suit_fl)
 
-        # create Corridor Segment and TAZ summaries with conversion to RES and JOBS
-        print "Generating Segment and TAZ summary tables..."
-        taz = arcpy.FeatureClassToFeatureClass_conversion(in_features=taz, out_path=scen_gdb, out_name='taz')
-        p_fields = [id_field, "seg_num"] + ex_lu_fields + pipe_fields + expi_fields + alloc_fields
-        t_fields = [tid, 'LCRT_H20', 'LCRT_E20', 'LCRT_H40', 'LCRT_E40']
-        pwTAZ = arcpy.SpatialJoin_analysis(
-            target_features=suit_fc, join_features=taz,
-            out_feature_class="in_memory\parcels_wTAZ", match_option="INTERSECT"
-        )
-        p_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=pwTAZ, field_names=p_fields + t_fields[0:], null_value=0.0
+            # add to parcels (allocation fields are named `{act}_SF_alloc`)
+            allocation_df = allocation_df.set_index(id_field).rename(
+                columns={fld.replace("_Alloc", "_alloc"): fld for fld in alloc_fields}
             )
-        ).set_index(id_field)
-        t_df = pd.DataFrame(
-            arcpy.da.TableToNumPyArray(
-                in_table=taz, field_names=t_fields, where_clause=taz_wc, null_value=0.0
-            )
-        ).groupby(tid, as_index=False).sum()
-
-        ''' 
-        -------------------
-        segment summary 
-        -------------------
-        '''
-        seg_summaries = p_df.groupby(seg_id_field).sum()
-        seg_summaries.drop(tid, axis=1, inplace=True)
-        # calc Existing jobs and households
-        # calc EXPI jobs and households
-        seg_summaries["RES_EX"] = (
-                ((seg_summaries[ex_lu_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((seg_summaries[ex_lu_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        seg_summaries["JOBS_EX"] = ((seg_summaries[ex_lu_fields[2]] / activity_sf_factors["Ret"]) +
-                                    (seg_summaries[ex_lu_fields[3]] / activity_sf_factors["Ind"]) +
-                                    (seg_summaries[ex_lu_fields[4]] / activity_sf_factors["Off"]) +
-                                    (seg_summaries[ex_lu_fields[5]] / activity_sf_factors["Hot"]))
-        # calc PIPE jobs and households
-        seg_summaries["RES_PIPE"] = (
-                ((seg_summaries[pipe_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((seg_summaries[pipe_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        seg_summaries["JOBS_PIPE"] = ((seg_summaries[pipe_fields[2]] / activity_sf_factors["Ret"]) +
-                                      (seg_summaries[pipe_fields[3]] / activity_sf_factors["Ind"]) +
-                                      (seg_summaries[pipe_fields[4]] / activity_sf_factors["Off"]) +
-                                      (seg_summaries[pipe_fields[5]] / activity_sf_factors["Hot"]))
-
-        # calc EXPI jobs and housing
-        seg_summaries["RES_EXPI"] = (
-                ((seg_summaries[expi_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((seg_summaries[expi_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        seg_summaries["JOBS_EXPI"] = ((seg_summaries[expi_fields[2]] / activity_sf_factors["Ret"]) +
-                                      (seg_summaries[expi_fields[3]] / activity_sf_factors["Ind"]) +
-                                      (seg_summaries[expi_fields[4]] / activity_sf_factors["Off"]) +
-                                      (seg_summaries[expi_fields[5]] / activity_sf_factors["Hot"]))
-
-        # calc ALLOC jobs and households
-        seg_summaries["RES_ALLOC"] = (
-                ((seg_summaries[alloc_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((seg_summaries[alloc_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        seg_summaries["JOBS_ALLOC"] = ((seg_summaries[alloc_fields[2]] / activity_sf_factors["Ret"]) +
-                                       (seg_summaries[alloc_fields[3]] / activity_sf_factors["Ind"]) +
-                                       (seg_summaries[alloc_fields[4]] / activity_sf_factors["Off"]) +
-                                       (seg_summaries[alloc_fields[5]] / activity_sf_factors["Hot"]))
-
-        # calculate 2040 estimate of Jobs and households
-        seg_summaries["RES_2040"] = (seg_summaries['RES_PIPE'] +
-                                     seg_summaries['RES_ALLOC'] +
-                                     seg_summaries['LCRT_H20'])
-        seg_summaries["JOBS_2040"] = (seg_summaries['JOBS_PIPE'] +
-                                      seg_summaries['JOBS_ALLOC'] +
-                                      seg_summaries['LCRT_E20'])
-        seg_summaries.reset_index(inplace=True)
-
-        ''' 
-        ---------------
-        taz summary 
-        ---------------
-        '''
-        taz_summaries = p_df.drop(
-            labels=['LCRT_H20', 'LCRT_E20', 'LCRT_H40', 'LCRT_E40'],
-            axis=1).groupby(tid, as_index=False).sum()
-        taz_summaries.drop(
-            labels="seg_num",
-            axis=1,
-            inplace=True)
-        taz_summaries = taz_summaries.merge(t_df, on=tid)
-
-        # calc EXISTING jobs and households
-        taz_summaries["RES_EX"] = (
-                ((taz_summaries[ex_lu_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((taz_summaries[ex_lu_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        taz_summaries["JOBS_EX"] = (
-                (taz_summaries[ex_lu_fields[2]] / activity_sf_factors["Ret"]) +
-                (taz_summaries[ex_lu_fields[3]] / activity_sf_factors["Ind"]) +
-                (taz_summaries[ex_lu_fields[4]] / activity_sf_factors["Off"]) +
-                (taz_summaries[ex_lu_fields[5]] / activity_sf_factors['Hot'])
-        )
-        # calc PIPE jobs and households
-        taz_summaries["RES_PIPE"] = (
-                ((taz_summaries[pipe_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"])+
-                ((taz_summaries[pipe_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        taz_summaries["JOBS_PIPE"] = (
-                (taz_summaries[pipe_fields[2]] / activity_sf_factors["Ret"]) +
-                (taz_summaries[pipe_fields[3]] / activity_sf_factors["Ind"]) +
-                (taz_summaries[pipe_fields[4]] / activity_sf_factors["Off"]) +
-                (taz_summaries[pipe_fields[5]] / activity_sf_factors['Hot'])
-        )
+            ledger.load_frame(allocation_df[alloc_fields])
 
-        # calc EXPI jobs and households
-        taz_summaries["RES_EXPI"] = (
-                ((taz_summaries[expi_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((taz_summaries[expi_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        taz_summaries["JOBS_EXPI"] = (
-                (taz_summaries[expi_fields[2]] / activity_sf_factors["Ret"]) +
-                (taz_summaries[expi_fields[3]] / activity_sf_factors["Ind"]) +
-                (taz_summaries[expi_fields[4]] / activity_sf_factors["Off"]) +
-                (taz_summaries[expi_fields[5]] / activity_sf_factors['Hot'])
-        )
+        # populate 2040 totals for each activity
+        with report.stage("parcel_fields"):
+            print "Calculating 2040 sqft totals..."
+            ledger.sum_phases("Fut", ["ExPi", "Alloc"])
+
+            # populate expi, alloc, and buildout parcel sum
+            print "Calculating summary square footage for developement phases.."
+            sum_sf_fields = ["ExPi_SF_sum", "Alloc_SF_sum", "Future_SF_sum"]
+            for summ, phase in zip(sum_sf_fields, ["ExPi", "Alloc", "Fut"]):
+                print "\tAdding {} for each parcel...".format(summ)
+                parcel_frame.assign(summ, ledger.total(phase))
+
+            # populate FAR by activity for visualization and summaries
+            # far = activity_sqft/parcel_sqft (null where parcel sqft is 0)
+            print "Calculating FAR for each phase..."
+            par_psqft = parcel_frame[par_sqft_field].values.astype(float)
+            par_psqft[par_psqft == 0] = np.nan
+            for far_fields in [far_alloc_fields, far_expi_fields, far_future_fields]:
+                parcel_frame.update(
+                    ledger.to_frame(far_fields, measure="FAR", divisor=par_psqft),
+                    field_type="DOUBLE",
+                )
 
-        # calc ALLOC jobs and households
-        taz_summaries["RES_ALLOC"] = (
-                ((taz_summaries[alloc_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-                ((taz_summaries[alloc_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-        )
-        taz_summaries["JOBS_ALLOC"] = (
-                (taz_summaries[alloc_fields[2]] / activity_sf_factors["Ret"]) +
-                (taz_summaries[alloc_fields[3]] / activity_sf_factors["Ind"]) +
-                (taz_summaries[alloc_fields[4]] / activity_sf_factors["Off"]) +
-                (taz_summaries[alloc_fields[5]] / activity_sf_factors['Hot'])
-        )
+            # create station area weighted FAR values for Indicator summaries
+            # create buildout summary sum_SF_build, activ_SF_build, wstat_FAR_build
+            #  - each parcel's FAR weighted by its share of the station area's land
+            #    area, i.e. activity sqft / station area land area
+            print "Calculating weighted FAR for each station area parcels..."
+            station_sum_fields = [
+                "Wstat_ExPi_far",
+                "Wstat_Alloc_far",
+                "Wstat_Build_far",
+            ]
+            stn_codes = parcel_frame["stn_name"].cat.codes.values
+            in_station = stn_codes >= 0
+            # -- station land area by code (trailing NaN for parcels outside stations)
+            station_areas = np.bincount(
+                stn_codes[in_station],
+                weights=parcel_frame["SHAPE@AREA"].values[in_station],
+                minlength=len(codes.labels.get(STATION, [])),
+            )
+            land_area = np.append(station_areas, np.nan)[stn_codes]
+            for field, phase in zip(station_sum_fields, ["ExPi", "Alloc", "Fut"]):
+                sqft_sum = ledger.total(phase, uses=TRACKED)
+                parcel_frame.assign(
+                    field,
+                    np.where(in_station, sqft_sum / land_area, np.nan),
+                    field_type="DOUBLE",
+                )
 
-        # calculate 2040 estimate of Jobs and households
-        taz_summaries["RES_2040"] = (
-                taz_summaries['RES_ALLOC'] +
-                taz_summaries['RES_PIPE'] +
-                taz_summaries['LCRT_H20']
-        )
-        taz_summaries["JOBS_2040"] = (
-                taz_summaries['JOBS_ALLOC'] +
-                taz_summaries['JOBS_PIPE'] +
-                taz_summaries['LCRT_E20']
-        )
-        taz_summaries.reset_index(inplace=True)
-
-        # write out tables
-        taz_summaries.to_csv(path.join(scen_ws, "taz_summary.csv"))
-        seg_summaries.to_csv(path.join(scen_ws, "seg_summary.csv"))
-
-        # create DIFF between OUR RES/JOBS for TAZ to COG RES/JOBS for TAZ
-        res_job_fields = ["RES_EX", "RES_PIPE", "JOBS_EX", "JOBS_PIPE", "RES_EXPI", "JOBS_EXPI",
-                          "RES_ALLOC", "JOBS_ALLOC", "RES_2040", "JOBS_2040"]
-        taz_sum_simple = taz_summaries[[tid] + res_job_fields]
-        extendTableDf(
-            in_table=taz,
-            table_match_field=tid,
-            df=taz_sum_simple,
-            df_match_field=tid,
-            append_only=False,
-        )
-        # # update RES and JOBS to reflect proportion of full TAZ for all phases
-        # for f in res_job_fields:
-        #     arcpy.CalculateField_management(in_table=taz, field=f,
-        #                                     expression="!{}! * !Share!".format(f),
-        #                                     expression_type="PYTHON_9.3")
-
-        # calculate difference from current CoG estimates
-        arcpy.AddField_management(in_table=taz, field_name="RES_diff", field_type="DOUBLE")
-        arcpy.AddField_management(in_table=taz, field_name="JOBS_diff", field_type="DOUBLE")
-        arcpy.AddField_management(in_table=taz, field_name="JOBS_ALL_INST", field_type="DOUBLE")
-        arcpy.AddField_management(in_table=taz, field_name="JOBS_2040_INST", field_type="DOUBLE")
-        # combine ALLOCATED JOBS with projected INSTITUTIONAL JOBS
-        arcpy.CalculateField_management(in_table=taz, field="JOBS_ALL_INST",
-                                        expression="!JOBS_ALLOC! + !INST_JOBS!",
-                                        expression_type="PYTHON_9.3")
-        # recalculate 2040 JOBS estimate with INSTITUTIONAL JOBS
-        arcpy.CalculateField_management(in_table=taz, field="JOBS_2040_INST",
-                                        expression="!JOBS_ALL_INST! + !JOBS_PIPE! + !LCRT_E20!",
-                                        expression_type="PYTHON_9.3")
-        # Generate variance for TOD vs CoG jobs and res
-        arcpy.CalculateField_management(in_table=taz, field="JOBS_diff",
-                                        expression="!JOBS_2040_INST! - !LCRT_E40!",
-                                        expression_type="PYTHON_9.3")
-        arcpy.CalculateField_management(in_table=taz, field="RES_diff",
-                                        expression="!RES_2040! - !LCRT_H40!",
-                                        expression_type="PYTHON_9.3")
+        # Write parcel attributes to the parcel features
+        with report.stage("parcel_write"):
+            print "Updating parcel features..."
+            ledger.export(parcel_frame, phases=ledger_export_phases)
+            parcel_frame.write()
 
+        # create Corridor Segment and TAZ summaries with conversion to RES and JOBS
+        with report.stage("summaries"):
+            print "Generating Segment and TAZ summary tables..."
+            scen_taz = arcpy.FeatureClassToFeatureClass_conversion(
+                in_features=taz, out_path=scen_gdb, out_name='taz'
+            )
+            p_fields = ["seg_num"] + ex_lu_fields + pipe_fields + expi_fields + alloc_fields
+            t_fields = [tid, 'LCRT_H20', 'LCRT_E20', 'LCRT_H40', 'LCRT_E40']
+            taz_attrs = pd.DataFrame(
+                arcpy.da.TableToNumPyArray(
+                    in_table=scen_taz, field_names=t_fields, null_value=0.0
+                )
+            ).groupby(tid).sum()
+            # -- TAZ attributes for each parcel come from the TAZ holding the
+            #  largest share of its area; parcels outside all TAZs have TAZ 0
+            p_df = parcel_frame.to_df(p_fields, index=True)
+            p_df[tid] = dominant_zone(taz_xwalk, id_field, tid).reindex(p_df.index).fillna(0)
+            p_df = p_df.join(taz_attrs, on=tid).fillna(0.0)
+            t_df = pd.DataFrame(
+                arcpy.da.TableToNumPyArray(
+                    in_table=scen_taz, field_names=t_fields, where_clause=taz_wc, null_value=0.0
+                )
+            ).groupby(tid, as_index=False).sum()
+
+            # -- sum floor area and convert to households (RES) and jobs (JOBS) for
+            #  all phases, by segment and TAZ (parcels straddling TAZ boundaries are
+            #  apportioned by their area share in each TAZ)
+            summary_uses = RES + NRES + HOTEL
+            summary_phases = ["Ex", "Pipe", "ExPi", "Alloc"]
+            summary_factors = conversion_factors(
+                uses=summary_uses,
+                sqft_factors=activity_sf_factors,
+                res_uses=RES,
+                job_uses=NRES + HOTEL,
+                unit_to_hh_factors=unit_to_hh_factors,
+            )
+            sqft_sum_fields = p_fields[1:]
+            summaries = summarize(
+                df=p_df,
+                geographies={"segment": seg_id_field, "taz": taz_xwalk},
+                uses=summary_uses,
+                phases=summary_phases,
+                factors=summary_factors,
+                sum_fields=sqft_sum_fields + t_fields[1:],
+            )
+            res_job_phase_fields = activity_fields(summary_phases)
+
+            ''' 
+            -------------------
+            segment summary 
+            -------------------
+            '''
+            seg_summaries = summaries["segment"]
+            # calculate 2040 estimate of Jobs and households
+            seg_summaries["RES_2040"] = (seg_summaries['RES_PIPE'] +
+                                         seg_summaries['RES_ALLOC'] +
+                                         seg_summaries['LCRT_H20'])
+            seg_summaries["JOBS_2040"] = (seg_summaries['JOBS_PIPE'] +
+                                          seg_summaries['JOBS_ALLOC'] +
+                                          seg_summaries['LCRT_E20'])
+            seg_summaries.reset_index(inplace=True)
+
+            ''' 
+            ---------------
+            taz summary 
+            ---------------
+            '''
+            # TAZ control totals come from the TAZ table rather than the parcel sums
+            taz_summaries = summaries["taz"].reset_index().drop(labels=t_fields[1:], axis=1)
+            taz_summaries = taz_summaries.merge(t_df, on=tid)
+            taz_summaries = taz_summaries[[tid] + sqft_sum_fields + t_fields[1:] + res_job_phase_fields]
+
+            # calculate 2040 estimate of Jobs and households
+            taz_summaries["RES_2040"] = (
+                    taz_summaries['RES_ALLOC'] +
+                    taz_summaries['RES_PIPE'] +
+                    taz_summaries['LCRT_H20']
+            )
+            taz_summaries["JOBS_2040"] = (
+                    taz_summaries['JOBS_ALLOC'] +
+                    taz_summaries['JOBS_PIPE'] +
+                    taz_summaries['LCRT_E20']
+            )
+            taz_summaries.reset_index(inplace=True)
+
+            # write out tables
+            taz_summaries.to_csv(path.join(scen_ws, "taz_summary.csv"))
+            seg_summaries.to_csv(path.join(scen_ws, "seg_summary.csv"))
+
+            # create DIFF between OUR RES/JOBS for TAZ to COG RES/JOBS for TAZ
+            res_job_fields = ["RES_EX", "RES_PIPE", "JOBS_EX", "JOBS_PIPE", "RES_EXPI", "JOBS_EXPI",
+                              "RES_ALLOC", "JOBS_ALLOC", "RES_2040", "JOBS_2040"]
+            taz_sum_simple = taz_summaries[[tid] + res_job_fields]
+            extendTableDf(
+                in_table=scen_taz,
+                table_match_field=tid,
+                df=taz_sum_simple,
+                df_match_field=tid,
+                append_only=False,
+            )
+            # RES and JOBS already reflect each parcel's share of the TAZ (apportioned
+            #  by area share through the crosswalk)
+
+            # calculate difference from current CoG estimates
+            arcpy.AddField_management(in_table=scen_taz, field_name="RES_diff", field_type="DOUBLE")
+            arcpy.AddField_management(in_table=scen_taz, field_name="JOBS_diff", field_type="DOUBLE")
+            arcpy.AddField_management(in_table=scen_taz, field_name="JOBS_ALL_INST", field_type="DOUBLE")
+            arcpy.AddField_management(in_table=scen_taz, field_name="JOBS_2040_INST", field_type="DOUBLE")
+            # combine ALLOCATED JOBS with projected INSTITUTIONAL JOBS
+            arcpy.CalculateField_management(in_table=scen_taz, field="JOBS_ALL_INST",
+                                            expression="!JOBS_ALLOC! + !INST_JOBS!",
+                                            expression_type="PYTHON_9.3")
+            # recalculate 2040 JOBS estimate with INSTITUTIONAL JOBS
+            arcpy.CalculateField_management(in_table=scen_taz, field="JOBS_2040_INST",
+                                            expression="!JOBS_ALL_INST! + !JOBS_PIPE! + !LCRT_E20!",
+                                            expression_type="PYTHON_9.3")
+            # Generate variance for TOD vs CoG jobs and res
+            arcpy.CalculateField_management(in_table=scen_taz, field="JOBS_diff",
+                                            expression="!JOBS_2040_INST! - !LCRT_E40!",
+                                            expression_type="PYTHON_9.3")
+            arcpy.CalculateField_management(in_table=scen_taz, field="RES_diff",
+                                            expression="!RES_2040! - !LCRT_H40!",
+                                            expression_type="PYTHON_9.3")
+
+        if RUN_SUMMARY:
+            print summary_table(report.records).to_string()
         print "DONE!\n"
 
 
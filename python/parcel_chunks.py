@@ -0,0 +1,253 @@
+"""
+Chunked parcel table access
+
+Streams parcel tables in row batches so per-parcel stages run with bounded
+memory on regional parcel bases. Chunks are contiguous ObjectID ranges, each
+read with one `TableToNumPyArray` call projected to the requested columns:
+
+    for df in iter_frames(parcels, ["LandUse2", "BldSqFt"], chunk_size=250000):
+        ...
+
+    # streaming map step: derive fields chunk by chunk and write them back
+    map_chunks(parcels, "ParclID", ["LandUse2", "BldSqFt"], derive_fields,
+               chunk_size=250000)
+
+A `chunk_size` of None reads the whole table as a single chunk.
+"""
+import numpy as np
+import pandas as pd
+
+from run_report import count_rows
+from tod.HandyGP import dfToArray
+from tod.LazyImport import arcpy
+
+TEXT_TYPES = ["String", "Guid", "GlobalID"]
+NUMERIC_TYPES = ["OID", "SmallInteger", "Integer", "Single", "Double"]
+
+
+def null_values(in_table, fields):
+    """
+    in_table: String (path to table or feature class)
+    fields: [String, ...]
+        Fields to be read from `in_table`; geometry tokens (`SHAPE@...`) are
+        skipped.
+
+    Returns a `null_value` dictionary for `TableToNumPyArray`, reading nulls in
+    text fields as empty strings and nulls in numeric fields as 0.
+    """
+    field_types = {f.name: f.type for f in arcpy.ListFields(in_table)}
+    null_dict = {}
+    for field in fields:
+        field_type = field_types.get(field)
+        if field_type in TEXT_TYPES:
+            null_dict[field] = ""
+        elif field_type in NUMERIC_TYPES:
+            null_dict[field] = 0
+    return null_dict
+
+
+def text_lengths(in_table, fields=None):
+    """{field: length} for the text fields of `in_table` (optionally limited to `fields`)"""
+    return {
+        f.name: f.length
+        for f in arcpy.ListFields(in_table)
+        if f.type in TEXT_TYPES and (fields is None or f.name in fields)
+    }
+
+
+def oid_ranges(in_table, chunk_size, where_clause=None):
+    """
+    in_table: String (path to table or feature class)
+    chunk_size: Integer
+        Maximum number of rows per chunk
+    where_clause: String, optional
+
+    Returns a list of (first, last) ObjectID pairs, each bounding at most
+    `chunk_size` of the selected rows. Only the ObjectIDs are read.
+    """
+    oids = np.sort(
+        arcpy.da.TableToNumPyArray(in_table, ["OID@"], where_clause=where_clause)["OID@"]
+    )
+    return [
+        (int(oids[i]), int(oids[min(i + chunk_size, len(oids)) - 1]))
+        for i in range(0, len(oids), chunk_size)
+    ]
+
+
+def _chunk_where(in_table, first, last, where_clause=None):
+    oid_field = arcpy.AddFieldDelimiters(in_table, arcpy.Describe(in_table).OIDFieldName)
+    chunk_wc = "{0} >= {1} AND {0} <= {2}".format(oid_field, first, last)
+    if where_clause:
+        chunk_wc = "({}) AND ({})".format(where_clause, chunk_wc)
+    return chunk_wc
+
+
+def iter_chunks(in_table, fields, chunk_size=None, where_clause=None, null_value=None):
+    """
+    in_table: String (path to table or feature class)
+    fields: [String, ...]
+        Fields (or geometry tokens) to read
+    chunk_size: Integer, optional
+        Maximum number of rows per chunk; if None the table is read at once
+    where_clause: String, optional
+    null_value: Dict, optional
+        `TableToNumPyArray` null replacements; defaults to `null_values`
+
+    Yields structured arrays of at most `chunk_size` rows, in ObjectID order.
+    """
+    if null_value is None:
+        null_value = null_values(in_table, fields)
+    if chunk_size is None:
+        array = arcpy.da.TableToNumPyArray(
+            in_table, fields, where_clause=where_clause, null_value=null_value
+        )
+        count_rows(read=len(array))
+        yield array
+        return
+    for first, last in oid_ranges(in_table, chunk_size, where_clause):
+        array = arcpy.da.TableToNumPyArray(
+            in_table,
+            fields,
+            where_clause=_chunk_where(in_table, first, last, where_clause),
+            null_value=null_value,
+        )
+        count_rows(read=len(array))
+        yield array
+
+
+def iter_frames(
+        in_table,
+        fields,
+        index_field=None,
+        chunk_size=None,
+        where_clause=None,
+        categories=None,
+        codes=None,
+):
+    """
+    in_table: String (path to table or feature class)
+    fields: [String, ...]
+        Fields (or geometry tokens) to read
+    index_field: String, optional
+        Field to index each chunk by (read in addition to `fields`)
+    chunk_size: Integer, optional
+        See `iter_chunks`
+    where_clause: String, optional
+    categories: Dict, optional
+        {field: domain} for text fields to encode as categorical codes
+    codes: CategoryCodes, optional
+        Code dictionaries for `categories`; shared by all chunks so codes are
+        consistent across them.
+
+    Yields a data frame for each chunk.
+    """
+    read_fields = list(fields)
+    if index_field is not None and index_field not in read_fields:
+        read_fields.insert(0, index_field)
+    for array in iter_chunks(in_table, read_fields, chunk_size, where_clause):
+        df = pd.DataFrame(array)
+        if index_field is not None:
+            df = df.set_index(index_field)
+        for field, domain in (categories or {}).items():
+            if field in df.columns:
+                df[field] = codes.encode(df[field], domain)
+        yield df
+
+
+def extend_chunk(in_table, id_field, df):
+    """
+    in_table: String (path to table or feature class)
+    id_field: String
+        Unique id field in `in_table`, matching the index of `df`
+    df: DataFrame
+        Field values for a chunk of rows, indexed by id
+
+    Adds or overwrites the fields in `df` for the matching rows of `in_table`
+    (rows outside the chunk are not changed).
+    """
+    arcpy.da.ExtendTable(
+        in_table=in_table,
+        table_match_field=id_field,
+        in_array=dfToArray(df, index=True),
+        array_match_field=id_field,
+        append_only=False,
+    )
+    count_rows(written=len(df))
+
+
+def map_chunks(
+        in_table,
+        id_field,
+        fields,
+        func,
+        chunk_size=None,
+        where_clause=None,
+        categories=None,
+        codes=None,
+):
+    """
+    in_table: String (path to table or feature class)
+    id_field: String
+        Unique id field in `in_table`
+    fields: [String, ...]
+        Fields passed to `func`
+    func: callable
+        Streaming map step: takes a chunk data frame (indexed by `id_field`)
+        and returns a data frame of derived fields for the same rows
+    chunk_size, where_clause, categories, codes:
+        See `iter_frames`
+
+    Applies `func` to each chunk and writes the derived fields back to
+    `in_table` before reading the next chunk. Returns the number of rows
+    processed.
+    """
+    n_rows = 0
+    for df in iter_frames(
+            in_table, fields, id_field, chunk_size, where_clause, categories, codes
+    ):
+        out_df = func(df)
+        if len(out_df):
+            extend_chunk(in_table, id_field, out_df)
+        n_rows += len(df)
+    return n_rows
+
+
+class ChunkTableWriter(object):
+    """
+    out_table: String (path to table)
+        Table to create from the first chunk written; later chunks are
+        appended with an insert cursor.
+    text_lengths: Dict, optional
+        {field: length} for text fields, so every chunk is written with the
+        same text widths (rather than the longest value in the first chunk)
+    """
+
+    def __init__(self, out_table, text_lengths=None):
+        self.out_table = out_table
+        self.text_lengths = text_lengths or {}
+        self.dtype = None
+        self.n_rows = 0
+
+    def _dtype(self, array):
+        dt_list = []
+        for name in array.dtype.names:
+            dt = array.dtype[name]
+            if dt.kind == "U" and name in self.text_lengths:
+                dt = np.dtype("<U{}".format(max(self.text_lengths[name], 1)))
+            dt_list.append((name, dt.str))
+        return np.dtype(dt_list)
+
+    def write(self, array):
+        """append a structured array (or data frame) of rows to the table"""
+        if isinstance(array, pd.DataFrame):
+            array = dfToArray(array)
+        if self.dtype is None:
+            self.dtype = self._dtype(array)
+            arcpy.da.NumPyArrayToTable(array.astype(self.dtype), self.out_table)
+        else:
+            array = array.astype(self.dtype)
+            with arcpy.da.InsertCursor(self.out_table, list(array.dtype.names)) as c:
+                for row in array.tolist():
+                    c.insertRow(row)
+        self.n_rows += len(array)
+        count_rows(written=len(array))
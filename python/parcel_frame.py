@@ -0,0 +1,205 @@
+"""
+Parcel frame
+
+A columnar, in-memory copy of the parcel attributes used by the scenario
+pipeline. Attributes are read from the parcel feature class once into a data
+frame indexed by the parcel id, passed between pipeline stages and updated in
+place, and written back to the feature class with a single `ExtendTable` call:
+
+    frame = ParcelFrame(suit_fc, "ParclID", ["seg_num", "LandUse2", "BldSqFt"])
+    frame.assign("SF_SF_Ex", values, "LONG")
+    ...
+    frame.write()
+
+Categorical text fields (land uses, station names) may be encoded at load time
+as pandas categoricals against shared `CategoryCodes` domains (see
+`categories`), so filters and grouping compare integer codes.
+
+For parcel bases too large to read at once, a `chunk_size` reads (and writes)
+the feature class in row batches (see `parcel_chunks`), bounding the transient
+memory used by the arcpy array conversions. Fields held in a memory-mapped
+parcel store (see `parcel_store`) are read from the store rather than the
+feature class.
+
+Assigned fields follow the feature class field types used by the pipeline:
+"LONG" values are truncated to integers (nulls as 0) and "DOUBLE" values are
+kept as floats (nulls as NaN, written as nulls).
+"""
+import numpy as np
+import pandas as pd
+
+from categories import CategoryCodes
+from parcel_chunks import extend_chunk, iter_frames
+
+
+class ParcelFrame(object):
+    """
+    in_fc: String (path to feature class)
+        Parcel features
+    id_field: String
+        Unique parcel id field in `in_fc`; the frame is indexed by its values
+    fields: [String, ...], optional
+        Fields (or geometry tokens such as "SHAPE@AREA") to load at the outset.
+        More fields may be loaded later with `load`.
+    categories: Dict, optional
+        {field: domain} for categorical fields in `fields` (see `load`)
+    codes: CategoryCodes, optional
+        Code dictionaries shared with other tables; a new set is created if
+        not provided.
+    chunk_size: Integer, optional
+        Maximum number of rows per read or write; if None the feature class
+        is read and written at once.
+    store: ParcelStore, optional
+        Store of unchanged parcel attributes keyed by `id_field`; fields in
+        the store are loaded from it.
+    """
+
+    def __init__(
+            self,
+            in_fc,
+            id_field,
+            fields=None,
+            categories=None,
+            codes=None,
+            chunk_size=None,
+            store=None,
+    ):
+        self.in_fc = in_fc
+        self.id_field = id_field
+        self.chunk_size = chunk_size
+        self.store = store
+        self.codes = codes if codes is not None else CategoryCodes()
+        self.df = None
+        # {field: "LONG" | "DOUBLE"} for fields assigned but not yet written
+        self.field_types = {}
+        if fields:
+            self.load(fields, categories)
+
+    def __contains__(self, field):
+        return self.df is not None and field in self.df.columns
+
+    def __getitem__(self, field):
+        return self.df[field]
+
+    def __len__(self):
+        return 0 if self.df is None else len(self.df)
+
+    @property
+    def index(self):
+        return self.df.index
+
+    def load(self, fields, categories=None):
+        """
+        fields: [String, ...]
+            Fields to read from the feature class. Fields already held in the
+            frame are not read again.
+        categories: Dict, optional
+            {field: domain} for text fields in `fields` to encode as categorical
+            codes in `self.codes`
+
+        Returns the frame.
+        """
+        new_fields = []
+        for field in fields:
+            if field != self.id_field and field not in self and field not in new_fields:
+                new_fields.append(field)
+        if not new_fields:
+            return self
+        store_fields = []
+        if self.store is not None and self.store.id_field == self.id_field:
+            store_fields = [f for f in new_fields if f in self.store]
+        table_fields = [f for f in new_fields if f not in store_fields]
+        frames = []
+        if table_fields:
+            chunks = list(
+                iter_frames(
+                    in_table=self.in_fc,
+                    fields=table_fields,
+                    index_field=self.id_field,
+                    chunk_size=self.chunk_size,
+                    categories=categories,
+                    codes=self.codes,
+                )
+            )
+            frames.append(chunks[0] if len(chunks) == 1 else pd.concat(chunks))
+        if store_fields:
+            frames.append(
+                self.store.to_df(store_fields, categories=categories, codes=self.codes)
+            )
+        for df in frames:
+            if self.df is None:
+                self.df = df
+            else:
+                self.df = self.df.join(df)
+        return self
+
+    def assign(self, field, values, field_type="LONG"):
+        """
+        field: String
+            Field to add or overwrite
+        values: Series or array-like
+            New values. A series is aligned on the parcel id (parcels missing
+            from the series are null); arrays must be ordered as `index`.
+        field_type: String, default="LONG"
+            "LONG" or "DOUBLE"; the field type written to the feature class.
+        """
+        if isinstance(values, pd.Series):
+            values = values.reindex(self.df.index).values
+        values = np.asarray(values, dtype=float)
+        if field_type == "LONG":
+            values = np.trunc(np.nan_to_num(values)).astype(np.int64)
+        elif field_type != "DOUBLE":
+            raise ValueError("Unsupported field type '{}'".format(field_type))
+        self.df[field] = values
+        self.field_types[field] = field_type
+
+    def update(self, df, match_field=None, field_type="LONG"):
+        """
+        df: DataFrame
+            New values for one or more fields, indexed by parcel id (or with
+            the parcel id in `match_field`). All other columns are assigned.
+        match_field: String, optional
+            Parcel id column in `df`
+        field_type: String, default="LONG"
+            See `assign`
+        """
+        if match_field is not None:
+            df = df.set_index(match_field)
+        for field in df.columns:
+            self.assign(field, df[field], field_type)
+
+    def to_df(self, fields, index=False):
+        """
+        fields: [String, ...]
+            Fields to include
+        index: Boolean, default=False
+            If True, the returned data frame is indexed by parcel id; otherwise
+            the parcel id is the first column, as read by `TableToNumPyArray`.
+
+        Returns a copy of `fields` as a data frame.
+        """
+        df = self.df[fields].copy()
+        if index:
+            return df
+        return df.reset_index()
+
+    def write(self, fields=None):
+        """
+        fields: [String, ...], optional
+            Assigned fields to write; defaults to all fields assigned since the
+            frame was loaded (or last written).
+
+        Extends the feature class with `fields`, overwriting existing values.
+        """
+        if fields is None:
+            fields = [f for f in self.df.columns if f in self.field_types]
+        if not fields:
+            return
+        print("...writing {} fields to {}".format(len(fields), self.in_fc))
+        chunk_size = self.chunk_size or max(len(self.df), 1)
+        for start in range(0, len(self.df), chunk_size):
+            extend_chunk(
+                self.in_fc, self.id_field, self.df[fields].iloc[start:start + chunk_size]
+            )
+        for field in fields:
+            self.field_types.pop(field, None)
@@ -0,0 +1,281 @@
+"""
+Parcel attribute store
+
+A memory-mapped columnar copy of parcel attributes that do not change between
+runs. The attributes are exported from the parcel feature class once, one
+`.npy` file per column plus a JSON manifest describing the columns:
+
+    {store_dir}/
+        manifest.json
+        c000_ParclID.npy
+        c001_LandUse2.npy
+        ...
+
+Later runs open the columns a stage needs with `np.load(mmap_mode="r")`
+instead of reading them through arcpy cursors, so startup does not depend on
+the size of the parcel base and processes reading the same store share its
+pages through the OS cache:
+
+    store = open_store(store_dir, parcels, "ParclID", ["LandUse2", "BldSqFt"])
+    df = store.to_df(["LandUse2", "BldSqFt"])
+
+Rows are stored in ObjectID order; the store's id field aligns them with
+other parcel tables. Nulls are stored as read by `parcel_chunks` (empty strings
+for text, 0 for numbers). The store does not track edits to the source
+features; re-export (`rebuild=True`) after the parcel base changes.
+"""
+import json
+import re
+import numpy as np
+import pandas as pd
+from os import makedirs, path, remove
+
+from parcel_chunks import iter_chunks, text_lengths
+from run_report import count_rows
+from tod.LazyImport import arcpy
+
+MANIFEST = "manifest.json"
+
+
+def _column_file(position, field):
+    """file name for a column (geometry tokens and odd characters are replaced)"""
+    return "c{:03d}_{}.npy".format(position, re.sub(r"[^0-9A-Za-z_]", "_", field))
+
+
+def _column_dtype(dtype, length=None):
+    """on-disk dtype of a column; text columns are fixed to the field length"""
+    if dtype.kind == "U" and length:
+        return np.dtype("<U{}".format(length))
+    return dtype
+
+
+def _write_manifest(store_dir, manifest):
+    with open(path.join(store_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _exported_from(store, in_table, id_field):
+    """True if `store` was exported from `in_table` with `id_field`"""
+    return store.source == in_table and store.id_field == id_field
+
+
+def export_store(in_table, id_field, fields, store_dir, chunk_size=None):
+    """
+    in_table: String (path to table or feature class)
+        Parcel table to export
+    id_field: String
+        Unique parcel id field in `in_table`
+    fields: [String, ...]
+        Fields (or geometry tokens such as "SHAPE@AREA") to export
+    store_dir: String
+        Folder holding the store; created if needed
+    chunk_size: Integer, optional
+        Maximum number of rows read at a time (see `parcel_chunks`); columns
+        are written to their memory-mapped files chunk by chunk.
+
+    Exports `fields` to `store_dir`. If the folder already holds a store of
+    `in_table`, the new columns are added to it (ids must match the stored
+    ids row for row). Returns the store.
+    """
+    manifest_file = path.join(store_dir, MANIFEST)
+    if path.exists(manifest_file):
+        store = ParcelStore(store_dir)
+        if not _exported_from(store, in_table, id_field):
+            raise ValueError(
+                "Store in {} was exported from {} ({}); rebuild it for {} ({})".format(
+                    store_dir, store.source, store.id_field, in_table, id_field)
+            )
+        manifest = store.manifest
+        stored_ids = store.ids
+    else:
+        if not path.exists(store_dir):
+            makedirs(store_dir)
+        manifest = {"source": in_table, "id_field": id_field, "n_rows": None, "columns": {}}
+        stored_ids = None
+
+    new_fields = [id_field] if stored_ids is None else []
+    new_fields += [f for f in fields if f not in manifest["columns"] and f not in new_fields]
+    if not new_fields:
+        return ParcelStore(store_dir)
+    print("Exporting {} columns to parcel store {}...".format(len(new_fields), store_dir))
+    read_fields = new_fields if id_field in new_fields else [id_field] + new_fields
+    lengths = text_lengths(in_table, read_fields)
+    n_rows = int(arcpy.GetCount_management(in_table).getOutput(0))
+
+    columns = {}
+    start = 0
+    for chunk in iter_chunks(in_table, read_fields, chunk_size):
+        stop = start + len(chunk)
+        if stored_ids is not None and not np.array_equal(chunk[id_field], stored_ids[start:stop]):
+            raise ValueError(
+                "Rows of {} no longer match the store in {}; rebuild it".format(in_table, store_dir)
+            )
+        for field in new_fields:
+            if field not in columns:
+                position = len(manifest["columns"]) + len(columns)
+                dtype = _column_dtype(chunk.dtype[field], lengths.get(field))
+                columns[field] = (
+                    _column_file(position, field),
+                    np.lib.format.open_memmap(
+                        path.join(store_dir, _column_file(position, field)),
+                        mode="w+",
+                        dtype=dtype,
+                        shape=(n_rows,),
+                    ),
+                )
+            columns[field][1][start:stop] = chunk[field]
+        start = stop
+    if start != n_rows:
+        raise ValueError("Read {} of {} rows from {}".format(start, n_rows, in_table))
+
+    for field in new_fields:
+        file_name, column = columns[field]
+        column.flush()
+        manifest["columns"][field] = {
+            "file": file_name,
+            "dtype": column.dtype.str,
+            "position": len(manifest["columns"]),
+        }
+    manifest["n_rows"] = n_rows
+    _write_manifest(store_dir, manifest)
+    print("...parcel store written here: {}".format(store_dir))
+    return ParcelStore(store_dir)
+
+
+def open_store(store_dir, in_table, id_field, fields, chunk_size=None, rebuild=False):
+    """
+    store_dir: String
+        Folder holding the store
+    in_table, id_field, fields, chunk_size:
+        See `export_store`
+    rebuild: Boolean, default=False
+        If True, the store is re-exported even if it exists
+
+    Returns the store in `store_dir`, exporting it (or any of `fields` it
+    lacks) first if needed. A store exported from another table or id field
+    is re-exported.
+    """
+    manifest_file = path.join(store_dir, MANIFEST)
+    if path.exists(manifest_file):
+        store = ParcelStore(store_dir)
+        if not rebuild and not _exported_from(store, in_table, id_field):
+            print("Parcel store in {} was exported from {} ({}); re-exporting it".format(
+                store_dir, store.source, store.id_field))
+            rebuild = True
+        if rebuild:
+            store.clear()
+        elif all(f in store for f in fields):
+            return store
+    return export_store(
+        in_table=in_table,
+        id_field=id_field,
+        fields=fields,
+        store_dir=store_dir,
+        chunk_size=chunk_size,
+    )
+
+
+class ParcelStore(object):
+    """
+    store_dir: String
+        Folder holding a store exported by `export_store`
+    mmap_mode: String, default="r"
+        `np.load` mode for column files; "r" maps them read-only
+    """
+
+    def __init__(self, store_dir, mmap_mode="r"):
+        self.store_dir = store_dir
+        self.mmap_mode = mmap_mode
+        with open(path.join(store_dir, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+    def __contains__(self, field):
+        return field in self.manifest["columns"]
+
+    def __len__(self):
+        return self.manifest["n_rows"]
+
+    @property
+    def source(self):
+        return self.manifest["source"]
+
+    @property
+    def id_field(self):
+        return self.manifest["id_field"]
+
+    @property
+    def fields(self):
+        columns = self.manifest["columns"]
+        return sorted(columns, key=lambda f: columns[f]["position"])
+
+    @property
+    def ids(self):
+        return self.column(self.id_field)
+
+    def column(self, field):
+        """the (memory-mapped) values of `field`"""
+        try:
+            file_name = self.manifest["columns"][field]["file"]
+        except KeyError:
+            raise KeyError("{} is not in the parcel store {}".format(field, self.store_dir))
+        return np.load(path.join(self.store_dir, file_name), mmap_mode=self.mmap_mode)
+
+    def clear(self):
+        """delete the store's column files and manifest"""
+        for column in self.manifest["columns"].values():
+            column_file = path.join(self.store_dir, column["file"])
+            if path.exists(column_file):
+                remove(column_file)
+        remove(path.join(self.store_dir, MANIFEST))
+        self.manifest = {"columns": {}, "n_rows": 0}
+
+    def to_df(self, fields, index=True, start=None, stop=None, categories=None, codes=None):
+        """
+        fields: [String, ...]
+            Fields to read
+        index: Boolean, default=True
+            If True, the data frame is indexed by the id field; otherwise the
+            id field is a column only if it is in `fields`.
+        start, stop: Integer, optional
+            Row slice to read
+        categories: Dict, optional
+            {field: domain} for text fields to encode as categorical codes
+        codes: CategoryCodes, optional
+            Code dictionaries for `categories`
+
+        Returns `fields` as a data frame; only the requested rows of each
+        column are copied out of its file.
+        """
+        rows = slice(start, stop)
+        read_fields = list(fields)
+        if index and self.id_field not in read_fields:
+            read_fields.insert(0, self.id_field)
+        df = pd.DataFrame(
+            dict((f, np.array(self.column(f)[rows])) for f in read_fields),
+            columns=read_fields,
+        )
+        if index:
+            df = df.set_index(self.id_field)
+        count_rows(read=len(df))
+        for field, domain in (categories or {}).items():
+            if field in df.columns:
+                df[field] = codes.encode(df[field], domain)
+        return df
+
+    def iter_frames(self, fields, index_field=None, chunk_size=None, categories=None, codes=None):
+        """
+        Yields data frames of `fields` in chunks of `chunk_size` rows, like
+        `parcel_chunks.iter_frames` (`index_field` must be the id field or None).
+        """
+        if index_field not in (None, self.id_field):
+            raise ValueError("Parcel store frames are indexed by {}".format(self.id_field))
+        chunk_size = chunk_size or max(len(self), 1)
+        for start in range(0, len(self), chunk_size):
+            yield self.to_df(
+                fields,
+                index=index_field is not None,
+                start=start,
+                stop=start + chunk_size,
+                categories=categories,
+                codes=codes,
+            )
@@ -0,0 +1,296 @@
+"""
+Run reports
+
+Per-stage instrumentation for pipeline runs. Each named stage records its wall
+time, CPU time, rows read and written, and its memory use:
+
+- `rss_start_mb`: resident memory of the process as the stage starts
+- `rss_delta_mb`: change in resident memory from start to end of the stage
+  (memory the stage kept)
+- `peak_growth_mb`: rise of the process's peak resident memory during the
+  stage (0 if the stage stayed below an earlier peak)
+- `process_peak_rss_mb`: peak resident memory of the process so far (a
+  cumulative high-water mark, not the stage's own peak)
+
+Current resident memory is read on Linux and Windows only; elsewhere the
+start and delta fields are null.
+
+    report = RunReport("WE_Sum", out_file=path.join(scen_ws, "run_report.jsonl"))
+    with report.stage("suitability"):
+        generate_suitability(...)
+    print(summary_table(report.records))
+
+Rows read and written by `parcel_chunks` and `parcel_store` are counted in the
+active stages automatically (see `count_rows`); stages doing their own table
+I/O may add counts to the record yielded by `stage`. Stages may be nested, in
+which case rows count toward both the inner and outer stage.
+
+Each stage is appended to the report's JSON-lines file as soon as it ends (so
+stages completed before a failure are kept), one line per stage, and runs can
+be compared over time (see `load_report` and `compare_runs`).
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# stage records currently open (innermost last)
+_ACTIVE = []
+
+REPORT_FIELDS = [
+    "run",
+    "scenario",
+    "stage",
+    "parent",
+    "status",
+    "started",
+    "wall_s",
+    "cpu_s",
+    "rows_read",
+    "rows_written",
+    "rows_per_s",
+    "rss_start_mb",
+    "rss_delta_mb",
+    "peak_growth_mb",
+    "process_peak_rss_mb",
+]
+
+
+def _cpu_time():
+    """user + system CPU seconds used by this process"""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _windows_memory_counters():
+    """memory counters of this process (Windows), or None"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+        ctypes.windll.kernel32.GetCurrentProcess(),
+        ctypes.byref(counters),
+        counters.cb,
+    )
+    return counters if ok else None
+
+
+def peak_rss_mb():
+    """peak resident memory of this process so far, in MB (None if unavailable)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        if sys.platform == "darwin":
+            return peak / (1024.0 * 1024.0)
+        return peak / 1024.0
+    try:
+        counters = _windows_memory_counters()
+    except (AttributeError, OSError):
+        return None
+    return None if counters is None else counters.PeakWorkingSetSize / (1024.0 * 1024.0)
+
+
+def rss_mb():
+    """current resident memory of this process, in MB (None if unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        counters = _windows_memory_counters()
+    except (AttributeError, OSError):
+        return None
+    return None if counters is None else counters.WorkingSetSize / (1024.0 * 1024.0)
+
+
+def _difference(end, start):
+    return None if end is None or start is None else end - start
+
+
+def count_rows(read=0, written=0):
+    """add `read` and `written` rows to every active stage"""
+    for record in _ACTIVE:
+        record.count(read, written)
+
+
+class StageRecord(object):
+    """Measurements for one run of a named stage (see `RunReport.stage`)"""
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.rows_read = 0
+        self.rows_written = 0
+        self.status = "ok"
+        self.started = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.rss_start_mb = None
+        self.rss_delta_mb = None
+        self.peak_growth_mb = None
+        self.process_peak_rss_mb = None
+
+    def count(self, read=0, written=0):
+        """add rows read and written by the stage"""
+        self.rows_read += int(read)
+        self.rows_written += int(written)
+
+    def to_dict(self):
+        rows = self.rows_read + self.rows_written
+        return {
+            "stage": self.name,
+            "parent": self.parent,
+            "status": self.status,
+            "started": self.started,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "rows_per_s": rows / self.wall_s if rows and self.wall_s else None,
+            "rss_start_mb": self.rss_start_mb,
+            "rss_delta_mb": self.rss_delta_mb,
+            "peak_growth_mb": self.peak_growth_mb,
+            "process_peak_rss_mb": self.process_peak_rss_mb,
+        }
+
+
+class RunReport(object):
+    """
+    scenario: String
+        Scenario (or other run label) reported with each stage
+    out_file: String, optional
+        JSON-lines file each stage record is appended to as the stage ends
+    run_id: String, optional
+        Identifier shared by all records of this run; defaults to the start
+        time of the run (e.g., "20201116T093012")
+    """
+
+    def __init__(self, scenario, out_file=None, run_id=None):
+        self.scenario = scenario
+        self.out_file = out_file
+        self.run_id = run_id or datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.records = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        name: String
+            Stage name
+
+        Context manager timing the enclosed block as stage `name`. Yields the
+        stage's `StageRecord` so the block can add row counts. The record is
+        kept (with status "error") if the block raises.
+        """
+        record = StageRecord(name, parent=_ACTIVE[-1].name if _ACTIVE else None)
+        record.started = datetime.now().isoformat()
+        _ACTIVE.append(record)
+        record.rss_start_mb = rss_mb()
+        peak_start = peak_rss_mb()
+        wall_start, cpu_start = time.time(), _cpu_time()
+        try:
+            yield record
+        except BaseException:
+            record.status = "error"
+            raise
+        finally:
+            record.wall_s = time.time() - wall_start
+            record.cpu_s = _cpu_time() - cpu_start
+            record.rss_delta_mb = _difference(rss_mb(), record.rss_start_mb)
+            record.process_peak_rss_mb = peak_rss_mb()
+            record.peak_growth_mb = _difference(record.process_peak_rss_mb, peak_start)
+            _ACTIVE.remove(record)
+            rec_dict = record.to_dict()
+            rec_dict.update({"run": self.run_id, "scenario": self.scenario})
+            self.records.append(rec_dict)
+            if self.out_file:
+                with open(self.out_file, "a") as f:
+                    f.write(json.dumps(rec_dict, sort_keys=True) + "\n")
+
+    def timed(self, name=None):
+        """decorator running the wrapped function as a stage (named for the function by default)"""
+
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return func(*args, **kwargs)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+
+        return decorator
+
+
+def load_report(report_file):
+    """data frame of the stage records in a JSON-lines run report"""
+    with open(report_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records, columns=REPORT_FIELDS)
+
+
+def summary_table(records):
+    """
+    records: [Dict, ...] or DataFrame
+        Stage records (`RunReport.records` or `load_report`) of one run
+
+    Returns a data frame indexed by stage (in the order stages ended) with wall and CPU
+    seconds, rows read and written, row throughput, memory use and each
+    top-level stage's share of the total wall time.
+    """
+    df = pd.DataFrame(records, columns=REPORT_FIELDS)
+    total = df.loc[df["parent"].isnull(), "wall_s"].sum()
+    df["wall_share"] = (df["wall_s"] / total).where(df["parent"].isnull()) if total else None
+    return df.set_index("stage")[
+        ["parent", "status", "wall_s", "cpu_s", "wall_share", "rows_read",
+         "rows_written", "rows_per_s", "rss_start_mb", "rss_delta_mb", "peak_growth_mb",
+         "process_peak_rss_mb"]
+    ]
+
+
+def compare_runs(report, value="wall_s", scenario=None):
+    """
+    report: DataFrame
+        Stage records of several runs (see `load_report`)
+    value: String, default="wall_s"
+        Measure to compare
+    scenario: String, optional
+        Limit the comparison to one scenario
+
+    Returns a (stages x runs) table of `value`, for tracking regressions
+    between runs.
+    """
+    if scenario is not None:
+        report = report[report["scenario"] == scenario]
+    stage_order = pd.unique(report["stage"])
+    table = report.pivot_table(index="stage", columns="run", values=value, aggfunc="sum")
+    return table.reindex(stage_order)
@@ -0,0 +1,306 @@
+"""
+Suitability weight sensitivity sweep
+
+Scores a grid or Latin-hypercube sample of suitability weight vectors in bulk
+against the cached suitability components (see `suitability.SuitabilityMatrix`),
+runs the vectorized segment allocation for each weighting scheme in worker
+processes and reports per-segment and per-TAZ allocation deltas against a
+baseline weighting scheme as a single (long) table:
+
+    run | in_DO ... dev_size | geography | zone | {act}_SF_alloc ... | {act}_SF_delta ...
+
+`geography` is "segment" or "taz"; run 0 is always the baseline.
+"""
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from os import path
+
+from allocation import ALLOC_ACTIVITIES, _fill_segments
+from crosswalk import dominant_zone, load_crosswalk
+from shared_arrays import SharedArrays, attach
+from suitability import SUIT_CRITERIA, SuitabilityMatrix, weight_vector
+from tod.LazyImport import arcpy
+
+
+def weight_grid(levels, normalize=False):
+    """
+    levels: Dict
+        {criterion: [values]} for each criterion in `SUIT_CRITERIA`. Criteria
+        not listed are held at 0.0.
+    normalize: Boolean
+        If True, each weight vector is scaled to sum to 1.0 (vectors summing to
+        zero are dropped).
+
+    Returns an (m, k) array of every combination of the listed levels.
+    """
+    axes = [levels.get(crit, [0.0]) for crit in SUIT_CRITERIA]
+    grid = np.array(list(itertools.product(*axes)), dtype=float)
+    if normalize:
+        totals = grid.sum(axis=1)
+        grid = grid[totals > 0] / totals[totals > 0, np.newaxis]
+    return grid
+
+
+def latin_hypercube(n, bounds, seed=None, normalize=False):
+    """
+    n: Integer
+        Number of weight vectors to sample.
+    bounds: Dict
+        {criterion: (low, high)} for each criterion in `SUIT_CRITERIA`. Criteria
+        not listed are held at 0.0.
+    seed: Integer, optional
+        Seed for reproducible samples.
+
+    Returns an (n, k) array with each criterion's range split into `n` equal
+    strata, each stratum sampled exactly once.
+    """
+    rng = np.random.RandomState(seed)
+    k = len(SUIT_CRITERIA)
+    strata = np.array([rng.permutation(n) for _ in range(k)]).T
+    unit = (strata + rng.uniform(size=(n, k))) / float(n)
+    lows = np.array([bounds.get(crit, (0.0, 0.0))[0] for crit in SUIT_CRITERIA])
+    highs = np.array([bounds.get(crit, (0.0, 0.0))[1] for crit in SUIT_CRITERIA])
+    sample = lows + unit * (highs - lows)
+    if normalize:
+        sample = sample / sample.sum(axis=1)[:, np.newaxis]
+    return sample
+
+
+# worker state, set once per process by `_init_worker`: the parcel arrays and
+#  the run output buffers, attached from shared memory (see `shared_arrays`)
+#  to avoid copying them to every worker
+_WORKER = {}
+_OUTPUTS = ["seg_sums", "zone_sums"]
+
+
+def _init_worker(handles):
+    _WORKER.clear()
+    _WORKER.update(attach(handles, writable=_OUTPUTS))
+
+
+def _sweep_batch(batch):
+    """Score a batch of weight vectors in bulk, allocate each one and write the
+    segment (and zone) sums to the output buffers' rows for the batch's runs"""
+    start, weight_batch = batch
+    w = _WORKER
+    scores = w["components"].dot(weight_batch.T) * w["alloc_include"][:, np.newaxis]
+    n_segs = len(w["controls"])
+    for j in range(scores.shape[1]):
+        # order by segment, then suitability descending (ties keep parcel order)
+        order = np.lexsort((-scores[:, j], w["seg_idx"]))
+        alloc = _fill_segments(w["seg_idx"][order], w["caps"][order], w["controls"])
+        w["seg_sums"][start + j] = _group_sum(w["seg_idx"][order], alloc, n_segs)
+        if "zone_idx" in w:
+            w["zone_sums"][start + j] = _group_sum(
+                w["zone_idx"][order], alloc, w["zone_sums"].shape[1]
+            )
+
+
+def _group_sum(group_idx, values, n_groups):
+    return np.array(
+        [np.bincount(group_idx, weights=values[:, j], minlength=n_groups)
+         for j in range(values.shape[1])]
+    ).T
+
+
+def sweep_allocation(
+        suit_mtx,
+        cap_df,
+        seg_field,
+        cap_fields,
+        control_dict,
+        weight_sets,
+        baseline_weights,
+        zone_ids=None,
+        processes=None,
+        batch_size=4,
+        out_file=None,
+):
+    """
+    suit_mtx: SuitabilityMatrix
+        Cached suitability components (e.g., `SuitabilityMatrix.from_table`).
+    cap_df: DataFrame
+        Parcel segment and change capacity fields, indexed by parcel id.
+    seg_field: String
+        Segment field in `cap_df`; values are keys in `control_dict`.
+    cap_fields: [String, ...]
+        Capacity fields in `cap_df`, ordered as `ALLOC_ACTIVITIES`.
+    control_dict: Dict
+        {segment: {activity: control}} as used by `allocate_dict`.
+    weight_sets: array-like
+        Weight vectors to evaluate (see `suitability.weight_vector`), for
+        example from `weight_grid` or `latin_hypercube`.
+    baseline_weights: Dict or array-like
+        The weighting scheme deltas are reported against (run 0).
+    zone_ids: Series, optional
+        TAZ id of each parcel, indexed by parcel id. If omitted only segment
+        results are reported.
+    processes: Integer, optional
+        Number of worker processes (defaults to the cpu count); 1 runs serially.
+    out_file: String, optional
+        Path to a csv file to write the result table to.
+
+    Returns the long result table as a data frame.
+    """
+    weights = np.vstack([weight_vector(baseline_weights), weight_vector(weight_sets)])
+
+    # align parcel attributes with the suitability matrix
+    ids = pd.Index(suit_mtx.ids)
+    cap_df = cap_df.reindex(ids)
+    keep = cap_df[seg_field].notnull().values
+    segments, seg_idx = np.unique(cap_df[seg_field].values[keep], return_inverse=True)
+    caps = np.trunc(cap_df[cap_fields].fillna(0.0).values[keep]).astype(np.int64)
+    controls = np.trunc(
+        np.array(
+            [[control_dict[seg][act] for act in ALLOC_ACTIVITIES] for seg in segments],
+            dtype=float,
+        )
+    ).astype(np.int64)
+    arrays = {
+        "components": suit_mtx.components[keep],
+        "alloc_include": suit_mtx.alloc_include[keep],
+        "seg_idx": seg_idx,
+        "caps": caps,
+        "controls": controls,
+    }
+    n_acts = len(ALLOC_ACTIVITIES)
+    outputs = {"seg_sums": (len(weights), len(segments), n_acts)}
+    if zone_ids is not None:
+        zones = zone_ids.reindex(ids).values[keep]
+        zone_keep = pd.notnull(zones)
+        zone_vals, zone_idx = np.unique(zones[zone_keep].astype(str), return_inverse=True)
+        # parcels without a zone are summed into a trailing bin that is dropped
+        full_zone_idx = np.full(len(zones), len(zone_vals), dtype=np.intp)
+        full_zone_idx[zone_keep] = zone_idx
+        arrays["zone_idx"] = full_zone_idx
+        outputs["zone_sums"] = (len(weights), len(zone_vals) + 1, n_acts)
+    else:
+        zone_vals = []
+
+    # score and allocate in batches; parcel arrays are shared with the workers
+    #  once and each batch writes its runs' rows of the shared output buffers
+    batches = [(i, weights[i:i + batch_size]) for i in range(0, len(weights), batch_size)]
+    print("Sweeping {} weighting schemes...".format(len(weights) - 1))
+    if processes == 1:
+        _WORKER.update(arrays)
+        _WORKER.update((name, np.zeros(shape)) for name, shape in outputs.items())
+        for batch in batches:
+            _sweep_batch(batch)
+        run_sums = dict((name, _WORKER[name]) for name in outputs)
+        _WORKER.clear()
+    else:
+        with SharedArrays() as shared:
+            for name, array in arrays.items():
+                shared.publish(name, array)
+            for name, shape in outputs.items():
+                shared.allocate(name, shape, np.float64)
+            pool = multiprocessing.Pool(
+                processes=processes, initializer=_init_worker, initargs=(shared.handles(),)
+            )
+            try:
+                pool.map(_sweep_batch, batches)
+            finally:
+                pool.close()
+                pool.join()
+            run_sums = dict((name, np.array(shared[name])) for name in outputs)
+    results = [
+        (run_sums["seg_sums"][run], run_sums["zone_sums"][run] if zone_ids is not None else None)
+        for run in range(len(weights))
+    ]
+
+    # assemble long table of allocations and deltas from the baseline
+    alloc_fields = ["{}_SF_alloc".format(act) for act in ALLOC_ACTIVITIES]
+    delta_fields = ["{}_SF_delta".format(act) for act in ALLOC_ACTIVITIES]
+    base_seg, base_zone = results[0]
+    frames = []
+    for run, (w, (seg_sums, zone_sums)) in enumerate(zip(weights, results)):
+        geos = [("segment", segments, seg_sums, base_seg)]
+        if zone_sums is not None:
+            n = len(zone_vals)
+            geos.append(("taz", zone_vals, zone_sums[:n], base_zone[:n]))
+        for geo, zone_labels, sums, base in geos:
+            frame = pd.DataFrame(sums, columns=alloc_fields)
+            for delta_field, col in zip(delta_fields, (sums - base).T):
+                frame[delta_field] = col
+            frame.insert(0, "zone", [str(z) for z in zone_labels])
+            frame.insert(0, "geography", geo)
+            for i in range(len(SUIT_CRITERIA) - 1, -1, -1):
+                frame.insert(0, SUIT_CRITERIA[i], w[i])
+            frame.insert(0, "run", run)
+            frames.append(frame)
+    sweep_df = pd.concat(frames, ignore_index=True)
+    if out_file:
+        sweep_df.to_csv(out_file, index=False)
+        print("...sweep results written here: {}".format(out_file))
+    return sweep_df
+
+
+if __name__ == "__main__":
+    # sweeps run against a completed scenario run of `generate_scenarios.py`
+    scen_ws = r"K:\Projects\BCDCOG\Features\Files_For_RDB\RDB_V3\scenarios\WE_Sum"
+    scen_gdb = path.join(scen_ws, "WE_Sum_scenario.gdb")
+    suit_fc = path.join(scen_gdb, "parcels_bldSqft_update_1202")
+    suit_tbl = path.join(scen_gdb, "suitability")
+    taz = path.join(scen_gdb, "taz")
+    id_field = "ParclID"
+    seg_field = "seg_num"
+    tid = "Big_TAZ"
+    cap_fields = ["SF_SF_ChgCap", "MF_SF_ChgCap", "Ret_SF_ChgCap",
+                  "Ind_SF_ChgCap", "Off_SF_ChgCap", "Hot_SF_ChgCap"]
+
+    control_tbl = r"K:\Projects\BCDCOG\Features\Files_For_RDB\RDB_V3\tables\control_totals_111620.csv"
+    ctl_df = pd.read_csv(
+        control_tbl, usecols=ALLOC_ACTIVITIES + ["segment", "group"]
+    ).set_index("segment")
+    ctl_dict = ctl_df[ctl_df["group"] == "net"].drop("group", axis=1).T.to_dict()
+
+    baseline = {
+        "in_DO": 0.6,
+        "is_vacant": 0.15,
+        "in_TOD": 0.05,
+        "in_walkshed": 0.1,
+        "dev_size": 0.1,
+    }
+    samples = latin_hypercube(
+        n=48,
+        bounds={
+            "in_DO": (0.3, 0.8),
+            "is_vacant": (0.0, 0.3),
+            "in_TOD": (0.0, 0.2),
+            "in_walkshed": (0.0, 0.2),
+            "dev_size": (0.0, 0.2),
+        },
+        seed=2020,
+        normalize=True,
+    )
+
+    suit_matrix = SuitabilityMatrix.from_table(suit_tbl, id_field)
+    cap_frame = pd.DataFrame(
+        arcpy.da.TableToNumPyArray(
+            suit_fc, [id_field, seg_field] + cap_fields, null_value=0.0
+        )
+    ).set_index(id_field)
+    # the scenario's parcels and TAZs are overlaid, so the crosswalk is kept in
+    #  the scenario folder (apart from the source crosswalk of generate_scenarios)
+    taz_xwalk = load_crosswalk(
+        xwalk_file=path.join(scen_ws, "parcel_taz_crosswalk.csv"),
+        parcels=suit_fc,
+        parcel_id=id_field,
+        zones=taz,
+        zone_id=tid,
+    )
+    taz_ids = dominant_zone(taz_xwalk, id_field, tid)
+
+    sweep_allocation(
+        suit_mtx=suit_matrix,
+        cap_df=cap_frame,
+        seg_field=seg_field,
+        cap_fields=cap_fields,
+        control_dict=ctl_dict,
+        weight_sets=samples,
+        baseline_weights=baseline,
+        zone_ids=taz_ids,
+        out_file=path.join(scen_ws, "weight_sweep.csv"),
+    )
@@ -0,0 +1,200 @@
+"""
+Shared parcel arrays
+
+A registry of numpy arrays placed in shared memory so worker processes can use
+the parcel columns of a stage (suitability, capacities, segment and station
+ids, centroids, ...) without each receiving a pickled copy. The parent
+publishes the read-only inputs once and allocates the output buffers workers
+write their results into; workers attach to both by handle, zero-copy:
+
+    with SharedArrays() as shared:
+        shared.publish("caps", caps)
+        shared.allocate("alloc", caps.shape, np.int64)
+        pool = multiprocessing.Pool(initializer=_init_worker, initargs=(shared.handles(),))
+        ...
+        alloc = shared["alloc"].copy()
+
+    def _init_worker(handles):
+        _WORKER.update(attach(handles, writable=["alloc"]))
+
+Blocks use `multiprocessing.shared_memory` where available (Python 3.8+) and
+`multiprocessing.sharedctypes.RawArray` otherwise. RawArray handles can only be
+passed to workers as process or pool initializer arguments (not with tasks), so
+pass handles that way. Workers must write disjoint parts of an output buffer
+(e.g., one row per task); no locking is done. Blocks are released when the
+registry is closed, so copy outputs out before leaving the `with` block.
+"""
+import sys
+from multiprocessing import sharedctypes
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+# shared memory blocks attached by this (worker) process, kept open for the
+#  life of the process so the arrays viewing them stay valid
+_ATTACHED = {}
+
+
+if shared_memory is not None:
+
+    class _Block(shared_memory.SharedMemory):
+        """shared memory block that stays mapped while arrays still view it"""
+
+        def close(self):
+            try:
+                super(_Block, self).close()
+            except BufferError:
+                # arrays viewing the block are still referenced; the mapping
+                #  is released once they are gone
+                pass
+
+
+def _nbytes(shape, dtype):
+    return max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+
+
+def _attach_block(name):
+    """open an existing shared memory block without taking ownership of it"""
+    if sys.version_info >= (3, 13):
+        return _Block(name=name, track=False)
+    # worker processes share their parent's resource tracker, which already
+    #  tracks the block (so registering it again here is harmless)
+    return _Block(name=name)
+
+
+class SharedArrays(object):
+    """
+    Registry of named arrays in shared memory (see module docs). Use as a
+    context manager or call `close` when done.
+    """
+
+    def __init__(self):
+        self._blocks = {}
+        self._handles = {}
+        self._arrays = {}
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _create(self, name, shape, dtype):
+        """create a zero-filled shared block for `name` and return its array"""
+        if name in self._arrays:
+            raise ValueError("{} is already in the shared array registry".format(name))
+        dtype = np.dtype(dtype)
+        if dtype.hasobject:
+            raise ValueError(
+                "{} has an object dtype; only fixed-size dtypes can be shared".format(name)
+            )
+        shape = tuple(int(s) for s in (shape if isinstance(shape, (tuple, list)) else [shape]))
+        # new blocks are zero-filled by the OS
+        nbytes = _nbytes(shape, dtype)
+        if shared_memory is not None:
+            block = _Block(create=True, size=nbytes)
+            handle = (block.name, shape, dtype.str)
+            buf = block.buf
+        else:
+            block = sharedctypes.RawArray("b", nbytes)
+            handle = (block, shape, dtype.str)
+            buf = block
+        array = np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        self._blocks[name] = block
+        self._handles[name] = handle
+        self._arrays[name] = array
+        return array
+
+    def publish(self, name, array):
+        """
+        name: String
+        array: array-like
+            Values to share (copied into shared memory once)
+
+        Returns the shared copy of `array`.
+        """
+        array = np.ascontiguousarray(array)
+        shared = self._create(name, array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def publish_frame(self, df, fields=None, prefix=""):
+        """
+        df: DataFrame
+        fields: [String, ...], optional
+            Columns to share (defaults to all columns)
+        prefix: String, optional
+            Prefix for the registered names
+
+        Publishes each column as `{prefix}{field}` and returns the names.
+        """
+        names = []
+        for field in fields or list(df.columns):
+            names.append(prefix + field)
+            self.publish(prefix + field, df[field].values)
+        return names
+
+    def allocate(self, name, shape, dtype=np.float64):
+        """
+        name: String
+        shape: Integer or tuple
+        dtype: numpy dtype, default=float64
+
+        Returns a new zero-filled shared output buffer.
+        """
+        return self._create(name, shape, dtype)
+
+    def handles(self, names=None):
+        """
+        names: [String, ...], optional
+            Arrays to include (defaults to all)
+
+        Returns {name: handle} for `attach` in worker processes.
+        """
+        names = self._handles if names is None else names
+        return dict((name, self._handles[name]) for name in names)
+
+    def close(self):
+        """release all shared blocks (arrays from the registry become invalid)"""
+        self._arrays.clear()
+        self._handles.clear()
+        for block in self._blocks.values():
+            if shared_memory is not None:
+                block.close()
+                block.unlink()
+        self._blocks.clear()
+
+
+def attach(handles, writable=()):
+    """
+    handles: Dict
+        {name: handle} from `SharedArrays.handles`
+    writable: [String, ...], optional
+        Names of the output buffers the caller will write to; all other
+        arrays are attached read-only
+
+    Returns {name: array} viewing the shared blocks (no data is copied).
+    """
+    arrays = {}
+    for name, (block, shape, dtype) in handles.items():
+        if shared_memory is not None:
+            if block not in _ATTACHED:
+                _ATTACHED[block] = _attach_block(block)
+            buf = _ATTACHED[block].buf
+        else:
+            buf = block
+        array = np.frombuffer(buf, dtype=np.dtype(dtype), count=int(np.prod(shape))).reshape(shape)
+        array.flags.writeable = name in writable
+        arrays[name] = array
+    return arrays
@@ -18,37 +18,171 @@ inputs:
     tod_excl_lu - list of land uses to ignore in evaluating TOD suitability
     alloc_excl_lu - list of lands uses to ignore in evaluating allocation suitability
     stations_wc - SQL statment to generate optional scenario suitabilities
+    codes - `CategoryCodes` shared with other pipeline stages (land uses are encoded in the
+            `LAND_USE` domain; a new set is used if not provided)
+    chunk_size - maximum number of rows scored at a time (see `parcel_chunks`); None scores all at once
+    store - `ParcelStore` holding the attributes of `in_suit_fc` (see `parcel_store`); attributes are
+            read from the store instead of the feature class if it holds them
 
 parcels with `current_lu_field` values in `alloc_excl_lu` will have no suitability for allocation purposes
 parcels with `exp_lu_field` values in `tod_excl_lu` will have no suitabiltiy for TOD templating
+
+the unweighted suitability components (`COMPONENT_FIELDS`) are stored in the suitability
+table, so alternative `weights` can be re-scored with `SuitabilityMatrix` or
+`rescore_suitability` without repeating the overlay analysis
 """
-import arcpy
 import numpy as np
 import pandas as pd
 import csv
 from os import path
 
+from categories import CategoryCodes, LAND_USE
+from parcel_chunks import ChunkTableWriter, extend_chunk, iter_frames, text_lengths
+from tod.HandyGP import dfToArray
+from tod.LazyImport import arcpy
+
+
+# Suitability criteria (keys expected in `weights`) in the column order of the
+#  component matrix, with the unweighted component field and weighted field
+#  recorded in the suitability table for each
+SUIT_CRITERIA = ["in_DO", "is_vacant", "dev_size", "in_walkshed", "in_TOD"]
+COMPONENT_FIELDS = ["cmp_DO", "cmp_vac", "cmp_dev", "cmp_walk", "cmp_stn"]
+SUIT_FIELDS = ["suit_DO", "suit_vac", "suit_dev", "walk_suit", "in_station"]
+
 
 def miles_to_feet(miles):
     return miles * 5280
 
 
-def suit_select_by_overlap(
-    in_layer, select_features, overlap_type, df, id_field, search_dist=None
+def weight_vector(weights):
+    """
+    weights: Dict, list of Dicts, or array-like
+        A `weights` dictionary keyed by `SUIT_CRITERIA`, a list of such
+        dictionaries, or an array of weights already ordered by `SUIT_CRITERIA`
+        (one row per weighting scheme).
+
+    Returns a float array of shape (k,) for a single weighting scheme or (m, k)
+    for a batch of `m` schemes, where k = len(SUIT_CRITERIA).
+    """
+    if isinstance(weights, dict):
+        return np.array([weights[crit] for crit in SUIT_CRITERIA], dtype=float)
+    weights = list(weights) if not isinstance(weights, np.ndarray) else weights
+    if len(weights) and isinstance(weights[0], dict):
+        return np.array(
+            [[w[crit] for crit in SUIT_CRITERIA] for w in weights], dtype=float
+        )
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape[-1] != len(SUIT_CRITERIA):
+        raise ValueError(
+            "weights must have {} values ordered as {}".format(
+                len(SUIT_CRITERIA), SUIT_CRITERIA)
+        )
+    return weights
+
+
+def _mask_scores(raw, include):
+    if raw.ndim == 1:
+        return raw * include
+    return raw * include[:, np.newaxis]
+
+
+class SuitabilityMatrix(object):
+    """
+    Cached, unweighted suitability components for a set of parcels.
+
+    `components` is a (parcels x criteria) array ordered by `SUIT_CRITERIA`;
+    `tod_include` and `alloc_include` are the 0/1 eligibility flags from
+    `generate_suitability`. Scores are matrix-vector products, so re-scoring
+    with new weights (or a batch of weights) does not touch any geometry.
+    Null components (e.g., `cmp_dev` of parcels without a segment) count as 0,
+    as in the sum of weighted components.
+    """
+
+    def __init__(self, ids, components, tod_include, alloc_include):
+        self.ids = np.asarray(ids)
+        self.components = np.nan_to_num(np.asarray(components, dtype=float))
+        self.tod_include = np.asarray(tod_include, dtype=float)
+        self.alloc_include = np.asarray(alloc_include, dtype=float)
+
+    @classmethod
+    def from_frame(cls, df, id_field):
+        return cls(
+            ids=df[id_field].values,
+            components=df[COMPONENT_FIELDS].values,
+            tod_include=df["tod_include"].values,
+            alloc_include=df["alloc_include"].values,
+        )
+
+    @classmethod
+    def from_table(cls, suit_tbl, id_field):
+        """Load the cached components from a `suitability` table"""
+        fields = [id_field] + COMPONENT_FIELDS + ["tod_include", "alloc_include"]
+        df = pd.DataFrame(
+            arcpy.da.TableToNumPyArray(suit_tbl, fields, null_value=0.0)
+        )
+        return cls.from_frame(df, id_field)
+
+    def score(self, weights):
+        """
+        Raw suitability for each parcel: shape (n,) for a single weighting
+        scheme or (n, m) for a batch of `m` schemes (see `weight_vector`).
+        """
+        return self.components.dot(weight_vector(weights).T)
+
+    def tod_suit(self, weights):
+        return _mask_scores(self.score(weights), self.tod_include)
+
+    def alloc_suit(self, weights):
+        return _mask_scores(self.score(weights), self.alloc_include)
+
+    def to_frame(self, weights, id_field):
+        """`tod_suit`, `alloc_suit` data frame for a single weighting scheme"""
+        raw = self.score(weights)
+        return pd.DataFrame(
+            {
+                id_field: self.ids,
+                "tod_suit": raw * self.tod_include,
+                "alloc_suit": raw * self.alloc_include,
+            },
+            columns=[id_field, "tod_suit", "alloc_suit"],
+        )
+
+
+def select_ids_by_overlap(
+    in_layer, select_features, overlap_type, id_field, search_dist=None
 ):
-    # -- intersect layers and get parcel ids
+    """ids of features in `in_layer` that overlap `select_features`"""
     arcpy.SelectLayerByLocation_management(
         in_layer=in_layer,
         overlap_type=overlap_type,
         select_features=select_features,
         search_distance=search_dist,
     )
-    ids = arcpy.da.TableToNumPyArray(in_table=in_layer, field_names=id_field)[id_field]
+    return arcpy.da.TableToNumPyArray(in_table=in_layer, field_names=id_field)[id_field]
+
+
+def suit_select_by_overlap(
+    in_layer, select_features, overlap_type, df, id_field, search_dist=None
+):
+    # -- intersect layers and get parcel ids
+    ids = select_ids_by_overlap(
+        in_layer, select_features, overlap_type, id_field, search_dist
+    )
     # -- select df records by ids to assign values
     filt = np.in1d(ar1=df[id_field], ar2=ids)
     return filt
 
 
+def _dev_area(df, is_do_field, do_prop_field, acres_field):
+    # developable area: DO share of the parcel (or the whole parcel) less a loss factor
+    df["base_area"] = df[acres_field] * np.select(
+        [df[is_do_field] == 1], [df[do_prop_field]], 1.0
+    )
+    df["loss_factor"] = 0.5 + (0.4 * np.exp(-0.077 * df.base_area))
+    df["dev_area"] = df.base_area * df.loss_factor
+    return df
+
+
 def generate_suitability(
     in_suit_fc,
     id_field,
@@ -66,7 +200,10 @@ def generate_suitability(
     out_gdb,
     tod_excl_lu=[],
     alloc_excl_lu=[],
-    stations_wc=None
+    stations_wc=None,
+    codes=None,
+    chunk_size=None,
+    store=None,
 ):
     print "Building Suitability table..."
     # read in suitability shapes (tesselation or other (ie..parcels) to gdb
@@ -77,7 +214,6 @@ def generate_suitability(
     arcpy.AddIndex_management(
         in_table=suit_fc, fields=[id_field], index_name="ID_IDX",
     )
-    # Dump the table to a data frame
     fields = [
         id_field,
         is_do_field,
@@ -89,29 +225,30 @@ def generate_suitability(
         pipe_field,
         flu_lock
     ]
-    df = pd.DataFrame(arcpy.da.TableToNumPyArray(suit_fc, fields))
-    df[id_field] = df[id_field].astype(str)
+    # -- land uses as categorical codes
+    if codes is None:
+        codes = CategoryCodes()
+    lu_categories = {current_lu_field: LAND_USE, exp_lu_field: LAND_USE}
 
-    # Calc suit components
-    df["suit_DO"] = df[is_do_field] * weights["in_DO"]
-    df["suit_vac"] = np.select(
-        [df[current_lu_field] == "Vacant/Undeveloped"], [weights["is_vacant"]], 0.0
-    )
-    # -- dev area
-    df["base_area"] = df[acres_field] * np.select(
-        [df[is_do_field] == 1], [df[do_prop_field]], 1.0
-    )
-    df["loss_factor"] = 0.5 + (0.4 * np.exp(-0.077 * df.base_area))
-    df["dev_area"] = df.base_area * df.loss_factor
-    max_devs = df[[seg_id_field, "dev_area"]].groupby(seg_id_field).max()
-    # -- standardize dev area
-    df["seg_max"] = df.merge(
-        max_devs, how="left", left_on=seg_id_field, right_index=True
-    )["dev_area_y"]
-    df["dev_std"] = df.dev_area / df.seg_max
-    df["suit_dev"] = df.dev_std * weights["dev_size"]
+    def _chunks():
+        # the table is streamed in chunks of `chunk_size` rows (or read at once),
+        #  from the parcel store if it holds the fields
+        if store is not None and all(f in store for f in fields):
+            return store.iter_frames(
+                fields=fields,
+                chunk_size=chunk_size,
+                categories=lu_categories,
+                codes=codes,
+            )
+        return iter_frames(
+            in_table=suit_fc,
+            fields=fields,
+            chunk_size=chunk_size,
+            categories=lu_categories,
+            codes=codes,
+        )
 
-    # Add walk suit
+    # Select parcels in walksheds and near stations (ids only)
     # -- make layers
     suit_fl = arcpy.MakeFeatureLayer_management(
         in_features=in_suit_fc, out_layer="suit_fl"
@@ -122,50 +259,126 @@ def generate_suitability(
     stations_fl = arcpy.MakeFeatureLayer_management(
         in_features=stations, out_layer="stations", where_clause=stations_wc
     )
-    # -- filter polygons matching overlap and update table
-    walk_filt = suit_select_by_overlap(
+    # -- ids of polygons matching overlap
+    walk_ids = select_ids_by_overlap(
         in_layer=suit_fl,
         select_features=buff_fl,
-        df=df,
         overlap_type="INTERSECT",
         id_field=id_field,
     )
-    in_station_filt = suit_select_by_overlap(
+    in_station_ids = select_ids_by_overlap(
         in_layer=suit_fl,
         select_features=stations_fl,
-        df=df,
         overlap_type="WITHIN_A_DISTANCE",
         id_field=id_field,
         search_dist=miles_to_feet(0.5),
     )
-    df["walk_suit"] = np.select(
-        condlist=[walk_filt], choicelist=[weights["in_walkshed"]], default=0.0
-    )
-    df["in_station"] = np.select(
-        condlist=[in_station_filt], choicelist=[weights["in_TOD"]], default=0.0
-    )
     # -- clean up by deleting the layers
     arcpy.Delete_management(suit_fl)
     arcpy.Delete_management(stations_fl)
     arcpy.Delete_management(buff_fl)
 
+    # Max dev area by segment (first pass when streaming; the whole table is
+    #  only read once otherwise)
+    if chunk_size is None:
+        all_chunks = list(_chunks())
+        chunks = lambda: all_chunks
+    else:
+        chunks = _chunks
+    seg_maxes = [
+        _dev_area(df, is_do_field, do_prop_field, acres_field)
+        .groupby(seg_id_field)["dev_area"].max()
+        for df in chunks()
+    ]
+    max_devs = pd.concat(seg_maxes).groupby(level=0).max()
+
+    # Score each chunk, appending to the suitability table and parcel features
+    # ##NOTE: this will fail on rerun as the NumPyArrayToTable cant overwrite existing tbl
+    suit_tbl = path.join(out_gdb, "suitability")
+    writer = ChunkTableWriter(suit_tbl, text_lengths(suit_fc, fields))
+    weight_vec = weight_vector(weights)
+    for df in chunks():
+        df = _score_suitability(
+            df=_dev_area(df, is_do_field, do_prop_field, acres_field),
+            max_devs=max_devs,
+            walk_ids=walk_ids,
+            in_station_ids=in_station_ids,
+            weight_vec=weight_vec,
+            codes=codes,
+            id_field=id_field,
+            is_do_field=is_do_field,
+            seg_id_field=seg_id_field,
+            current_lu_field=current_lu_field,
+            exp_lu_field=exp_lu_field,
+            pipe_field=pipe_field,
+            flu_lock=flu_lock,
+            tod_excl_lu=tod_excl_lu,
+            alloc_excl_lu=alloc_excl_lu,
+        )
+        writer.write(df)
+        # join suit score to suit fc
+        extend_chunk(suit_fc, id_field, df[[id_field, "tod_suit", "alloc_suit"]].set_index(id_field))
+    print "...Suitability table generated here: {}".format(suit_tbl)
+    print "...'tod_suit', 'alloc_suit' added to ##-{}-## layer for use in TOD tools".format(suit_fc)
+    return suit_fc, suit_tbl
+
+
+def _score_suitability(
+    df,
+    max_devs,
+    walk_ids,
+    in_station_ids,
+    weight_vec,
+    codes,
+    id_field,
+    is_do_field,
+    seg_id_field,
+    current_lu_field,
+    exp_lu_field,
+    pipe_field,
+    flu_lock,
+    tod_excl_lu,
+    alloc_excl_lu,
+):
+    """suitability components, scores and eligibility for a chunk of parcels (streaming map step)"""
+    # Calc suit components (unweighted, see `COMPONENT_FIELDS`)
+    df["cmp_DO"] = df[is_do_field].astype(float)
+    df["cmp_vac"] = np.select(
+        [codes.isin(df[current_lu_field], ["Vacant/Undeveloped"], LAND_USE)], [1.0], 0.0
+    )
+    # -- standardize dev area
+    df["seg_max"] = df[seg_id_field].map(max_devs)
+    df["dev_std"] = df.dev_area / df.seg_max
+    df["cmp_dev"] = df.dev_std
+    # -- walk suit and station proximity
+    df["cmp_walk"] = np.select(
+        condlist=[np.in1d(df[id_field], walk_ids)], choicelist=[1.0], default=0.0
+    )
+    df["cmp_stn"] = np.select(
+        condlist=[np.in1d(df[id_field], in_station_ids)], choicelist=[1.0], default=0.0
+    )
+
     # Calc total suit
-    suit_fields = ["suit_DO", "suit_vac", "suit_dev", "walk_suit", "in_station"]
-    df["raw_suit"] = df[suit_fields].sum(axis=1)
+    # -- weighted components are kept for reference; raw suit is the product of
+    #    the component matrix and the weight vector, with null components
+    #    (e.g., dev area of parcels without a segment) counted as 0 like the
+    #    sum of the weighted components
+    components = df[COMPONENT_FIELDS].values
+    for suit_field, weighted in zip(SUIT_FIELDS, (components * weight_vec).T):
+        df[suit_field] = weighted
+    df["raw_suit"] = np.nan_to_num(components).dot(weight_vec)
 
     # zero out select uses for TOD templating purposes (unless DO)
     if tod_excl_lu:
-        exclusions = pd.concat([df[exp_lu_field] == lu for lu in tod_excl_lu], axis=1)
-        exclusions["tod_any_excl"] = np.any(exclusions, axis=1)
-        df["tod_lu_include"] = np.select([exclusions.tod_any_excl], [0.0], 1.0)
+        tod_any_excl = codes.isin(df[exp_lu_field], tod_excl_lu, LAND_USE)
+        df["tod_lu_include"] = np.select([tod_any_excl], [0.0], 1.0)
     else:
         df["tod_lu_include"] = 1.0
 
     # zero out select uses for allocation purposes (unless DO)
     if alloc_excl_lu:
-        exclusions = pd.concat([df[current_lu_field] == lu for lu in alloc_excl_lu], axis=1)
-        exclusions["alloc_any_excl"] = np.any(exclusions, axis=1)
-        df["alloc_lu_include"] = np.select([exclusions.alloc_any_excl], [0.0], 1.0)
+        alloc_any_excl = codes.isin(df[current_lu_field], alloc_excl_lu, LAND_USE)
+        df["alloc_lu_include"] = np.select([alloc_any_excl], [0.0], 1.0)
     else:
         df["alloc_lu_include"] = 1.0
 
@@ -196,25 +409,18 @@ def generate_suitability(
     df["alloc_include"] = np.select([_include_a], [1.0], 0.0)
     df["tod_suit"] = df.raw_suit * df.tod_include
     df["alloc_suit"] = df.raw_suit * df.alloc_include
-    # df["tot_suit"] = (
-    #     #df[[is_do_field, "lu_include", "pipe_include"]].max(axis=1) * df.raw_suit
-        
-    #     df[["lu_include", "pipe_include"]].min(axis=1) * df.raw_suit
-    # )
+    return df
 
-    # dump suit table to gdb ##NOTE: this will fail on rerun as the NumPyArrayToTable cant overwrite existing tbl
-    suit_tbl = path.join(out_gdb, "suitability")
-    out_array = np.array(np.rec.fromrecords(df.values))
-    names = df.dtypes.index.tolist()
-    out_array.dtype.names = tuple(names)
-    arcpy.da.NumPyArrayToTable(out_array, suit_tbl)
-    print "...Suitability table generated here: {}".format(suit_tbl)
 
-    # join suit score to suit fc
-    suit_df = df[[id_field, "tod_suit", "alloc_suit"]]
-    suit_arr = np.array(
-        np.rec.fromrecords(suit_df.values, names=suit_df.dtypes.index.tolist())
-    )
+def rescore_suitability(suit_fc, suit_tbl, id_field, weights):
+    """
+    Re-score `tod_suit` and `alloc_suit` on `suit_fc` for a new set of weights
+    using the components cached in `suit_tbl` by `generate_suitability`.
+    """
+    print "Re-scoring suitability..."
+    suit_mtx = SuitabilityMatrix.from_table(suit_tbl, id_field)
+    suit_df = suit_mtx.to_frame(weights, id_field)
+    suit_arr = dfToArray(suit_df)
     arcpy.da.ExtendTable(
         in_table=suit_fc,
         table_match_field=id_field,
@@ -222,8 +428,7 @@ def generate_suitability(
         array_match_field=id_field,
         append_only=False,
     )
-    print "...'tod_suit', 'alloc_suit' added to ##-{}-## layer for use in TOD tools".format(suit_fc)
-    return suit_fc, suit_tbl
+    return suit_mtx
 
 
 # if __name__ == "__main__":
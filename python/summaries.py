@@ -0,0 +1,200 @@
+"""
+Activity summaries
+
+Converts parcel floor area to households and jobs and aggregates the results
+to summary geographies (corridor segments, TAZs, station areas) in one pass:
+
+    1. parcel floor area is arranged as a (parcels x uses x phases) tensor
+       from `{use}_SF_{phase}` fields
+    2. a (uses x activities) conversion-factor matrix turns floor area into
+       activities (e.g., RES = sqft / sqft-per-unit * hh-per-unit,
+       JOBS = sqft / sqft-per-job) for every phase as one tensor product
+    3. floor area, activities and any other summed fields are aggregated to
+       each geography with a sparse group-sum, i.e. the product of the
+       (geography x parcels) membership matrix and the parcel value matrix.
+       Geographies given as a parcel-zone crosswalk (see `crosswalk`) use the
+       parcels' area shares as membership weights, so parcels straddling zone
+       boundaries are apportioned among them rather than counted in each.
+
+Activity fields are named `{activity}_{PHASE}` (e.g., "RES_EXPI", "JOBS_ALLOC").
+"""
+import numpy as np
+import pandas as pd
+
+from crosswalk import XWALK_AREA, XWALK_SHARE
+
+ACTIVITIES = ["RES", "JOBS"]
+
+
+def conversion_factors(uses, sqft_factors, res_uses, job_uses, unit_to_hh_factors=None):
+    """
+    uses: [String, ...]
+        Use groupings, in the order of the floor area tensor's use axis
+    sqft_factors: Dict
+        {use: square feet per dwelling unit (residential) or per job}
+    res_uses: [String, ...]
+        Uses converted to households (RES)
+    job_uses: [String, ...]
+        Uses converted to jobs (JOBS)
+    unit_to_hh_factors: Dict, optional
+        {use: households per dwelling unit} for `res_uses` (1.0 if omitted)
+
+    Returns a (uses x 2) array of RES and JOBS per square foot of each use;
+    uses in neither group have zero factors.
+    """
+    unit_to_hh_factors = unit_to_hh_factors or {}
+    factors = np.zeros((len(uses), 2))
+    for i, use in enumerate(uses):
+        if use in res_uses:
+            factors[i, 0] = unit_to_hh_factors.get(use, 1.0) / float(sqft_factors[use])
+        elif use in job_uses:
+            factors[i, 1] = 1.0 / float(sqft_factors[use])
+    return factors
+
+
+def sqft_fields(uses, phases, measure="SF"):
+    """(uses x phases) nested list of `{use}_{measure}_{phase}` field names"""
+    return [["{}_{}_{}".format(use, measure, phase) for phase in phases] for use in uses]
+
+
+def sqft_tensor(df, uses, phases, measure="SF"):
+    """
+    df: DataFrame
+        Parcel attributes with `{use}_{measure}_{phase}` fields
+    uses: [String, ...]
+    phases: [String, ...]
+        Phase suffixes (e.g., "Ex", "Pipe", "ExPi", "Alloc")
+
+    Returns a (parcels x uses x phases) array of floor area (nulls as 0).
+    """
+    fields = sqft_fields(uses, phases, measure)
+    flat = [field for use_fields in fields for field in use_fields]
+    values = df[flat].fillna(0).values.astype(float)
+    return values.reshape(len(df), len(uses), len(phases))
+
+
+def activity_fields(phases, activities=ACTIVITIES):
+    """`{activity}_{PHASE}` field names, ordered by phase, then activity"""
+    return ["{}_{}".format(act, phase.upper()) for phase in phases for act in activities]
+
+
+def activity_matrix(sqft, factors):
+    """
+    sqft: array
+        (parcels x uses x phases) floor area (see `sqft_tensor`)
+    factors: array
+        (uses x activities) conversion factors (see `conversion_factors`)
+
+    Returns a (parcels x phases*activities) array of activities, with columns
+    named by `activity_fields`.
+    """
+    activities = np.tensordot(sqft, factors, axes=([1], [0]))
+    return activities.reshape(sqft.shape[0], -1)
+
+
+def group_sum(values, rows, groups, n_groups, weights=None):
+    """
+    values: array
+        (parcels x fields) values to aggregate
+    rows: array
+        Parcel (row) index of each membership entry
+    groups: array
+        Group index of each membership entry
+    n_groups: Integer
+    weights: array, optional
+        Share of the parcel's values assigned to the group by each entry
+        (1.0 if omitted)
+
+    Sparse group-sum: the (rows, groups, weights) entries define a sparse
+    (parcels x groups) membership matrix `M`; returns the (groups x fields)
+    product `M.T.dot(values)`.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    entries = values[rows]
+    if weights is not None:
+        entries = entries * np.asarray(weights, dtype=float)[:, np.newaxis]
+    return np.array(
+        [np.bincount(groups, weights=entries[:, j], minlength=n_groups)
+         for j in range(values.shape[1])]
+    ).reshape(values.shape[1], n_groups).T
+
+
+def summarize(
+        df,
+        geographies,
+        uses,
+        phases,
+        factors,
+        activities=ACTIVITIES,
+        sum_fields=None,
+        measure="SF",
+):
+    """
+    df: DataFrame
+        Parcel attributes with `{use}_{measure}_{phase}` fields
+    geographies: Dict
+        {name: key} for each summary geography. The key is either a field in
+        `df` (e.g., {"segment": "seg_num"}; parcels with null keys are not
+        summarized) or a crosswalk data frame with the parcel id (the name of
+        `df`'s index), a zone id and area shares (see `crosswalk`), in which
+        case each parcel's values are apportioned by its area shares.
+    uses: [String, ...]
+        Uses converted to activities (rows of `factors`)
+    phases: [String, ...]
+        Phases converted to activities
+    factors: array
+        (uses x activities) conversion factors (see `conversion_factors`)
+    activities: [String, ...], default=ACTIVITIES
+        Activity names (columns of `factors`)
+    sum_fields: [String, ...], optional
+        Fields in `df` summed alongside the activities (e.g., floor area and
+        control total fields); integer fields keep integer sums.
+
+    Returns {name: DataFrame} with one summary table per geography, indexed by
+    the geography key (or zone id), with `sum_fields` followed by
+    `activity_fields`.
+    """
+    sum_fields = list(sum_fields or [])
+    act_fields = activity_fields(phases, activities)
+    act_values = activity_matrix(sqft_tensor(df, uses, phases, measure), factors)
+    values = np.hstack([df[sum_fields].fillna(0).values.astype(float), act_values])
+    int_fields = [f for f in sum_fields if df[f].dtype.kind in "iu"]
+
+    summaries = {}
+    for name, key in geographies.items():
+        if isinstance(key, pd.DataFrame):
+            rows, groups, weights, labels, key_field = _crosswalk_entries(key, df.index)
+        else:
+            key_field, weights = key, None
+            group_idx, labels = pd.factorize(df[key_field], sort=True)
+            rows = np.flatnonzero(group_idx >= 0)
+            groups = group_idx[rows]
+        sums = group_sum(values, rows, groups, len(labels), weights)
+        summary = pd.DataFrame(
+            sums, index=pd.Index(labels, name=key_field), columns=sum_fields + act_fields
+        )
+        if weights is None:
+            for field in int_fields:
+                summary[field] = summary[field].round().astype(np.int64)
+        summaries[name] = summary
+    return summaries
+
+
+def _crosswalk_entries(xwalk, parcel_index):
+    """membership entries (rows, zones, shares), zone labels and zone field of `xwalk`"""
+    parcel_id = parcel_index.name
+    zone_fields = [
+        f for f in xwalk.columns if f not in (parcel_id, XWALK_AREA, XWALK_SHARE)
+    ]
+    if len(zone_fields) != 1:
+        raise ValueError(
+            "Crosswalk must have one zone id field besides '{}' (found {})".format(
+                parcel_id, zone_fields)
+        )
+    zone_field = zone_fields[0]
+    rows = parcel_index.get_indexer(xwalk[parcel_id].values)
+    keep = rows >= 0
+    groups, labels = pd.factorize(xwalk[zone_field].values[keep], sort=True)
+    return rows[keep], groups, xwalk[XWALK_SHARE].values[keep], labels, zone_field
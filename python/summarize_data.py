@@ -3,6 +3,9 @@ import pandas as pd
 from os import path
 import numpy as np
 
+from crosswalk import load_crosswalk
+from summaries import conversion_factors, summarize
+
 arcpy.env.overwriteOutput = True
 
 # Use groupings
@@ -58,52 +61,45 @@ sid = "SegmentNum"
 
 
 
-def generate_summaries(suit_fc, suit_id, suit_fields, taz_fc, taz_id, seg_id)
+def generate_summaries(suit_fc, suit_id, suit_fields, taz_fc, taz_id, seg_id):
     # setup field lists
     expi_flds = genFieldList(suffix="ExPi", include_untracked=False)
     totcap_flds = genFieldList(suffix="TotCap", include_untracked=False)
     alloc_flds = genFieldList(suffix="alloc", include_untracked=False)
     buildout_flds = genFieldList(suffix="build", include_untracked=False)
     
-    pwTAZ = arcpy.SpatialJoin_analysis(
-        target_features=suit_fc, join_features=taz_fc,
-        out_feature_class="in_memory\parcels_wTAZ", match_option="INTERSECT"
+    # parcels are summarized by segment, and apportioned to TAZs by area share
+    taz_xwalk = load_crosswalk(
+        xwalk_file=path.join(summary_wkspc, "parcel_taz_crosswalk.csv"),
+        parcels=suit_fc,
+        parcel_id=suit_id,
+        zones=taz_fc,
+        zone_id=taz_id,
     )
-
     p_df = pd.DataFrame(
         arcpy.da.TableToNumPyArray(
-            in_table=pwTAZ, field_names=suit_fields + [taz_id], null_value=0.0
+            in_table=suit_fc, field_names=suit_fields, null_value=0.0
         )
     ).set_index(suit_id)
-
-    seg_summaries = p_df.groupby(seg_id).sum()
-    seg_summaries.drop(tid, axis=1, inplace=True)
     for expi_fld, alloc_fld, buildout_fld in zip(expi_flds, alloc_flds, buildout_flds):
-        seg_summaries[buildout_fld] = seg_summaries[expi_fld] + seg_summaries[alloc_fld]
-
-    seg_summaries["RES"] = (seg_summaries[buildout_flds[0]] / shares["SF"]) + (
-        seg_summaries[buildout_flds[1]] / shares["MF"]
-    )
-    seg_summaries["JOBS"] = (
-        (seg_summaries[buildout_flds[2]] / shares["Ret"])
-        + (seg_summaries[buildout_flds[3]] / shares["Ind"])
-        + (seg_summaries[buildout_flds[4]] / shares["Off"])
-        + (seg_summaries[buildout_flds[5]] / shares["Hot"])
+        p_df[buildout_fld] = p_df[expi_fld] + p_df[alloc_fld]
+
+    # sum floor area and convert buildout floor area to households and jobs
+    uses = RES + NRES + HOTEL
+    summaries = summarize(
+        df=p_df,
+        geographies={"segment": seg_id, "taz": taz_xwalk},
+        uses=uses,
+        phases=["build"],
+        factors=conversion_factors(
+            uses=uses, sqft_factors=shares, res_uses=RES, job_uses=NRES + HOTEL
+        ),
+        sum_fields=[f for f in suit_fields if f not in (suit_id, seg_id)] + buildout_flds,
     )
-
-    taz_summaries = p_df.groupby(tid).sum()
-    taz_summaries.drop("seg_num", axis=1, inplace=True)
-    for expi_fld, alloc_fld, buildout_fld in zip(expi_flds, alloc_flds, buildout_flds):
-        taz_summaries[buildout_fld] = taz_summaries[expi_fld] + taz_summaries[alloc_fld]
-    taz_summaries["RES"] = (taz_summaries[buildout_flds[0]] / shares["SF"]) + (
-        taz_summaries[buildout_flds[1]] / shares["MF"]
-    )
-    taz_summaries["JOBS"] = (
-        (taz_summaries[buildout_flds[2]] / shares["Ret"])
-        + (taz_summaries[buildout_flds[3]] / shares["Ind"])
-        + (taz_summaries[buildout_flds[4]] / shares["Off"])
-    )  # + (taz_summaries[buildout_flds[5]] / shares['Hot'])
-
+    seg_summaries, taz_summaries = [
+        summaries[geo].rename(columns={"RES_BUILD": "RES", "JOBS_BUILD": "JOBS"})
+        for geo in ["segment", "taz"]
+    ]
 
     # write out tables
     taz_summaries.to_csv(path.join(summary_wkspc, "taz_summary.csv"))
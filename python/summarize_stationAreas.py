@@ -3,6 +3,8 @@ import arcpy
 import os
 import pandas as pd
 
+from summaries import activity_fields, conversion_factors, summarize
+
 # %% factors
 activity_sf_factors = {
     "SF": 1800,
@@ -67,43 +69,37 @@ pdf = pd.DataFrame(
 ).set_index(id_field)
 
 # %% summarize data at station area
-station_summaries = pdf.groupby(station_name).sum()
-
-# summary of Households by phase
-station_summaries["HH_EX"] = (
-        ((station_summaries[ex_lu_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-        ((station_summaries[ex_lu_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-).astype(int)
-station_summaries["HH_PIPE"] = (
-        ((station_summaries[pipe_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-        ((station_summaries[pipe_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-).astype(int)
-station_summaries["HH_ALLOC"] = (
-        ((station_summaries[alloc_fields[0]] / activity_sf_factors["SF"]) * unit_to_hh_factors["SF"]) +
-        ((station_summaries[alloc_fields[1]] / activity_sf_factors["MF"]) * unit_to_hh_factors["MF"])
-).astype(int)
+# households (HH) and jobs by phase, as whole numbers
+phases = ["Ex", "Pipe", "Alloc"]
+factors = conversion_factors(
+    uses=RES + NRES + HOTEL,
+    sqft_factors=activity_sf_factors,
+    res_uses=RES,
+    job_uses=NRES + HOTEL,
+    unit_to_hh_factors=unit_to_hh_factors,
+)
+station_summaries = summarize(
+    df=pdf,
+    geographies={"station": station_name},
+    uses=RES + NRES + HOTEL,
+    phases=phases,
+    factors=factors,
+    activities=["HH", "JOBS"],
+    sum_fields=p_fields[2:],
+)["station"]
+for field in activity_fields(phases, ["HH", "JOBS"]):
+    station_summaries[field] = station_summaries[field].astype(int)
 station_summaries["HH_2040"] = (station_summaries['HH_PIPE'] +
                                 station_summaries['HH_ALLOC'] +
                                 station_summaries['HH_EX'])
-# summary of jobs by phase
-station_summaries["JOBS_EX"] = (
-        (station_summaries[ex_lu_fields[2]] / activity_sf_factors["Ret"]) +
-        (station_summaries[ex_lu_fields[3]] / activity_sf_factors["Ind"]) +
-        (station_summaries[ex_lu_fields[4]] / activity_sf_factors["Off"]) +
-        (station_summaries[ex_lu_fields[5]] / activity_sf_factors["Hot"])).astype(int)
-station_summaries["JOBS_PIPE"] = (
-        (station_summaries[pipe_fields[2]] / activity_sf_factors["Ret"]) +
-        (station_summaries[pipe_fields[3]] / activity_sf_factors["Ind"]) +
-        (station_summaries[pipe_fields[4]] / activity_sf_factors["Off"]) +
-        (station_summaries[pipe_fields[5]] / activity_sf_factors["Hot"])).astype(int)
-station_summaries["JOBS_ALLOC"] = (
-        (station_summaries[alloc_fields[2]] / activity_sf_factors["Ret"]) +
-        (station_summaries[alloc_fields[3]] / activity_sf_factors["Ind"]) +
-        (station_summaries[alloc_fields[4]] / activity_sf_factors["Off"]) +
-        (station_summaries[alloc_fields[5]] / activity_sf_factors["Hot"])).astype(int)
 station_summaries["JOBS_2040"] = (station_summaries['JOBS_PIPE'] +
                                   station_summaries['JOBS_ALLOC'] +
                                   station_summaries['JOBS_EX'])
+station_summaries = station_summaries[
+    p_fields[2:]
+    + ["HH_EX", "HH_PIPE", "HH_ALLOC", "HH_2040"]
+    + ["JOBS_EX", "JOBS_PIPE", "JOBS_ALLOC", "JOBS_2040"]
+]
 # reset index to stn_name
 station_summaries.reset_index(inplace=True)
 
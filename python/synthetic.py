@@ -0,0 +1,310 @@
+"""
+Synthetic corridors
+
+Generates corridors of configurable size (parcels, segments, stations) for
+benchmarking and testing the allocation and TOD template engines without
+source data or arcpy:
+
+    corridor = make_corridor(n_parcels=100000, n_segments=10, n_stations=20, seed=1)
+    allocate_array(corridor.suit_df(), ID_FIELD, SUIT_FIELD, SEG_FIELD,
+                   CAP_FIELDS, corridor.control_dict())
+
+Parcels are laid out along a straight corridor split into equal-length
+segments, with stations spaced evenly along it. Distributions follow the
+shape of the LCRT parcel base:
+    - parcel areas are log-normal (median about half an acre)
+    - about a quarter of parcels are ineligible (zero suitability); the rest
+      have beta-distributed scores that rise near stations
+    - capacity for change is concentrated in one or two activities per
+      parcel, with log-normal FARs
+    - segment control totals are 30-90% of the segment's capacity, and some
+      segment/activity controls are zero
+
+The same seed always produces the same corridor.
+"""
+import numpy as np
+import pandas as pd
+
+# activities, in the order of `allocation.ALLOC_ACTIVITIES`
+ACTIVITIES = ["SF", "MF", "Ret", "Ind", "Off", "Hot"]
+RES_ACTIVITIES = ["SF", "MF"]
+
+ID_FIELD = "ParclID"
+SEG_FIELD = "seg_num"
+SUIT_FIELD = "alloc_suit"
+STATION_FIELD = "stn_name"
+CAP_FIELDS = ["{}_SF_ChgCap".format(act) for act in ACTIVITIES]
+EXISTING_FIELDS = ["{}_SF_Plan".format(act) for act in ACTIVITIES]
+TARGET_FIELDS = ["{}_SF_Tgt".format(act) for act in ACTIVITIES]
+
+LAND_USES = [
+    "Single-family",
+    "Multifamily",
+    "Commercial/Retail",
+    "Industrial/Manufacturing",
+    "Office",
+    "Hospitality",
+    "Vacant/Undeveloped",
+    "Other",
+]
+LAND_USE_SHARES = [0.45, 0.1, 0.1, 0.08, 0.07, 0.02, 0.13, 0.05]
+
+# square feet per dwelling unit, job or hotel room (SmartAlloc and template units)
+SQFT_PER_UNIT = {"SF": 2000, "MF": 900, "Ret": 750, "Ind": 1500, "Off": 300, "Hot": 650}
+
+SQFT_PER_ACRE = 43560.0
+
+
+class SyntheticCorridor(object):
+    """
+    parcels: DataFrame
+        Parcel attributes indexed by `ID_FIELD`
+    stations: DataFrame
+        Station names, segments and positions
+    controls: DataFrame
+        Control totals (square feet) indexed by segment, with `ACTIVITIES`
+        columns
+    seed: Integer
+
+    Engine inputs are built by the methods below; each call returns new
+    objects, since most engines modify their inputs.
+    """
+
+    def __init__(self, parcels, stations, controls, seed=None):
+        self.parcels = parcels
+        self.stations = stations
+        self.controls = controls
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.parcels)
+
+    def suit_df(self):
+        """parcel segment, suitability and change capacity (`allocate_dict`, `allocate_array`)"""
+        return self.parcels[[SEG_FIELD, SUIT_FIELD] + CAP_FIELDS].copy()
+
+    def control_dict(self):
+        """{segment: {activity: control}} (`allocate_dict`, `allocate_array`)"""
+        return self.controls.T.to_dict()
+
+    def control_df(self):
+        """control totals indexed by segment (`allocate_df`)"""
+        return self.controls.copy()
+
+    def smart_alloc_arrays(self, units_scale=1.0):
+        """
+        units_scale: Number, default=1.0
+            Scale applied to control totals and capacities in units (dwelling
+            units, jobs, rooms); SmartAlloc allocates one unit at a time, so
+            large corridors may be scaled down.
+
+        Returns (control_rows, recipient_rows) structured arrays for
+        `SmartAlloc.ArrayToArrayAllocation` (and `_allocateValues`), with one
+        capacity and suitability field per activity.
+        """
+        unit_factors = np.array([float(SQFT_PER_UNIT[act]) for act in ACTIVITIES])
+        controls = np.floor(self.controls[ACTIVITIES].values / unit_factors * units_scale)
+        control_rows = np.zeros(
+            len(controls), dtype=[(SEG_FIELD, "<i4")] + [(act, "<i4") for act in ACTIVITIES]
+        )
+        control_rows[SEG_FIELD] = self.controls.index.values
+        for j, act in enumerate(ACTIVITIES):
+            control_rows[act] = controls[:, j]
+
+        caps = np.floor(self.parcels[CAP_FIELDS].values / unit_factors * units_scale)
+        suit = self.parcels[SUIT_FIELD].values
+        dt_list = [(ID_FIELD, "<i4"), (SEG_FIELD, "<i4")]
+        dt_list += [("{}_cap".format(act), "<f8") for act in ACTIVITIES]
+        dt_list += [("{}_suit".format(act), "<f8") for act in ACTIVITIES]
+        recipient_rows = np.zeros(len(self.parcels), dtype=dt_list)
+        recipient_rows[ID_FIELD] = self.parcels.index.values
+        recipient_rows[SEG_FIELD] = self.parcels[SEG_FIELD].values
+        for j, act in enumerate(ACTIVITIES):
+            recipient_rows["{}_cap".format(act)] = caps[:, j]
+            recipient_rows["{}_suit".format(act)] = np.where(caps[:, j] > 0, suit, 0.0)
+        return control_rows, recipient_rows
+
+    def station_parcels(self):
+        """{station name: parcel rows} for parcels within walking distance of a station"""
+        in_station = self.parcels[self.parcels[STATION_FIELD] != ""]
+        return dict(
+            (name, group) for name, group in in_station.groupby(STATION_FIELD)
+        )
+
+    def distribute_arrays(self, density=20.0):
+        """
+        density: Number, default=20.0
+            Station area activity target per acre (units and jobs)
+
+        Returns a list of (total target, array) pairs, one per station, for
+        `TOD._distribute`; arrays have the layout of `TOD._devAreasToNpArray`
+        ("NAME", "total_activity", "density_weight").
+        """
+        out = []
+        for name, group in sorted(self.station_parcels().items()):
+            array = np.zeros(
+                len(group),
+                dtype=[("NAME", "|S50"), ("total_activity", "<f8"), ("density_weight", "<f8")],
+            )
+            array["NAME"] = group.index.astype(str).values
+            array["density_weight"] = group["density_weight"].values * group["acres"].values
+            total = np.ceil(group["acres"].sum() * density)
+            out.append((total, array))
+        return out
+
+    def hotel_arrays(self, rooms_per_station=150, min_hotel_size=50):
+        """
+        rooms_per_station: Integer, default=150
+            Hotel room target of each station
+        min_hotel_size: Integer, default=50
+            Smallest hotel (rooms) a parcel may receive
+
+        Returns a list of (total target, array, minimum hotel size) triples,
+        one per station, for `TOD._allocate`; arrays have the layout of
+        `TOD._devAreasToNpArray` with a control field ("NAME",
+        "hotel_activity", "nonres_activity", "xx__CONTROL__xx").
+        """
+        out = []
+        for name, group in sorted(self.station_parcels().items()):
+            array = np.zeros(
+                len(group),
+                dtype=[
+                    ("NAME", "|S50"),
+                    ("hotel_activity", "<f8"),
+                    ("nonres_activity", "<f8"),
+                    ("xx__CONTROL__xx", "<f8"),
+                ],
+            )
+            array["NAME"] = group.index.astype(str).values
+            array["nonres_activity"] = group["nonres_activity"].values
+            array["xx__CONTROL__xx"] = group["nonres_activity"].values
+            # keep the target within the non-residential activity of parcels
+            #  large enough for a hotel
+            eligible = array["nonres_activity"] >= min_hotel_size
+            total = min(rooms_per_station, np.floor(array["nonres_activity"][eligible].sum() / 2.0))
+            out.append((total, array, min_hotel_size))
+        return out
+
+    def dev_area_df(self):
+        """station area parcels with planned (existing) and target floor area (`TOD._adjustTargets`)"""
+        in_station = self.parcels[STATION_FIELD] != ""
+        return self.parcels.loc[
+            in_station, [STATION_FIELD] + EXISTING_FIELDS + TARGET_FIELDS
+        ].reset_index()
+
+
+def make_corridor(
+        n_parcels,
+        n_segments=10,
+        n_stations=20,
+        seed=None,
+        segment_length=10560.0,
+        walk_distance=2640.0,
+):
+    """
+    n_parcels: Integer
+    n_segments: Integer, default=10
+    n_stations: Integer, default=20
+    seed: Integer, optional
+        Seed for the random number generator
+    segment_length: Number, default=10560.0
+        Segment length (feet)
+    walk_distance: Number, default=2640.0
+        Parcels within this distance (feet) of a station are in its station
+        area
+
+    Returns a `SyntheticCorridor`.
+    """
+    rng = np.random.RandomState(seed)
+    n = int(n_parcels)
+    length = n_segments * segment_length
+
+    # Layout: parcels scattered along the corridor, stations evenly spaced
+    x = np.sort(rng.uniform(0, length, n))
+    y = rng.normal(0, walk_distance * 1.5, n)
+    seg = np.minimum((x // segment_length).astype(np.int64), n_segments - 1) + 1
+    stn_x = (np.arange(n_stations) + 0.5) * length / n_stations
+    stn_x += rng.uniform(-0.1, 0.1, n_stations) * length / n_stations
+    stn_names = np.array(["STN_{:03d}".format(i + 1) for i in range(n_stations)])
+    # -- nearest station: the closer of the stations either side of each parcel
+    right = np.clip(np.searchsorted(stn_x, x), 0, n_stations - 1)
+    left = np.clip(right - 1, 0, n_stations - 1)
+    nearest = np.where(np.abs(stn_x[left] - x) <= np.abs(stn_x[right] - x), left, right)
+    stn_dist = np.hypot(stn_x[nearest] - x, y)
+    in_station = stn_dist <= walk_distance
+
+    # Parcel size and land use
+    sq_feet = np.round(rng.lognormal(np.log(20000.0), 1.0, n))
+    acres = sq_feet / SQFT_PER_ACRE
+    land_use = rng.choice(LAND_USES, size=n, p=LAND_USE_SHARES)
+    bld_sqft = np.round(sq_feet * rng.lognormal(np.log(0.3), 0.6, n))
+    bld_sqft[land_use == "Vacant/Undeveloped"] = 0
+
+    # Suitability: ineligible parcels score 0, others rise near stations
+    proximity = np.clip(1.0 - stn_dist / (2 * walk_distance), 0, 1)
+    suit = rng.beta(2, 5, n) * 0.7 + proximity * 0.3
+    suit[rng.uniform(size=n) < 0.25] = 0.0
+
+    # Capacity for change: one primary activity (and sometimes a second)
+    #  per parcel at a log-normal FAR
+    n_act = len(ACTIVITIES)
+    caps = np.zeros((n, n_act))
+    primary = rng.choice(n_act, size=n, p=[0.4, 0.2, 0.12, 0.1, 0.15, 0.03])
+    far = rng.lognormal(np.log(0.5), 0.7, n) * (1 + proximity)
+    caps[np.arange(n), primary] = sq_feet * far
+    second = rng.uniform(size=n) < 0.2
+    secondary = rng.choice(n_act, size=n)
+    caps[second, secondary[second]] += sq_feet[second] * far[second] * 0.5
+    caps[rng.uniform(size=n) < 0.15] = 0
+    caps = np.trunc(caps)
+
+    # Control totals: a share of each segment's capacity, some zero
+    seg_caps = np.array(
+        [np.bincount(seg - 1, weights=caps[:, j], minlength=n_segments) for j in range(n_act)]
+    ).T
+    shares = rng.uniform(0.3, 0.9, seg_caps.shape)
+    shares[rng.uniform(size=seg_caps.shape) < 0.1] = 0
+    controls = pd.DataFrame(
+        np.trunc(seg_caps * shares).astype(np.int64),
+        index=pd.Index(np.arange(1, n_segments + 1), name="segment"),
+        columns=ACTIVITIES,
+    )
+
+    # TOD template inputs: density weights decline with distance from the
+    #  station; planned floor area and template targets for station parcels
+    density_weight = np.where(in_station, 1.0 - 0.8 * stn_dist / walk_distance, 0.0)
+    nonres_activity = np.round(density_weight * rng.lognormal(np.log(40.0), 1.0, n))
+    planned = np.trunc(caps * rng.uniform(0, 0.6, (n, 1)))
+    targets = np.trunc(caps * rng.lognormal(np.log(0.8), 0.5, (n, 1)))
+
+    parcels = pd.DataFrame(
+        {
+            SEG_FIELD: seg,
+            SUIT_FIELD: suit,
+            STATION_FIELD: np.where(in_station, stn_names[nearest], ""),
+            "dist_to_station": stn_dist,
+            "density_weight": density_weight,
+            "nonres_activity": nonres_activity,
+            "Sq_Feet": sq_feet,
+            "acres": acres,
+            "BldSqFt": bld_sqft,
+            "LandUse2": land_use,
+            "x": x,
+            "y": y,
+        },
+        index=pd.Index(np.arange(1, n + 1), name=ID_FIELD),
+    )
+    for j, act in enumerate(ACTIVITIES):
+        parcels[CAP_FIELDS[j]] = caps[:, j]
+        parcels[EXISTING_FIELDS[j]] = planned[:, j]
+        parcels[TARGET_FIELDS[j]] = targets[:, j]
+
+    stations = pd.DataFrame(
+        {
+            STATION_FIELD: stn_names,
+            SEG_FIELD: np.minimum((stn_x // segment_length).astype(np.int64), n_segments - 1) + 1,
+            "x": stn_x,
+            "y": 0.0,
+        }
+    )
+    return SyntheticCorridor(parcels, stations, controls, seed)
@@ -0,0 +1,337 @@
+# Ensemble
+# Renaissance Planning
+# Description:
+'''
+Monte Carlo ensembles for the stochastic allocators (SmartAlloc allocations and
+hotel room allocation in TOD._allocate).
+
+A single run of either allocator is one random realization, so parcel-level
+outputs are noisy. An ensemble runs N seeded realizations in a process pool and
+folds each one into streaming accumulators as it is produced, so memory does
+not grow with N:
+    RunningStats: Welford running mean/variance for every recipient/activity cell
+    CellDigest: t-digest style quantile sketches for every recipient/activity cell
+
+Realization i is always run with seed `seed + i`, and realizations are folded
+into the accumulators in fixed-size chunks of consecutive seeds that are merged
+in seed order, so results do not depend on the number of worker processes (the
+quantile sketch merge is not associative, so they do depend on `chunk_size`).
+'''
+
+from LazyImport import arcpy
+import math
+import multiprocessing
+import numpy as np
+import SmartAlloc as SA
+import TOD
+
+
+# streaming accumulators
+# --------------------------------------------------------------------------
+class RunningStats(object):
+    """Welford running mean and variance for an array of cells"""
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, values):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    def merge(self, other):
+        """fold in another accumulator (Chan et al. pairwise update)"""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / float(count))
+        self.m2 = self.m2 + other.m2 + delta ** 2 * (self.count * other.count / float(count))
+        self.count = count
+
+    def variance(self, ddof=1):
+        if self.count - ddof <= 0:
+            return np.full(self.mean.shape, np.nan)
+        return self.m2 / float(self.count - ddof)
+
+
+class CellDigest(object):
+    """t-digest style quantile sketches for an array of cells that each receive one
+        value per realization. Centroids for all cells are held in (cells x bins) arrays
+        and compressed together: centroids are sorted within each cell and binned on
+        the arcsine k-scale of their cumulative weight, so tails keep fine resolution.
+        `compression` bounds the number of centroids per cell (about compression/2)."""
+
+    def __init__(self, n_cells, compression=100, buffer_size=None):
+        self.n_cells = n_cells
+        self.n_bins = int(compression // 2) + 1
+        self.buffer_size = buffer_size or self.n_bins
+        self.means = np.zeros((n_cells, 0))
+        self.weights = np.zeros((n_cells, 0))
+        self.min = np.full(n_cells, np.inf)
+        self.max = np.full(n_cells, -np.inf)
+        self._buffer = []
+
+    def update(self, values):
+        values = np.ravel(values).astype(float)
+        self.min = np.minimum(self.min, values)
+        self.max = np.maximum(self.max, values)
+        self._buffer.append(values)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        buffered = np.column_stack(self._buffer)
+        self._buffer = []
+        self._compress(np.hstack([self.means, buffered]),
+                       np.hstack([self.weights, np.ones(buffered.shape)]))
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self._compress(np.hstack([self.means, other.means]),
+                       np.hstack([self.weights, other.weights]))
+
+    def _compress(self, means, weights):
+        rows = np.arange(self.n_cells)[:, np.newaxis]
+        order = np.argsort(means, axis=1, kind="mergesort")
+        means = means[rows, order]
+        weights = weights[rows, order]
+        cumu = np.cumsum(weights, axis=1)
+        total = cumu[:, -1:]
+        total = np.where(total > 0, total, 1.0)
+        q = (cumu - weights / 2.0) / total
+        k = (np.arcsin(2 * q - 1) / math.pi + 0.5) * (self.n_bins - 1)
+        bins = np.clip(np.floor(k + 0.5).astype(np.intp), 0, self.n_bins - 1)
+        flat = (rows * self.n_bins + bins).ravel()
+        size = self.n_cells * self.n_bins
+        bin_weights = np.bincount(flat, weights=weights.ravel(), minlength=size)
+        bin_sums = np.bincount(flat, weights=(weights * means).ravel(), minlength=size)
+        bin_weights = bin_weights.reshape(self.n_cells, self.n_bins)
+        bin_sums = bin_sums.reshape(self.n_cells, self.n_bins)
+        self.weights = bin_weights
+        self.means = np.where(bin_weights > 0, bin_sums / np.where(bin_weights > 0, bin_weights, 1.0), 0.0)
+
+    def quantile(self, q):
+        """estimate the q-th quantile (0-1) of every cell"""
+        self.flush()
+        rows = np.arange(self.n_cells)
+        # move empty bins to the end, keeping centroid order
+        order = np.argsort(self.weights == 0, axis=1, kind="mergesort")
+        weights = self.weights[rows[:, np.newaxis], order]
+        means = self.means[rows[:, np.newaxis], order]
+        n_valid = (weights > 0).sum(axis=1)
+        cumu = np.cumsum(weights, axis=1)
+        total = cumu[:, -1]
+        centers = np.where(weights > 0, cumu - weights / 2.0, np.inf)
+        target = q * total
+        idx = (centers < target[:, np.newaxis]).sum(axis=1)
+        lo_idx = np.clip(idx - 1, 0, self.n_bins - 1)
+        hi_idx = np.clip(idx, 0, self.n_bins - 1)
+        # interpolate between neighboring centroids, or toward the min/max at the ends
+        lo_c = np.where(idx > 0, centers[rows, lo_idx], 0.0)
+        lo_m = np.where(idx > 0, means[rows, lo_idx], self.min)
+        at_end = idx >= n_valid
+        hi_c = np.where(at_end, total, centers[rows, hi_idx])
+        hi_m = np.where(at_end, self.max, means[rows, hi_idx])
+        span = np.where(hi_c > lo_c, hi_c - lo_c, 1.0)
+        frac = np.clip((target - lo_c) / span, 0.0, 1.0)
+        result = lo_m + frac * (hi_m - lo_m)
+        return np.where(total > 0, result, np.nan)
+
+
+# realizations
+# --------------------------------------------------------------------------
+class SmartAllocRealization(object):
+    """a picklable SmartAlloc realization: calling it with a seed runs
+        SmartAlloc.ArrayToArrayAllocation and returns a (recipients x activities) array
+        of allocated units, aligned with `ids` and `fields`"""
+
+    def __init__(self, control_rows, control_id_field, control_total_fields,
+                 recipient_rows, recipient_id_field, recipient_link_field,
+                 recipient_capacity_fields, recipient_suitability_fields,
+                 recipient_mix_fields=None, consumption_weights=None):
+        self.control_rows = control_rows
+        self.control_id_field = control_id_field
+        self.control_total_fields = SA._adaptParameters(control_total_fields)[1]
+        self.recipient_rows = recipient_rows
+        self.recipient_id_field = recipient_id_field
+        self.recipient_link_field = recipient_link_field
+        self.recipient_capacity_fields = recipient_capacity_fields
+        self.recipient_suitability_fields = recipient_suitability_fields
+        self.recipient_mix_fields = recipient_mix_fields
+        self.consumption_weights = consumption_weights
+        id_dtype = SA._idDType(recipient_rows, recipient_id_field)
+        self.ids = recipient_rows[recipient_id_field].astype(id_dtype)
+        self.fields = list(self.control_total_fields)
+        self._index = dict((recipient_id, i) for i, recipient_id in enumerate(self.ids))
+
+    def __call__(self, seed):
+        np.random.seed(seed)
+        alloc_array, unalloc_array = SA.ArrayToArrayAllocation(
+            self.control_rows, self.control_id_field, list(self.control_total_fields),
+            self.recipient_rows, self.recipient_id_field, self.recipient_link_field,
+            self.recipient_capacity_fields, self.recipient_suitability_fields,
+            recipient_mix_fields=self.recipient_mix_fields,
+            consumption_weights=self.consumption_weights)
+        values = np.zeros((len(self.ids), len(self.fields)))
+        rows = [self._index[recipient_id] for recipient_id in alloc_array[self.recipient_id_field]]
+        for j, field in enumerate(self.fields):
+            values[rows, j] = alloc_array[field]
+        return values
+
+
+class HotelRealization(object):
+    """a picklable realization of hotel room allocation (TOD._allocate) for a set of
+        stations: `station_arrays` is a list of (hotel_target, dev_area_array, min_hotel_size)
+        tuples (see hotelArraysFromCorridor)"""
+
+    def __init__(self, station_arrays):
+        self.station_arrays = station_arrays
+        self.ids = np.concatenate([array["NAME"] for _, array, _ in station_arrays])
+        self.fields = ["hotel_activity"]
+
+    def __call__(self, seed):
+        np.random.seed(seed)
+        values = []
+        for hotel_target, array, min_hotel_size in self.station_arrays:
+            result = TOD._allocate(hotel_target, array.copy(), "hotel_activity", "nonres_activity",
+                                   control_attr="nonres_activity", min_value=min_hotel_size)
+            values.append(result["hotel_activity"])
+        return np.concatenate(values)[:, np.newaxis]
+
+
+def hotelArraysFromCorridor(corridor):
+    """build HotelRealization inputs from a corridor whose stations have already had
+        targets distributed to their development areas (Station.distributeTargetsToDevAreas)"""
+    station_arrays = []
+    for station in corridor.stations:
+        array = TOD._devAreasToNpArray(station.dev_areas, "hotel_activity", "nonres_activity",
+                                       control_attr="nonres_activity")
+        array["hotel_activity"] = 0.0
+        station_arrays.append((station.station_type.hotel_target, array,
+                               station.station_type.min_hotel_size))
+    return station_arrays
+
+
+# ensemble runner
+# --------------------------------------------------------------------------
+_WORKER = {}
+
+
+# realizations folded into one set of accumulators per pool task; fixed so the chunk
+#  layout (and quantile estimates) do not depend on the number of worker processes
+CHUNK_SIZE = 25
+
+
+def _initWorker(realization, compression, track_quantiles):
+    _WORKER["realization"] = realization
+    _WORKER["compression"] = compression
+    _WORKER["track_quantiles"] = track_quantiles
+
+
+def _runSeeds(seeds):
+    realization = _WORKER["realization"]
+    shape = (len(realization.ids), len(realization.fields))
+    stats = RunningStats(shape)
+    digest = None
+    if _WORKER["track_quantiles"]:
+        digest = CellDigest(shape[0] * shape[1], compression=_WORKER["compression"])
+    for seed in seeds:
+        values = realization(seed)
+        stats.update(values)
+        if digest is not None:
+            digest.update(values)
+    if digest is not None:
+        digest.flush()
+    return stats, digest
+
+
+def runEnsemble(realization, n_realizations, seed=0, processes=None,
+                quantiles=(0.05, 0.5, 0.95), compression=100, chunk_size=None):
+    """run `n_realizations` seeded realizations of `realization` (e.g., SmartAllocRealization,
+        HotelRealization) in a process pool and return a structured summary array with
+        mean, variance and quantile estimates for every recipient and activity. Seeds are
+        run in chunks of `chunk_size` (default CHUNK_SIZE) realizations, merged in seed order"""
+    seeds = [seed + i for i in range(n_realizations)]
+    if not chunk_size:
+        chunk_size = CHUNK_SIZE
+    chunks = [seeds[i:i + chunk_size] for i in range(0, n_realizations, chunk_size)]
+    track_quantiles = bool(quantiles)
+    init_args = (realization, compression, track_quantiles)
+    if processes == 1:
+        _initWorker(*init_args)
+        results = [_runSeeds(chunk) for chunk in chunks]
+    else:
+        pool = multiprocessing.Pool(processes=processes, initializer=_initWorker, initargs=init_args)
+        try:
+            results = pool.map(_runSeeds, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    # fold chunk accumulators together in seed order
+    stats, digest = results[0]
+    for chunk_stats, chunk_digest in results[1:]:
+        stats.merge(chunk_stats)
+        if digest is not None:
+            digest.merge(chunk_digest)
+    return _summarize(realization, stats, digest, quantiles)
+
+
+def _summarize(realization, stats, digest, quantiles):
+    n_ids, n_fields = len(realization.ids), len(realization.fields)
+    dt_list = [("recip_id", realization.ids.dtype.str)]
+    columns = [realization.ids]
+    variance = stats.variance()
+    quantile_values = [digest.quantile(q).reshape(n_ids, n_fields) for q in quantiles] if digest else []
+    for j, field in enumerate(realization.fields):
+        dt_list += [("{}_mean".format(field), "<f8"), ("{}_var".format(field), "<f8")]
+        columns += [stats.mean[:, j], variance[:, j]]
+        for q, q_values in zip(quantiles, quantile_values):
+            dt_list.append(("{}_q{:02d}".format(field, int(round(q * 100))), "<f8"))
+            columns.append(q_values[:, j])
+    summary = np.zeros(n_ids, dtype=np.dtype(dt_list))
+    for (name, _), column in zip(dt_list, columns):
+        summary[name] = column
+    return summary
+
+
+def TableToTableEnsemble(control_table, control_id_field, control_total_fields,
+                         recipient_table, recipient_id_field, recipient_link_field,
+                         recipient_capacity_fields, recipient_suitability_fields,
+                         out_table, n_realizations, seed=0, processes=None,
+                         quantiles=(0.05, 0.5, 0.95), recipient_mix_fields=None,
+                         consumption_weights=None, control_where_clause=""):
+    """ensemble version of SmartAlloc.TableToTableAllocation: runs `n_realizations` seeded
+        allocations and writes a single summary table of per-recipient statistics"""
+    single_ctrl, ctrl_fields = SA._adaptParameters(control_total_fields)
+    single_cap, cap_fields = SA._adaptParameters(recipient_capacity_fields)
+    single_suit, suit_fields = SA._adaptParameters(recipient_suitability_fields)
+    recipient_fields = [recipient_id_field, recipient_link_field] + cap_fields + suit_fields
+    if recipient_mix_fields:
+        recipient_fields += recipient_mix_fields
+    control_rows = arcpy.da.TableToNumPyArray(control_table, [control_id_field] + ctrl_fields,
+                                              control_where_clause, skip_nulls=True)
+    recipient_rows = arcpy.da.TableToNumPyArray(recipient_table, recipient_fields, skip_nulls=True)
+    realization = SmartAllocRealization(control_rows, control_id_field, ctrl_fields,
+                                        recipient_rows, recipient_id_field, recipient_link_field,
+                                        recipient_capacity_fields, recipient_suitability_fields,
+                                        recipient_mix_fields=recipient_mix_fields,
+                                        consumption_weights=consumption_weights)
+    summary = runEnsemble(realization, n_realizations, seed=seed, processes=processes,
+                          quantiles=quantiles)
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+    arcpy.da.NumPyArrayToTable(summary, out_table)
+    return out_table
@@ -22,10 +22,12 @@ Inventory:
         location.  Optionally, group features and find the (weighted) centroid of the group.
     create fishnet: copy of arctoolbox Create Fishnet tool but honors selected features
         and where clauses.
+    numpy fishnet: build fishnet cells in memory from the features' bounding box, clipped
+        to the features, as coordinate arrays with cell ids.
 
 '''
 
-import arcpy
+from LazyImport import arcpy
 import numpy as np
 import pandas as pd
 import uuid
@@ -166,16 +168,55 @@ def _getDistanceBetweenPoints(point_1, point_2, sr):
     return point_1.distanceTo(point_2.projectAs(sr))
 
 
+def _featureExtent(fc, where_clause=None, sr=None):
+    """bounding box (x_min, y_min, x_max, y_max) of the selected features. Without a where clause (and in
+        the feature class's own spatial reference) this is the feature class extent; otherwise the extents of
+        the selected shapes are combined (no vertices are read out)"""
+    desc = arcpy.Describe(fc)
+    same_sr = sr is None or (sr.factoryCode and sr.factoryCode == desc.spatialReference.factoryCode)
+    if not where_clause and same_sr:
+        extent = desc.extent
+        return extent.XMin, extent.YMin, extent.XMax, extent.YMax
+    x_min = y_min = np.inf
+    x_max = y_max = -np.inf
+    with arcpy.da.SearchCursor(fc, "SHAPE@", where_clause=where_clause, spatial_reference=sr) as c:
+        for shape, in c:
+            if shape is None:
+                continue
+            extent = shape.extent
+            x_min = min(x_min, extent.XMin)
+            y_min = min(y_min, extent.YMin)
+            x_max = max(x_max, extent.XMax)
+            y_max = max(y_max, extent.YMax)
+    return x_min, y_min, x_max, y_max
+
+
+def _polygonRings(fc, where_clause=None, sr=None):
+    """list of polygons, each a list of ring vertex arrays ((n, 2) x/y arrays, exterior and interior rings)"""
+    polygons = []
+    with arcpy.da.SearchCursor(fc, "SHAPE@", where_clause=where_clause,
+                               spatial_reference=sr) as c:
+        for r in c:
+            rings = []
+            for part in r[0]:
+                ring = []
+                for pnt in part:
+                    if pnt:
+                        ring.append((pnt.X, pnt.Y))
+                    elif ring:
+                        # a null point separates interior rings
+                        rings.append(np.array(ring))
+                        ring = []
+                if ring:
+                    rings.append(np.array(ring))
+            polygons.append(rings)
+    return polygons
+
+
 def _createFishnetCoords(fc, where_clause=None, sr=None):
     if not sr:
         sr = arcpy.Describe(fc).spatialReference
-    with arcpy.da.SearchCursor(fc, "SHAPE@", where_clause=where_clause,
-                               spatial_reference=sr) as c:
-        extents = [r[0].extent for r in c]
-    x_min = min([extent.XMin for extent in extents])
-    x_max = max([extent.XMax for extent in extents])
-    y_min = min([extent.YMin for extent in extents])
-    y_max = max([extent.YMax for extent in extents])
+    x_min, y_min, x_max, y_max = _featureExtent(fc, where_clause=where_clause, sr=sr)
     origin = "{} {}".format(x_min, y_min)
     y_coord = "{} {}".format(x_min, y_min + 10)
     opposite_corner = "{} {}".format(x_max, y_max)
@@ -197,22 +238,73 @@ def _getFieldDType(fc, field_name):
 
 
 # pandas helpers
-def _makeArrayFromDf(df, dtype):
-    try:
-        array = np.array([tuple(row) for row in df.values], dtype)
-    except ValueError:
-        array = df.reset_index().values
-        array = np.array([tuple(row) for row in array], dtype)
+def dfToArray(df, index=False, null_string=""):
+    """structured array built column by column from a data frame's native dtypes (for arcpy.da
+        table writers). Avoids df.values, which upcasts mixed frames to an object array that
+        then has to be re-parsed row by row. Text columns are sized to their longest value and
+        nulls are written as `null_string`; integers are stored as 32-bit (LONG) integers,
+        nullable integers become floats (nulls as NaN) and booleans become integers. Set `index` to include the (named) index as the first column(s)."""
+    columns = []
+    if index:
+        for level, name in enumerate(df.index.names):
+            columns.append((name or "index", df.index.get_level_values(level)))
+    columns += [(name, df[name]) for name in df.columns]
+    dt_list = []
+    values_list = []
+    for name, column in columns:
+        values = _columnToArray(column, null_string)
+        dt_list.append((str(name), values.dtype.str))
+        values_list.append(values)
+    array = np.empty(len(df), dtype=np.dtype(dt_list))
+    for (name, dtype), values in zip(dt_list, values_list):
+        array[name] = values
     return array
 
 
+def _columnToArray(column, null_string=""):
+    if hasattr(column.dtype, "numpy_dtype") and column.dtype.kind in "iuf":
+        # pandas nullable numeric extension types
+        return column.astype(float).values
+    values = np.asarray(column)
+    kind = values.dtype.kind
+    if kind == "b":
+        return values.astype("<i4")
+    elif kind in "iu":
+        # arcpy tables hold 32-bit integers; wider integers are written as doubles if needed
+        if len(values) == 0 or (values.min() >= -2 ** 31 and values.max() < 2 ** 31):
+            return values.astype("<i4")
+        return values.astype("<f8")
+    elif kind in "fM":
+        return values
+    elif kind == "O":
+        # object columns holding numbers or booleans (e.g., values gathered from mixed frames) keep their
+        #  numeric type; numeric-looking strings stay text
+        inferred = np.asarray(pd.Series(values).infer_objects())
+        if inferred.dtype.kind in "biufM":
+            return _columnToArray(inferred, null_string)
+    # text (object, categorical, bytes) columns
+    nulls = pd.isnull(values)
+    if nulls.any():
+        values = np.where(nulls, null_string, values)
+    if len(values) == 0:
+        return values.astype("<U1")
+    return values.astype("U")
+
+
+def _makeArrayFromDf(df, dtype):
+    """structured array with the given dtype from the data frame's columns (or index and
+        columns, if the data frame has fewer columns than dtype fields)"""
+    dtype = np.dtype(dtype)
+    array = dfToArray(df, index=len(df.columns) < len(dtype.names))
+    out_array = np.empty(len(array), dtype=dtype)
+    for out_name, in_name in zip(dtype.names, array.dtype.names):
+        out_array[out_name] = array[in_name]
+    return out_array
+
+
 # Extend table with data frame
 def extendTableDf(in_table, table_match_field, df, df_match_field, **kwargs):
-    in_array = np.array(
-        np.rec.fromrecords(
-            df.values, names=df.dtypes.index.tolist()
-        )
-    )
+    in_array = dfToArray(df)
     arcpy.da.ExtendTable(in_table=in_table,
                          table_match_field=table_match_field,
                          in_array=in_array,
@@ -220,11 +312,7 @@ def extendTableDf(in_table, table_match_field, df, df_match_field, **kwargs):
                          **kwargs)
 
 def dfToArcpyTable(df, out_table):
-    in_array = np.array(
-        np.rec.fromrecords(
-            df.values, names=df.dtypes.index.tolist()
-        )
-    )
+    in_array = dfToArray(df)
     arcpy.da.NumPyArrayToTable(in_array, out_table)
 # Maximum overlap spatial join
 # ------------------------------------------------------------------------------------
@@ -506,42 +594,65 @@ def multiRingServiceAreaNoOverlap(in_features, id_field, output_fc, network_data
 # ------------------------------------------------------------------------------------
 def FeaturesToCentroids(in_features, id_field, output_fc, where_clause=None,
                         weight_field=None, sr=None):
-    # setup output_dtype:
-    id_field_dtype = _getFieldDType(in_features, id_field)
-    dt_list = [(id_field, id_field_dtype), ("SHAPE@X", '<f8'), ("SHAPE@Y", '<f8')]
-
-    # dump in_features to array and convert to pd data frame
-    arcpy.AddMessage("creating pandas data frame from input features")
+    """create a point feature class with one (weighted) centroid per value of `id_field`,
+        e.g., parcels grouped by station area and weighted by activity"""
     if not sr:
-        sr = arcpy.Describe(in_polygons).spatialReference
-    fields = [id_field] + groupd_fields + weight_fields + ["SHAPE@X", "SHAPE@Y"]
-    array = arcpy.da.FeatureClassToNumPyArray(in_polygons, fields,
+        sr = arcpy.Describe(in_features).spatialReference
+
+    # dump in_features to array
+    arcpy.AddMessage("creating array from input features")
+    fields = [id_field, "SHAPE@X", "SHAPE@Y"]
+    null_value = None
+    if weight_field:
+        fields.append(weight_field)
+        null_value = {weight_field: 0.0}
+    array = arcpy.da.FeatureClassToNumPyArray(in_features, fields,
                                               where_clause=where_clause,
-                                              spatial_reference=sr)
-    df = pd.DataFrame(array)
+                                              spatial_reference=sr,
+                                              null_value=null_value)
 
     # summarize (weighted) cental points
     arcpy.AddMessage("finding centroid locations")
     if weight_field:
         arcpy.AddMessage("...weighted by {}".format(weight_field))
-        weight_field_dtype = _getFieldDType(in_features, weight_field)
-        dt_list.append((weight_field, weight_field_dtype))
-        # create product sums
-        for coord in ['X', 'Y']:
-            df["SHAPE@{}_".format(coord)] = df["SHAPE@{}".format(coord)]
-            df["SHAPE@{}".format(coord)] = df["SHAPE@{}_".format(coord)] * df[weight_field]
-        df_sum = df.groupby([id_field])["SHAPE@X", "SHAPE@Y", weight_field].sum()
-    else:
-        df_sum = df.groupby([id_field])["SHAPE@X", "SHAPE@Y"].sum()
-    out_array = _makeArrayFromDf(df_sum, np.dtype(dt_list))
+    out_array = _weightedCentroids(array, id_field, weight_field)
 
     # export output
     arcpy.AddMessage("writing output features")
+    if arcpy.Exists(output_fc):
+        arcpy.Delete_management(output_fc)
     arcpy.da.NumPyArrayToFeatureClass(out_array, output_fc, ["SHAPE@X", "SHAPE@Y"],
                                       spatial_reference=sr)
     return output_fc
 
 
+def _weightedCentroids(array, group_field, weight_field=None):
+    """group-wise (weighted) mean of SHAPE@X and SHAPE@Y in a structured array, returned as a
+        structured array of group_field, SHAPE@X, SHAPE@Y (and the summed weight_field). Groups
+        with no weight fall back to the unweighted mean."""
+    groups, group_idx = np.unique(array[group_field], return_inverse=True)
+    group_idx = group_idx.ravel()
+    n_groups = len(groups)
+    counts = np.bincount(group_idx, minlength=n_groups).astype(float)
+    dt_list = [(group_field, array.dtype[group_field].str), ("SHAPE@X", "<f8"), ("SHAPE@Y", "<f8")]
+    if weight_field:
+        dt_list.append((weight_field, "<f8"))
+        weights = array[weight_field].astype(float)
+        weight_sums = np.bincount(group_idx, weights=weights, minlength=n_groups)
+    out_array = np.zeros(n_groups, dtype=np.dtype(dt_list))
+    out_array[group_field] = groups
+    for coord in ["SHAPE@X", "SHAPE@Y"]:
+        mean = np.bincount(group_idx, weights=array[coord], minlength=n_groups) / counts
+        if weight_field:
+            product_sums = np.bincount(group_idx, weights=array[coord] * weights, minlength=n_groups)
+            has_weight = weight_sums != 0
+            mean[has_weight] = product_sums[has_weight] / weight_sums[has_weight]
+        out_array[coord] = mean
+    if weight_field:
+        out_array[weight_field] = weight_sums
+    return out_array
+
+
 # Create fishnet
 # ------------------------------------------------------------------------------------
 def createFishnet(in_features, output_fc, cell_width=None, cell_height=None,
@@ -561,15 +672,124 @@ def createFishnet(in_features, output_fc, cell_width=None, cell_height=None,
                                    number_of_rows, number_of_columns, opposite_corner,
                                    labels, geometry_type=geometry_type)
     arcpy.DefineProjection_management(output_fc, sr)
-    # create a cell ID field
+    # create a cell ID field (numbered in object id order)
     arcpy.AddMessage('Updating cell id')
+    oid_field = arcpy.Describe(output_fc).OIDFieldName
+    oids = arcpy.da.TableToNumPyArray(output_fc, oid_field)[oid_field]
+    cell_ids = np.empty(len(oids), dtype=[("xx__OID__xx", "<i4"), ("CELL_ID", "<i4")])
+    cell_ids["xx__OID__xx"] = np.sort(oids)
+    cell_ids["CELL_ID"] = np.arange(1, len(oids) + 1)
+    arcpy.da.ExtendTable(output_fc, oid_field, cell_ids, "xx__OID__xx")
+    return output_fc
+
+
+# Numpy fishnet
+# ------------------------------------------------------------------------------------
+def _cellsInPolygon(rings, x_min, y_min, cell_width, cell_height, n_rows, n_cols):
+    """row and column indices of fishnet cells whose centers fall inside a polygon (list of ring
+        vertex arrays). The fishnet grid serves as the spatial index: only the window of rows and
+        columns under the polygon's bounding box is scanned, and each ring edge only visits the
+        rows it spans (scanline even-odd fill)."""
+    vertices = np.vstack(rings)
+    # window of cells whose centers can fall inside the polygon
+    r_lo, r_hi = np.clip(np.ceil((np.array([vertices[:, 1].min(), vertices[:, 1].max()]) - y_min)
+                                 / cell_height - 0.5).astype(int) + [0, 1], 0, n_rows)
+    c_lo, c_hi = np.clip(np.ceil((np.array([vertices[:, 0].min(), vertices[:, 0].max()]) - x_min)
+                                 / cell_width - 0.5).astype(int) + [0, 1], 0, n_cols)
+    if r_hi <= r_lo or c_hi <= c_lo:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    # ring edges
+    x0 = np.concatenate([ring[:, 0] for ring in rings])
+    y0 = np.concatenate([ring[:, 1] for ring in rings])
+    x1 = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings])
+    y1 = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+    # rows whose cell centers each edge crosses (half-open, so shared vertices count once)
+    row_start = np.clip(np.ceil((np.minimum(y0, y1) - y_min) / cell_height - 0.5).astype(int), r_lo, r_hi)
+    row_end = np.clip(np.ceil((np.maximum(y0, y1) - y_min) / cell_height - 0.5).astype(int), r_lo, r_hi)
+    counts = np.maximum(row_end - row_start, 0)
+    edge = np.repeat(np.arange(len(x0)), counts)
+    rows = row_start[edge] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    y_center = y_min + (rows + 0.5) * cell_height
+    x_cross = x0[edge] + (y_center - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    # toggle cells to the right of each crossing; an odd count of toggles is inside
+    cols = np.clip(np.ceil((x_cross - x_min) / cell_width - 0.5).astype(int), c_lo, c_hi)
+    toggles = np.zeros((r_hi - r_lo, c_hi - c_lo + 1), dtype=np.int32)
+    np.add.at(toggles, (rows - r_lo, cols - c_lo), 1)
+    inside = np.cumsum(toggles[:, :-1], axis=1) % 2 == 1
+    in_rows, in_cols = np.nonzero(inside)
+    return in_rows + r_lo, in_cols + c_lo
+
+
+def numpyFishnet(in_features, cell_width, cell_height=None, where_clause=None, sr=None,
+                 clip=True):
+    """build a fishnet over the extent of `in_features` in memory. Cells are returned as a
+        structured array of CELL_ID, ROW, COL, cell bounds (XMin, YMin, XMax, YMax) and center
+        coordinates (SHAPE@X, SHAPE@Y). CELL_ID numbers the full grid row by row from the lower-left
+        origin, so ids are stable whether or not the grid is clipped. If `clip` is True only cells
+        whose centers fall inside the (selected) polygon features are kept."""
+    if not sr:
+        sr = arcpy.Describe(in_features).spatialReference
+    if not cell_height:
+        cell_height = cell_width
+    arcpy.AddMessage('Finding extents')
+    x_min, y_min, x_max, y_max = _featureExtent(in_features, where_clause=where_clause, sr=sr)
+    n_cols = max(int(np.ceil((x_max - x_min) / float(cell_width))), 1)
+    n_rows = max(int(np.ceil((y_max - y_min) / float(cell_height))), 1)
+
+    arcpy.AddMessage('Creating fishnet cells')
+    if clip:
+        in_study_area = np.zeros((n_rows, n_cols), dtype=bool)
+        for rings in _polygonRings(in_features, where_clause=where_clause, sr=sr):
+            rows, cols = _cellsInPolygon(rings, x_min, y_min, cell_width, cell_height,
+                                         n_rows, n_cols)
+            in_study_area[rows, cols] = True
+        rows, cols = np.nonzero(in_study_area)
+    else:
+        rows, cols = np.divmod(np.arange(n_rows * n_cols), n_cols)
+
+    fishnet = np.empty(len(rows), dtype=np.dtype([
+        ("CELL_ID", "<i4"), ("ROW", "<i4"), ("COL", "<i4"),
+        ("XMin", "<f8"), ("YMin", "<f8"), ("XMax", "<f8"), ("YMax", "<f8"),
+        ("SHAPE@X", "<f8"), ("SHAPE@Y", "<f8")
+    ]))
+    fishnet["CELL_ID"] = rows * n_cols + cols + 1
+    fishnet["ROW"] = rows
+    fishnet["COL"] = cols
+    fishnet["XMin"] = x_min + cols * cell_width
+    fishnet["YMin"] = y_min + rows * cell_height
+    fishnet["XMax"] = fishnet["XMin"] + cell_width
+    fishnet["YMax"] = fishnet["YMin"] + cell_height
+    fishnet["SHAPE@X"] = fishnet["XMin"] + cell_width / 2.0
+    fishnet["SHAPE@Y"] = fishnet["YMin"] + cell_height / 2.0
+    return fishnet
+
+
+def fishnetRings(fishnet):
+    """(cells, 5, 2) array of closed polygon rings (clockwise from the lower-left corner) for a
+        fishnet array from numpyFishnet"""
+    xs = np.column_stack([fishnet["XMin"], fishnet["XMin"], fishnet["XMax"], fishnet["XMax"], fishnet["XMin"]])
+    ys = np.column_stack([fishnet["YMin"], fishnet["YMax"], fishnet["YMax"], fishnet["YMin"], fishnet["YMin"]])
+    return np.dstack([xs, ys])
+
+
+def fishnetToFeatureClass(fishnet, output_fc, sr, geometry_type="POLYGON"):
+    """write a fishnet array from numpyFishnet to a feature class of cell polygons or
+        center points (geometry_type="POINT")"""
+    if arcpy.Exists(output_fc):
+        arcpy.Delete_management(output_fc)
+    if geometry_type == "POINT":
+        arcpy.da.NumPyArrayToFeatureClass(fishnet, output_fc, ["SHAPE@X", "SHAPE@Y"],
+                                          spatial_reference=sr)
+        return output_fc
+    out_ws, out_name = output_fc.rsplit('\\', 1)
+    arcpy.CreateFeatureclass_management(out_ws, out_name, "POLYGON", spatial_reference=sr)
     arcpy.AddField_management(output_fc, "CELL_ID", "LONG")
-    cell_id = 1
-    with arcpy.da.UpdateCursor(output_fc, "CELL_ID") as c:
-        for r in c:
-            r[0] = cell_id
-            c.updateRow(r)
-            cell_id += 1
+    with arcpy.da.InsertCursor(output_fc, ["CELL_ID", "SHAPE@"]) as c:
+        for cell_id, ring in zip(fishnet["CELL_ID"], fishnetRings(fishnet)):
+            polygon = arcpy.Polygon(arcpy.Array([arcpy.Point(x, y) for x, y in ring]), sr)
+            c.insertRow([int(cell_id), polygon])
     return output_fc
 
 
@@ -0,0 +1,139 @@
+'''
+Compiled kernels
+
+Order-dependent allocation loops that cannot be vectorized without changing
+results, written over plain numpy arrays so they can be compiled with numba:
+
+    fillSegments: the running segment control decrement of
+        `allocation.allocate_dict`
+    treeAdd, treeTotal, treeFind: a Fenwick tree (built by `treeBuild`) of recipient
+        weights for the weighted recipient draws of `SmartAlloc._allocateValues`,
+        updating one recipient's weight and drawing a recipient in O(log n)
+
+If numba is installed (`NUMBA` is True) the kernels are compiled on first use
+(and cached next to this file where it is writable). Without numba they are
+ordinary Python functions with the same results; where a caller has a
+vectorized numpy path (`fillSegments`) it uses that instead, which is faster
+than the uncompiled loop.
+'''
+
+import numpy as np
+
+try:
+    import numba
+    NUMBA = True
+except ImportError:
+    numba = None
+    NUMBA = False
+
+
+def jit(func):
+    '''compile `func` with numba (nopython mode) if it is installed; otherwise return it as is'''
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+def _fillSegments(seg_idx, caps, controls):
+    '''
+    seg_idx: (n,) int array
+        Segment position (row in `controls`) of each recipient, recipients in
+        allocation order (grouped by segment, suitability descending)
+    caps: (n, k) int64 array
+        Capacity of each recipient for each activity
+    controls: (s, k) int64 array
+        Control total of each segment for each activity (not modified)
+
+    Returns an (n, k) int64 array of allocated values, visiting recipients in
+    order and decrementing their segment's controls exactly as `allocate_dict`
+    does (including negative capacities and controls).
+    '''
+    alloc = np.zeros(caps.shape, dtype=np.int64)
+    remaining = controls.copy()
+    for i in range(caps.shape[0]):
+        s = seg_idx[i]
+        for j in range(caps.shape[1]):
+            control = remaining[s, j]
+            cap = caps[i, j]
+            # skip exhausted controls and recipients without capacity
+            if control == 0 or cap == 0:
+                continue
+            updated = control - cap
+            if updated < 0:
+                # the control cannot cover the full capacity: allocate the remainder
+                cap += updated
+                updated = 0
+            remaining[s, j] = updated
+            alloc[i, j] = cap
+    return alloc
+
+
+fillSegments = jit(_fillSegments)
+
+
+def treeBuild(weights):
+    '''
+    weights: (n,) float array
+        Non-negative weight of each recipient
+
+    Returns a Fenwick (binary indexed) tree of `weights`: an (n + 1,) array in
+    which position i (1-based) holds the sum of the weights of recipients
+    i - (i & -i) + 1 through i. Built from the cumulative sum in O(n) (no
+    compilation needed); see `treeAdd` and `treeFind`.
+    '''
+    cumu = np.r_[0.0, np.cumsum(np.asarray(weights, dtype=np.float64))]
+    i = np.arange(1, len(cumu))
+    return np.r_[0.0, cumu[i] - cumu[i - (i & -i)]]
+
+
+def _treeAdd(tree, idx, delta):
+    '''add `delta` to the weight of recipient `idx` (0-based) in O(log n)'''
+    n = len(tree) - 1
+    i = idx + 1
+    while i <= n:
+        tree[i] += delta
+        i += i & -i
+
+
+treeAdd = jit(_treeAdd)
+
+
+def _treeTotal(tree):
+    '''sum of all weights in the tree, in O(log n)'''
+    total = 0.0
+    i = len(tree) - 1
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+
+treeTotal = jit(_treeTotal)
+
+
+def _treeFind(tree, target):
+    '''
+    tree: (n + 1,) float array
+        Fenwick tree from `treeBuild`
+    target: Number
+        Value in [0, total weight)
+
+    Returns the first recipient (0-based) whose cumulative weight exceeds
+    `target`, in O(log n). With `target` = u * total for a uniform draw u,
+    recipients are drawn with probability proportional to their weights.
+    '''
+    n = len(tree) - 1
+    step = 1
+    while step * 2 <= n:
+        step *= 2
+    pos = 0
+    while step > 0:
+        nxt = pos + step
+        if nxt <= n and tree[nxt] <= target:
+            pos = nxt
+            target -= tree[nxt]
+        step //= 2
+    return min(pos, n - 1)
+
+
+treeFind = jit(_treeFind)
@@ -0,0 +1,56 @@
+'''
+Lazy imports
+
+Stand-ins for modules that are slow to import or not always installed
+(arcpy in particular). A `LazyModule` imports the real module the first time
+one of its attributes is used, so modules that only need arcpy for reading and
+writing tables can be imported for their numeric functions without ArcGIS:
+
+    from LazyImport import arcpy
+
+    def tableCount(table):
+        return int(arcpy.GetCount_management(table).getOutput(0))
+
+Module level code must not touch the stand-in (that would import the module
+right away).
+'''
+
+import importlib
+
+
+class LazyModule(object):
+    '''
+    name: String
+        Name of the module to import on first use
+    '''
+
+    def __init__(self, name):
+        self.__dict__["_lazyName"] = name
+        self.__dict__["_lazyModule"] = None
+
+    def _lazyLoad(self):
+        if self._lazyModule is None:
+            try:
+                module = importlib.import_module(self._lazyName)
+            except ImportError as e:
+                raise ImportError(
+                    "{} is required for this operation but could not be imported: {}".format(
+                        self._lazyName, e))
+            self.__dict__["_lazyModule"] = module
+        return self._lazyModule
+
+    def __getattr__(self, attr):
+        return getattr(self._lazyLoad(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazyLoad(), attr, value)
+
+    def __dir__(self):
+        return dir(self._lazyLoad())
+
+    def __repr__(self):
+        state = "loaded" if self._lazyModule is not None else "not loaded"
+        return "<lazy module '{}' ({})>".format(self._lazyName, state)
+
+
+arcpy = LazyModule("arcpy")
@@ -1,6 +1,7 @@
-import arcpy as ap
+from LazyImport import arcpy as ap
 import numpy as np
 import random
+import Kernels
 
 
 def TableToTableAllocation(control_table, control_id_field, control_total_fields,
@@ -91,7 +92,53 @@ def TableToTableAllocation(control_table, control_id_field, control_total_fields
 
     ap.da.NumPyArrayToTable(alloc_array, "{}\\{}_alloc.dbf".format(output_folder, allocation_name))
     ap.da.NumPyArrayToTable(unalloc_array, "{}\\{}_unalloc.dbf".format(output_folder, allocation_name))
-        
+
+
+def ArrayToArrayAllocation(control_rows, control_id_field, control_total_fields,
+                           recipient_rows, recipient_id_field, recipient_link_field,
+                           recipient_capacity_fields, recipient_suitability_fields,
+                           recipient_mix_fields=None, consumption_weights=None):
+    """in-memory version of TableToTableAllocation: control_rows and recipient_rows are
+        structured arrays (e.g., from arcpy.da.TableToNumPyArray) and the allocated and
+        unallocated arrays are returned rather than written to dbf tables"""
+    single_ctrl, control_total_fields = _adaptParameters(control_total_fields)
+    single_cap, recipient_capacity_fields = _adaptParameters(recipient_capacity_fields)
+    single_suit, recipient_suitability_fields = _adaptParameters(recipient_suitability_fields)
+    if consumption_weights is None:
+        consumption_weights = [1 for i in control_total_fields]
+    _confirmParameters(single_ctrl, control_total_fields,
+                       single_cap, recipient_capacity_fields,
+                       single_suit, recipient_suitability_fields,
+                       recipient_mix_fields, consumption_weights)
+
+    #create results containers, matching TableToTableAllocation's output schema
+    alloc_dt_list = [(recipient_link_field, _idDType(recipient_rows, recipient_link_field)),
+                     (recipient_id_field, _idDType(recipient_rows, recipient_id_field))]
+    alloc_dt_list += [(ctf, "<i4") for ctf in control_total_fields]
+    unalloc_dt_list = [(control_id_field, _idDType(recipient_rows, recipient_link_field))]
+    unalloc_dt_list += [(ctf, "<i4") for ctf in control_total_fields]
+
+    #promote integer recipient fields to floats so capacities can be diminished by weights
+    recipient_rows = np.array(recipient_rows, dtype=np.dtype([(cname, ctype) if ctype != '<i4' else (cname, "<f8")
+                                                              for cname, ctype in recipient_rows.dtype.descr]))
+    all_allocated = []
+    all_unallocated = []
+    for control_row in control_rows:
+        control_id = control_row[control_id_field]
+        control_totals_dict = dict(zip(control_total_fields, [control_row[i] for i in control_total_fields]))
+        this_recipients = recipient_rows[recipient_rows[recipient_link_field] == control_id]
+        this_alloc, this_unalloc = _allocateValues(control_id, control_totals_dict, control_total_fields,
+                                                   this_recipients, recipient_id_field, recipient_capacity_fields,
+                                                   recipient_suitability_fields, recipient_mix_fields,
+                                                   consumption_weights,
+                                                   single_ctrl, single_cap, single_suit)
+        all_allocated += this_alloc
+        all_unallocated += this_unalloc
+
+    alloc_array = np.array(all_allocated, dtype=np.dtype(alloc_dt_list))
+    unalloc_array = np.array(all_unallocated, dtype=np.dtype(unalloc_dt_list))
+    return alloc_array, unalloc_array
+
 
 def _allocateValues(control_id, control_totals, control_total_fields,
                     recipient_rows, recipient_id_field, recipient_capacity_fields,
@@ -106,6 +153,32 @@ def _allocateValues(control_id, control_totals, control_total_fields,
                      for field in recipient_capacity_fields])
     total_suit = sum([sum(recipient_rows[field])
                           for field in recipient_suitability_fields])
+
+    #capacity state as a dense (recipients x capacity fields) matrix, updated one row per allocation
+    capacity = np.column_stack([recipient_rows[field] for field in recipient_capacity_fields]).astype(float)
+    has_capacity = capacity >= 1
+    consumption = _consumptionMatrix(consumption_weights, single_cap)
+
+    #eligibility bitmap: one column per activity flagging recipients with capacity and suitability for it.
+    # suitability does not change, so only the allocated recipient's row needs to be refreshed
+    suitability = np.column_stack([recipient_rows[field] for field in recipient_suitability_fields]).astype(float)
+    if single_ctrl or single_suit:
+        #criteria fields will be the suitability fields: one draw over the recipients eligible for any
+        # activity still being allocated, scored by their total suitability
+        scores = suitability.sum(axis=1)[:, np.newaxis]
+        is_suitable = np.repeat((suitability > 0).any(axis=1)[:, np.newaxis], len(control_total_fields), axis=1)
+    else:
+        #criteria fields will be based on the suitability for the activity being allocated
+        scores = suitability
+        is_suitable = suitability > 0
+    if single_cap:
+        activity_cap_cols = [0 for field in control_total_fields]
+    else:
+        activity_cap_cols = range(len(control_total_fields))
+    eligible = has_capacity[:, activity_cap_cols] & is_suitable
+    active_fields = set(control_totals.keys())
+    draws = _EligibleDraw(scores, _drawEligibility(eligible, control_total_fields, control_totals,
+                                                   single_ctrl or single_suit))
     count=-1
     chex=0
 
@@ -134,29 +207,19 @@ def _allocateValues(control_id, control_totals, control_total_fields,
                 activity = activity_row['activity']
                 allocation_idx = control_total_fields.index(activity)
 
-        #get valid recipient rows | CAPACITY
+        #get valid recipient rows | CAPACITY and SUITABILITY
         if single_ctrl or single_suit:
-            #fetch recipient rows where any capacity field is greater than 1
-            valid_cap_rows = _fetchValidRecipients(recipient_rows, [recipient_capacity_fields[i] for i in xrange(len(control_total_fields))
-                                                                   if control_total_fields[i] in control_totals.keys()], 1, True)
-        elif single_cap:
-            #fetch recipient rows where the capacity field is greater than 1
-            valid_cap_rows = _fetchValidRecipients(recipient_rows, recipient_capacity_fields, 1, True)
+            #recipients eligible for any activity still being allocated
+            if active_fields != set(control_totals.keys()):
+                active_fields = set(control_totals.keys())
+                draws.reset(_drawEligibility(eligible, control_total_fields, control_totals, True))
+            draw_col = 0
         else:
-            #fetch recipient rows that have capacity for the activity being allocated
-            valid_cap_rows = _fetchValidRecipients(recipient_rows, [recipient_capacity_fields[allocation_idx]], 1, True)
-
-        #get value recipient rows | SUITABILITY
-        if single_ctrl or single_suit:
-            #criteria fields will be the suitability fields
-            score_fields = recipient_suitability_fields            
-        else:
-            #criteria fields will be based on the suitability for the activity being allocated
-            score_fields = [recipient_suitability_fields[allocation_idx]]
-        valid_rows = _fetchValidRecipients(valid_cap_rows, score_fields, 0)
+            #recipients eligible for the activity being allocated
+            draw_col = allocation_idx
 
         #select a row for allocation
-        if len(valid_rows) == 0:
+        if draws.counts[draw_col] == 0:
             #if there are no rows to allocate to, report allocation progress and unallocated remnant
             if single_ctrl or single_suit:
                 if activity != '_unknown':
@@ -170,11 +233,11 @@ def _allocateValues(control_id, control_totals, control_total_fields,
                 del control_totals[activity]
                 continue
         else:
-            allocation_row = _selectRandomRowFromArray(valid_rows, score_fields)
-            
+            allocation_row_idx = draws.draw(draw_col)
+
         #get allocation row
+        allocation_row = recipient_rows[allocation_row_idx]
         recipient_id = allocation_row[recipient_id_field]
-        allocation_row_idx = np.where(recipient_rows[recipient_id_field] == recipient_id)[0][0]
         #if activity has not been determined yet, randomly choose activity now
         if activity == '_unknown':
             mix_indices = [control_total_fields.index(field) for field in control_total_fields if field in control_totals.keys()]
@@ -185,11 +248,13 @@ def _allocateValues(control_id, control_totals, control_total_fields,
             else:
                 chex +=1
                 search_rows = [(control_total_fields[i], allocation_row[recipient_mix_fields[i]]) for i in mix_indices
-                                if allocation_row[recipient_capacity_fields[i]] >=1
+                                if has_capacity[allocation_row_idx, i]
                                    and allocation_row[recipient_mix_fields[i]]>0]
                 if not search_rows:
-                    for recipient_capacity_field in recipient_capacity_fields:
-                        recipient_rows[allocation_row_idx][recipient_capacity_field] = 0
+                    capacity[allocation_row_idx] = 0
+                    has_capacity[allocation_row_idx] = False
+                    eligible[allocation_row_idx] = False
+                    draws.update(allocation_row_idx, np.zeros(draws.scores.shape[1], dtype=bool))
                     continue
             activity_row = _selectRandomRowFromArray(np.array(search_rows, dtype=dtype),["mix_value"])
             activity = activity_row['activity']                
@@ -206,32 +271,22 @@ def _allocateValues(control_id, control_totals, control_total_fields,
         unallocated_dict[activity] -= 1 #######increment?
 
         #update capacity
-        if single_ctrl:
-            if single_cap:
-                #there's only one capacity field that needs to be reduced
-                recipient_rows[allocation_row_idx][recipient_capacity_fields[0]] -=1
-            else:
-                #there are multiple capacity fields for a single control, randomly reduce one of them by the increment (1)
-                search_rows = zip(recipient_capacity_fields, [allocation_row[field] if allocation_row[field] >=1 else 0 #######>=increment?
-                                                                for field in recipient_capacity_fields])
-                reduction_field = _selectRandomRowFromArray(np.array(search_rows, dtype=np.dtype([("cap_field", "|S255"), ("cap_calue", '<f8')])),
-                                                                    ['cap_value'])['cap_field']
-                recipient_rows[allocation_row_idx][reduction_field] -= 1 ########increment?
+        if single_ctrl and not single_cap:
+            #there are multiple capacity fields for a single control, randomly reduce one of them by the increment (1)
+            search_rows = zip(recipient_capacity_fields, [value if value >=1 else 0 #######>=increment?
+                                                          for value in capacity[allocation_row_idx]])
+            reduction_field = _selectRandomRowFromArray(np.array(search_rows, dtype=np.dtype([("cap_field", "|S255"), ("cap_value", '<f8')])),
+                                                        ['cap_value'])['cap_field']
+            capacity[allocation_row_idx, recipient_capacity_fields.index(reduction_field)] -= 1 ########increment?
         else:
-            if single_cap:
-                #diminish total capacity based on the activity's consumption weight
-                consumption_weight = consumption_weights[allocation_idx]
-                diminish_qty = 1 * consumption_weight #######increment * consumption weight?
-                recipient_rows[allocation_row_idx][recipient_capacity_fields[0]] -= diminish_qty
-            else:
-                #reduce the capacity for the activity being allocated by the increment (1)
-                recipient_rows[allocation_row_idx][recipient_capacity_fields[allocation_idx]] -=1 ##### increment
-                #reduce capacities for each activity by the diminish_qty (increment * consumption weight)
-                for i in range(len(control_total_fields)):
-                    if i != allocation_idx:
-                        consumption_weight = consumption_weights[allocation_idx]/float(consumption_weights[i])
-                        diminish_qty = 1 * consumption_weight #######increment * consumption weight
-                        recipient_rows[allocation_row_idx][recipient_capacity_fields[i]] -= diminish_qty
+            #diminish the recipient's capacities by the increment (1) times the activity's row of
+            # consumption ratios (a single capacity field is diminished by the consumption weight)
+            capacity[allocation_row_idx] -= consumption[allocation_idx]
+        has_capacity[allocation_row_idx] = capacity[allocation_row_idx] >= 1
+        eligible[allocation_row_idx] = has_capacity[allocation_row_idx, activity_cap_cols] & is_suitable[allocation_row_idx]
+        draws.update(allocation_row_idx,
+                     _drawEligibility(eligible[allocation_row_idx:allocation_row_idx + 1], control_total_fields,
+                                      control_totals, single_ctrl or single_suit)[0])
 
     #when the loop is finished and all control totals have been allocated
     print "allocation complete for control area ({})".format(control_id)
@@ -240,6 +295,16 @@ def _allocateValues(control_id, control_totals, control_total_fields,
     return allocated, unallocated   
 
 
+def _idDType(array, field):
+    """output dtype for an id field, strings are stored as unicode like _makeAllocatedRows"""
+    dtype = array.dtype[field]
+    if dtype.kind == "U":
+        return "<U{}".format(dtype.itemsize // 4)
+    elif dtype.kind == "S":
+        return "<U{}".format(dtype.itemsize)
+    return "<f8"
+
+
 def _adaptParameters(input_param):
     """adapt input parameters to organize fields into a list format and have the allocation flag the status of single/multiple
         control totals, capacity fields, or suitability fields"""
@@ -280,6 +345,17 @@ def _confirmParameters(single_ctrl, control_total_fields,
                 raise ValueError("Input Error 0003: argument is not a list or unequal number of fields defining mix values and recipient control totals/capacities")
 
 
+def _consumptionMatrix(consumption_weights, single_cap):
+    """capacity consumed by allocating one unit of each activity: row i holds the reduction to each capacity
+        field when activity i is allocated. With a single capacity field this is the activity's consumption
+        weight; with one capacity field per activity it is consumption_weights[i]/consumption_weights[j]
+        (1 for the activity's own capacity)"""
+    weights = np.array(consumption_weights, dtype=float)
+    if single_cap:
+        return weights[:, np.newaxis]
+    return weights[:, np.newaxis] / weights[np.newaxis, :]
+
+
 def _makeUnallocatedRow(control_id, unallocated_dict, control_total_fields):    
     print "\tUNALLOCATED:"
     out_row =[control_id]
@@ -305,22 +381,52 @@ def _selectRandomRowFromArray(array, score_fields):
     weights = [sum(row[score_field] for score_field in score_fields)/total_score for row in array]
     return np.random.choice(array, p=weights)
 
-    
-def _fetchValidRecipients(recipient_rows, criteria_fields, criterion, inclusive=False):
-    if inclusive:
-        return np.take(recipient_rows,
-                       sorted({idx for field in criteria_fields
-                               for idx in np.where(recipient_rows[field] >= criterion)[0]}))
-    else:
-        return np.take(recipient_rows,
-                       sorted({idx for field in criteria_fields
-                               for idx in np.where(recipient_rows[field] > criterion)[0]}))
-
-
-
-
-
-
-
 
-            
+def _drawEligibility(eligible, control_total_fields, control_totals, single_draw):
+    """eligibility by draw column: the activity columns of the eligibility bitmap, or (single_draw) one column
+        flagging recipients eligible for any activity still being allocated"""
+    if not single_draw:
+        return eligible
+    activity_cols = [i for i in xrange(len(control_total_fields)) if control_total_fields[i] in control_totals]
+    return eligible[:, activity_cols].any(axis=1)[:, np.newaxis]
+
+
+class _EligibleDraw(object):
+    """weighted draws of eligible recipients: for each draw column (activity), a Fenwick tree of the scores of
+        the eligible recipients (see Kernels) and their count, updated one recipient at a time, so a draw
+        takes O(log n) with no copy or scan of the recipients"""
+
+    def __init__(self, scores, eligible):
+        self.scores = scores
+        self.reset(eligible)
+
+    def reset(self, eligible):
+        """rebuild the trees for a new (recipients x draw columns) eligibility matrix"""
+        self.eligible = eligible.copy()
+        self.weights = np.where(self.eligible, self.scores, 0.0)
+        self.counts = self.eligible.sum(axis=0)
+        self.trees = [Kernels.treeBuild(self.weights[:, j]) for j in xrange(self.weights.shape[1])]
+
+    def update(self, row, eligible_row):
+        """refresh one recipient's eligibility (a row of draw columns)"""
+        for j in np.flatnonzero(eligible_row != self.eligible[row]):
+            weight = self.scores[row, j] if eligible_row[j] else 0.0
+            Kernels.treeAdd(self.trees[j], row, weight - self.weights[row, j])
+            self.weights[row, j] = weight
+            self.counts[j] += 1 if eligible_row[j] else -1
+            self.eligible[row, j] = eligible_row[j]
+
+    def draw(self, col):
+        """draw an eligible recipient with probability proportional to its score, from one uniform draw of
+            the numpy generator (as np.random.choice takes)"""
+        u = np.random.random_sample()
+        for attempt in xrange(2):
+            total = Kernels.treeTotal(self.trees[col])
+            if not total > 0:
+                raise ValueError("eligible recipients have no suitability to draw from")
+            row = Kernels.treeFind(self.trees[col], u * total)
+            if self.weights[row, col] > 0:
+                return row
+            #rounding in the running tree sums landed on an ineligible recipient: rebuild the tree and redraw
+            self.trees[col] = Kernels.treeBuild(self.weights[:, col])
+        return row
@@ -3,7 +3,7 @@
 # 2017
 
 
-import arcpy
+from LazyImport import arcpy
 import uuid
 import HandyGP
 import numpy as np
@@ -15,6 +15,27 @@ import pandas as pd
 global METERS_PER_MILE, TECH_DEFAULTS, STATION_TYPE_DEFAULTS
 
 METERS_PER_MILE = 1609.3472186944375
+FEET_PER_MILE = 5280.0
+
+# distance to station and activities of grid cells distributed as arrays (see
+#  Station.distributeTargetsToCells), as in the dev area output tables
+_CELL_DTYPE = np.dtype(
+    [
+        ("DstToStn", "<f8"),
+        ("TOTAL_ACT", "<f8"),
+        ("RES", "<f8"),
+        ("NONRES", "<f8"),
+        ("JOB", "<f8"),
+        ("HOTEL", "<f8"),
+    ]
+)
+
+# station-to-station run time model (see `evaluateSpacing`): vehicles accelerate
+#  and brake at a constant rate between stops, up to a top speed set relative to
+#  the technology's target operating speed, and dwell at each intermediate station
+RUN_ACCELERATION = 2.2  # feet per second per second (1.5 mph/s), also used for braking
+RUN_TOP_SPEED_FACTOR = 1.5  # top speed as a multiple of the target operating speed
+RUN_DWELL_SECONDS = 30.0
 
 TECH_DEFAULTS = {
     "BRT": {
@@ -315,6 +336,14 @@ class Gradient(object):
                 weight = value_range[2]
         return weight
 
+    def interpWeights(self, in_values):
+        """interpWeight for an array of values"""
+        in_values = np.asarray(in_values, dtype=float)
+        weights = np.zeros(len(in_values))
+        for from_val, to_val, weight in self.value_ranges:
+            weights[(from_val <= in_values) & (in_values <= to_val)] = weight
+        return weights
+
 
 class Corridor(object):
     def __init__(self, technology, stations=[], sr=None):
@@ -420,10 +449,36 @@ class Corridor(object):
                     dev_area.hotel_activity *= hotel_factor
             station._updateTotalActivities()
 
-    def evaluateSpacingAndSpeed(self):
-        # use stations to determine speeds by station-to-station leg,
-        # average station spacing, etc.
-        pass
+    def stationCoordinates(self):
+        """(n, 2) array of station x, y coordinates (in `sr` units), in station order"""
+        xy = np.empty((len(self.stations), 2))
+        for i, station in enumerate(self.stations):
+            point = station.shape.projectAs(self.sr).centroid
+            xy[i] = point.X, point.Y
+        return xy
+
+    def evaluateSpacingAndSpeed(self, xy=None):
+        """use stations to determine spacing, flags and run times by station-to-station
+            leg, and the corridor's average spacing and operating speed (see
+            `evaluateSpacing`). `xy` may supply station coordinates (in `sr` units) for one
+            or more alternative station sets instead of the corridor's stations. Results
+            are returned and, for the corridor's own stations, kept as `spacing_eval`"""
+        try:
+            meters_per_unit = self.sr.metersPerUnit
+        except AttributeError:
+            # assume meters
+            meters_per_unit = 1.00
+        feet_per_unit = meters_per_unit * FEET_PER_MILE / METERS_PER_MILE
+        evaluation = evaluateSpacing(
+            self.stationCoordinates() if xy is None else xy,
+            self.spacing_short,
+            self.spacing_long,
+            self.speed_target,
+            feet_per_unit=feet_per_unit,
+        )
+        if xy is None:
+            self.spacing_eval = evaluation
+        return evaluation
 
     def summarizeStationActivities(self):
         self.station_res = sum([station.res_activity for station in self.stations])
@@ -443,6 +498,9 @@ class Station(object):
         self.shape = shape
         self.sr = sr
         self.dev_areas = []
+        # grid cells distributed as arrays (see distributeTargetsToCells)
+        self.cell_ids = None
+        self.cells = None
         self.res_activity = 0.0
         self.job_activity = 0.0
         self.hotel_activity = 0.0
@@ -524,17 +582,85 @@ class Station(object):
         # update station totals
         self.summarizeDevAreaActivities()
 
+    def distributeTargetsToCells(self, cell_ids, cell_x, cell_y, cell_areas, suitability=None):
+        """array version of distributeTargetsToDevAreas for grid cells given as arrays of ids,
+            center coordinates (in `sr` units), areas and (optionally) suitability scores, with
+            the same weights and distribution steps but no geometry or DevArea object per cell.
+            The results are kept in `cell_ids` and `cells`, a structured array of distance to
+            station and activities (fields of _CELL_DTYPE)"""
+        point = self.shape.projectAs(self.sr).centroid
+        dist = np.sqrt((cell_x - point.X) ** 2 + (cell_y - point.Y) ** 2)
+        n_cells = len(dist)
+        # gradient weights (density weights scale with cell area, see DevArea)
+        if self.station_type.density_gradient:
+            density_weight = self.station_type.density_gradient.interpWeights(dist) * cell_areas
+        else:
+            density_weight = np.zeros(n_cells)
+        if self.station_type.res_mix_gradient:
+            res_mix_weight = self.station_type.res_mix_gradient.interpWeights(dist)
+        else:
+            res_mix_weight = np.ones(n_cells)
+        if suitability is not None:
+            density_weight = density_weight * suitability
+        cells = np.zeros(n_cells, dtype=_CELL_DTYPE)
+        cells["DstToStn"] = dist
+        # focus on total activity
+        dist_array = _distribute(
+            self.station_type.totalActivityTarget(),
+            _valuesToNpArray("total_activity", np.zeros(n_cells), "density_weight", density_weight),
+            "total_activity",
+            "density_weight",
+        )
+        cells["TOTAL_ACT"] = dist_array["total_activity"]
+        # focus on res activity
+        dist_array = _distribute(
+            self.station_type.res_target,
+            _valuesToNpArray("res_activity", np.zeros(n_cells), "res_mix_weight", res_mix_weight,
+                             control_values=cells["TOTAL_ACT"]),
+            "res_activity",
+            "res_mix_weight",
+            control_attr="total_activity",
+        )
+        cells["RES"] = dist_array["res_activity"]
+        # focus on non_res activity
+        cells["NONRES"] = cells["TOTAL_ACT"] - cells["RES"]
+        # distribute hotel rooms
+        dist_array = _allocate(
+            self.station_type.hotel_target,
+            _valuesToNpArray("hotel_activity", np.zeros(n_cells), "nonres_activity", cells["NONRES"],
+                             control_values=cells["NONRES"]),
+            "hotel_activity",
+            "nonres_activity",
+            control_attr="nonres_activity",
+            min_value=self.station_type.min_hotel_size,
+        )
+        cells["HOTEL"] = dist_array["hotel_activity"]
+        # distribute jobs
+        cells["JOB"] = cells["NONRES"] - cells["HOTEL"]
+        self.cell_ids = np.asarray(cell_ids)
+        self.cells = cells
+        # update station totals
+        self.summarizeDevAreaActivities()
+
     def _updateTotalActivities(self):
         for dev_area in self.dev_areas:
             dev_area.nonres_activity = dev_area.hotel_activity + dev_area.job_activity
             dev_area.total_activity = dev_area.res_activity + dev_area.nonres_activity
+        if self.cells is not None:
+            self.cells["NONRES"] = self.cells["HOTEL"] + self.cells["JOB"]
+            self.cells["TOTAL_ACT"] = self.cells["RES"] + self.cells["NONRES"]
 
     def summarizeDevAreaActivities(self):
-        self.res_activity = sum([dev_area.res_activity for dev_area in self.dev_areas])
-        self.job_activity = sum([dev_area.job_activity for dev_area in self.dev_areas])
-        self.hotel_activity = sum(
-            [dev_area.hotel_activity for dev_area in self.dev_areas]
-        )
+        res = [dev_area.res_activity for dev_area in self.dev_areas]
+        job = [dev_area.job_activity for dev_area in self.dev_areas]
+        hotel = [dev_area.hotel_activity for dev_area in self.dev_areas]
+        if self.cells is not None:
+            res += self.cells["RES"].tolist()
+            job += self.cells["JOB"].tolist()
+            hotel += self.cells["HOTEL"].tolist()
+        self.res_activity = sum(res)
+        self.job_activity = sum(job)
+        self.hotel_activity = sum(hotel)
 
     def _convertToRow(self, name_type="TEXT"):
         self.summarizeDevAreaActivities()
@@ -606,6 +732,73 @@ class DevArea(object):
 
 # TOD CLASS HELPER FUNCTIONS
 # ----------------------------------------------------------------------------------------------
+def evaluateSpacing(
+        xy,
+        spacing_short,
+        spacing_long,
+        speed_target,
+        feet_per_unit=1.0,
+        acceleration=RUN_ACCELERATION,
+        top_speed_factor=RUN_TOP_SPEED_FACTOR,
+        dwell_seconds=RUN_DWELL_SECONDS,
+):
+    """station spacing and run time analytics for one or more station sets
+        - xy: (n, 2) array of ordered station coordinates, or (m, n, 2) for m alternative
+            sets of n stations each (sets with fewer stations may repeat their last station;
+            zero-length legs are ignored)
+        - spacing_short, spacing_long: technology spacing thresholds (feet)
+        - speed_target: technology target operating speed (mph)
+        - feet_per_unit: feet per coordinate unit
+
+        Each leg is run accelerating to the top speed (`top_speed_factor` x `speed_target`),
+        cruising and braking at `acceleration` (ft/s^2); legs too short to reach the top
+        speed accelerate to the midpoint and brake. Trips dwell `dwell_seconds` at each
+        intermediate station.
+
+        Returns a dict of arrays (leading axis m for batches):
+            - spacing: leg lengths (feet)
+            - too_short, too_long: legs outside the spacing thresholds
+            - run_time: leg run times, excluding dwell (seconds)
+            - length: corridor length (feet)
+            - mean_spacing: average leg length (feet)
+            - n_too_short, n_too_long: legs outside the spacing thresholds
+            - travel_time: end to end travel time, including dwell (seconds)
+            - avg_speed: average operating speed (mph)
+            - meets_speed: average operating speed at or above `speed_target`"""
+    xy = np.asarray(xy, dtype=float)
+    legs = np.diff(xy, axis=-2)
+    spacing = np.sqrt((legs ** 2).sum(axis=-1)) * feet_per_unit
+    valid = spacing > 0
+    # leg run times: cruise legs cover the acceleration and braking distance
+    #  (top_speed^2 / acceleration) with time to spare
+    top_speed = speed_target * top_speed_factor * FEET_PER_MILE / 3600.0
+    ramp = top_speed ** 2 / acceleration
+    run_time = np.where(
+        spacing >= ramp,
+        spacing / top_speed + top_speed / acceleration,
+        2.0 * np.sqrt(spacing / acceleration),
+    )
+    n_legs = valid.sum(axis=-1)
+    length = spacing.sum(axis=-1)
+    travel_time = run_time.sum(axis=-1) + np.maximum(n_legs - 1, 0) * dwell_seconds
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_spacing = length / n_legs
+        avg_speed = (length / FEET_PER_MILE) / (travel_time / 3600.0)
+    return {
+        "spacing": spacing,
+        "too_short": valid & (spacing < spacing_short),
+        "too_long": spacing > spacing_long,
+        "run_time": run_time,
+        "length": length,
+        "mean_spacing": mean_spacing,
+        "n_too_short": (valid & (spacing < spacing_short)).sum(axis=-1),
+        "n_too_long": (spacing > spacing_long).sum(axis=-1),
+        "travel_time": travel_time,
+        "avg_speed": avg_speed,
+        "meets_speed": avg_speed >= speed_target,
+    }
+
+
 def _distribute(total, array, sum_attr, weight_attr, control_attr=None, min_value=None):
     if control_attr:
         control_attr = "xx__CONTROL__xx"
@@ -685,6 +878,19 @@ def _devAreasToNpArray(
     return array
 
 
+def _valuesToNpArray(sum_attr, sum_values, weight_attr, weight_values, control_values=None):
+    """_devAreasToNpArray for values given as arrays (rows in cell order, without names)"""
+    dt_list = [(sum_attr, "<f8"), (weight_attr, "<f8")]
+    if control_values is not None:
+        dt_list.append(("xx__CONTROL__xx", "<f8"))
+    array = np.zeros(len(sum_values), dtype=np.dtype(dt_list))
+    array[sum_attr] = sum_values
+    array[weight_attr] = weight_values
+    if control_values is not None:
+        array["xx__CONTROL__xx"] = control_values
+    return array
+
+
 def _NpArrayToDevAreas(station_obj, array, sum_attr):
     keys = [dev_area.name for dev_area in station_obj.dev_areas]
     dev_areas_dict = dict(zip(keys, station_obj.dev_areas))
@@ -885,19 +1091,7 @@ def applyTODTemplates(
 ):
     # generate supporting objects
     fishnet_id_dtype = HandyGP._getFieldDType(fishnet_fc, fishnet_id)
-    arcpy.AddMessage("assembling TOD templates")
-    stations_fc, technologies, station_types, gradients = _generateTemplateReferences(
-        in_gdb
-    )
-    if not sr:
-        sr = arcpy.Describe(stations_fc).spatialReference
-    # set up corridor object
-    arcpy.AddMessage("creating corridor")
-    tech_obj = technologies[technology_name]
-    corridor = Corridor(tech_obj, sr=sr)
-    # add stations to corridor
-    arcpy.AddMessage("compiling station locations")
-    _addStationsToCorridor(corridor, stations_fc, station_types, technology_name, sr)
+    stations_fc, station_types, corridor, sr = _setupCorridor(in_gdb, technology_name, sr)
 
     # Create station area polygons
     #   set buffer field
@@ -976,25 +1170,122 @@ def applyTODTemplates(
         weight_by_area=weight_by_area,
     )
 
+    # apply targets and gradients, export outputs
+    _flag = ""
+    if network_dataset:
+        _flag = "_net"
+    _applyTargetsAndExport(corridor, in_gdb, fishnet_id, fishnet_id_dtype,
+                           use_suitability=bool(fishnet_suitability_field), flag=_flag)
+
+
+def applyTODTemplatesToFishnet(
+        in_gdb,
+        fishnet,
+        technology_name,
+        fishnet_id="CELL_ID",
+        fishnet_suitability_field=None,
+        sr=None,
+        weight_by_area=False,
+):
+    """apply TOD templates to an in-memory fishnet array (see HandyGP.numpyFishnet) rather than a
+        fishnet feature class. Station areas are not buffered and spatially joined: each cell is
+        assigned by its center to the station whose (non-overlapping) buffer contains it, where
+        overlapping buffers are split along the line through their intersection points like
+        HandyGP.multiRingBufferNoOverlap. `fishnet_suitability_field` is an optional field of
+        the fishnet array."""
+    fishnet_id_dtype = fishnet.dtype[fishnet_id].str
+    stations_fc, station_types, corridor, sr = _setupCorridor(in_gdb, technology_name, sr)
+
+    # create development areas for each station
+    arcpy.AddMessage("assigning fishnet cells to station areas")
+    station_idx = _assignCellsToStations(corridor.stations, fishnet["SHAPE@X"], fishnet["SHAPE@Y"], sr)
+    if weight_by_area:
+        cell_areas = (fishnet["XMax"] - fishnet["XMin"]) * (fishnet["YMax"] - fishnet["YMin"])
+    else:
+        cell_areas = np.ones(len(fishnet))
+    suitability = None
+    if fishnet_suitability_field:
+        suitability = np.nan_to_num(fishnet[fishnet_suitability_field].astype(float))
+    # cells are distributed as arrays (no geometry or DevArea object per cell)
+    cells = (station_idx, fishnet[fishnet_id], fishnet["SHAPE@X"], fishnet["SHAPE@Y"],
+             cell_areas, suitability)
+
+    # apply targets and gradients, export outputs
+    _applyTargetsAndExport(corridor, in_gdb, fishnet_id, fishnet_id_dtype,
+                           use_suitability=bool(fishnet_suitability_field), flag="_fishnet",
+                           cells=cells)
+
+
+def _setupCorridor(in_gdb, technology_name, sr=None):
+    arcpy.AddMessage("assembling TOD templates")
+    stations_fc, technologies, station_types, gradients = _generateTemplateReferences(
+        in_gdb
+    )
+    if not sr:
+        sr = arcpy.Describe(stations_fc).spatialReference
+    # set up corridor object
+    arcpy.AddMessage("creating corridor")
+    tech_obj = technologies[technology_name]
+    corridor = Corridor(tech_obj, sr=sr)
+    # add stations to corridor
+    arcpy.AddMessage("compiling station locations")
+    _addStationsToCorridor(corridor, stations_fc, station_types, technology_name, sr)
+    return stations_fc, station_types, corridor, sr
+
+
+def _assignCellsToStations(stations, cell_x, cell_y, sr):
+    """index of the station area containing each cell center (-1 if none). A cell belongs to the
+        station with the least power distance (squared distance less squared buffer) among stations
+        whose buffer contains it; cells are indexed by x so each station only scans its buffer's
+        extent"""
+    order = np.argsort(cell_x, kind="mergesort")
+    sorted_x = cell_x[order]
+    best_power = np.full(len(cell_x), np.inf)
+    station_idx = np.full(len(cell_x), -1, dtype=int)
+    for k, station in enumerate(stations):
+        radius = float(station.station_type.buffer_area)
+        point = station.shape.projectAs(sr).centroid
+        lo = np.searchsorted(sorted_x, point.X - radius, side="left")
+        hi = np.searchsorted(sorted_x, point.X + radius, side="right")
+        cells = order[lo:hi]
+        dist_sq = (cell_x[cells] - point.X) ** 2 + (cell_y[cells] - point.Y) ** 2
+        power = dist_sq - radius ** 2
+        better = (dist_sq <= radius ** 2) & (power < best_power[cells])
+        best_power[cells[better]] = power[better]
+        station_idx[cells[better]] = k
+    return station_idx
+
+
+def _applyTargetsAndExport(corridor, in_gdb, fishnet_id, fishnet_id_dtype,
+                           use_suitability=False, flag="", cells=None):
+    """distribute station targets and export the activity tables. Targets are distributed to the
+        stations' dev areas or, if `cells` (station index, ids, x, y, areas, suitability or None
+        by cell, see applyTODTemplatesToFishnet) are given, to the cells as arrays"""
+    if cells is not None:
+        station_idx, cell_ids, cell_x, cell_y, cell_areas, suitability = cells
+        # cells of each station, in cell order
+        order = np.argsort(station_idx, kind="mergesort")
+        bounds = np.searchsorted(station_idx[order], np.arange(len(corridor.stations) + 1))
     # apply targets and gradients for station areas
     arcpy.AddMessage("applying station area targets and gradients")
-    if fishnet_suitability_field:
-        use_suitability = True
-    else:
-        use_suitability = False
-    for station in corridor.stations:
+    for k, station in enumerate(corridor.stations):
         arcpy.AddMessage("...{}".format(station.name))
-        station.distributeTargetsToDevAreas(use_suitability=use_suitability)
+        if cells is None:
+            station.distributeTargetsToDevAreas(use_suitability=use_suitability)
+        else:
+            idx = order[bounds[k]:bounds[k + 1]]
+            station.distributeTargetsToCells(
+                cell_ids[idx], cell_x[idx], cell_y[idx], cell_areas[idx],
+                suitability=None if suitability is None else suitability[idx],
+            )
     # apply adjustments to meet corridor targets if needed
     arcpy.AddMessage("applying corridor-level adjustments")
     # corridor.adjustStationActivitiesToTargets()
 
     # export tables of activities for corridor, station areas, dev areas
     arcpy.AddMessage("exporting output tables")
-    _flag = ""
-    if network_dataset:
-        _flag = "_net"
-    if fishnet_suitability_field:
+    _flag = flag
+    if use_suitability:
         _flag = _flag + "_suit"
     corridor_sum_table = "{}\\corridor_activities{}".format(in_gdb, _flag)
     station_area_sum_table = "{}\\station_area_activities{}".format(in_gdb, _flag)
@@ -1016,15 +1307,24 @@ def applyTODTemplates(
     )
     corridor_dtype = np.dtype([("RES", "<f8"), ("JOB", "<f8"), ("HOTEL", "<f8")])
 
-    dev_area_rows = [
-        dev_area._convertToRow()
-        for station in corridor.stations
-        for dev_area in station.dev_areas
-    ]
+    if cells is None:
+        dev_area_rows = [
+            dev_area._convertToRow()
+            for station in corridor.stations
+            for dev_area in station.dev_areas
+        ]
+        dev_area_array = np.array(dev_area_rows, dev_area_dtype)
+    else:
+        station_cells = np.concatenate([station.cells for station in corridor.stations])
+        dev_area_array = np.zeros(len(station_cells), dev_area_dtype)
+        dev_area_array[str(fishnet_id)] = np.concatenate(
+            [station.cell_ids for station in corridor.stations]
+        )
+        for name in _CELL_DTYPE.names:
+            dev_area_array[name] = station_cells[name]
     station_area_rows = [station._convertToRow() for station in corridor.stations]
     corridor_rows = [corridor._convertToRow()]
 
-    dev_area_array = np.array(dev_area_rows, dev_area_dtype)
     station_area_array = np.array(station_area_rows, station_area_dtype)
     corridor_array = np.array(corridor_rows, corridor_dtype)
 
@@ -1390,7 +1690,7 @@ def adjustTargetsBasedOnExisting(
     ]
     df_stack = pd.concat(result_dfs)
     df_out = df_stack[[id_field, "HH_Target_PP", "Jobs_Target_PP", "Hotel_Target_PP"]]
-    array_out = np.array(df_out.to_records(index=False), dtype=np.dtype(dt_list))
+    array_out = HandyGP._makeArrayFromDf(df_out, np.dtype(dt_list))
     arcpy.da.NumPyArrayToTable(array_out, out_table)
 
 
@@ -1436,7 +1736,7 @@ def adjustTargetsBasedOnExisting2(
     df_stack = pd.concat(result_dfs)
     df_out_fields = [id_field] + out_fields
     df_out = df_stack[df_out_fields]
-    array_out = np.array(df_out.to_records(index=False), dtype=np.dtype(dt_list))
+    array_out = HandyGP._makeArrayFromDf(df_out, np.dtype(dt_list))
     arcpy.da.NumPyArrayToTable(array_out, out_table)
 
 def _adjustTargets(df, id_field, target_field, existing_field, result_field, depth=0):